@@ -1,21 +1,87 @@
 # Flask + SQLite Backend for Hydroponics Monitoring System
-from flask import Flask, request, jsonify, g, Response
+from flask import Flask, request, jsonify, g, Response, stream_with_context
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit, join_room, leave_room
+from socketio import KombuManager, RedisManager
 import sqlite3
 import json
 import time
 import os
+import io
+import gzip
+import hashlib
 import base64
-from datetime import datetime, timedelta
+import bisect
+import collections
+from datetime import datetime, timedelta, timezone
 import threading
+import queue
+import click
+import atexit
+import functools
+import heapq
+import struct
+import zlib
+from abc import ABC, abstractmethod
 import random
-from werkzeug.utils import secure_filename
+import re
+import shutil
+import sys
+import tempfile
+from werkzeug.utils import secure_filename, send_file
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'hydroponics_secret_key_2024'
 CORS(app, origins="*")
-socketio = SocketIO(app, cors_allowed_origins="*")
+
+# Socket.IO setup. `python app.py` runs one threaded process. server.py runs
+# several eventlet workers and sets HYDRO_MESSAGE_QUEUE (e.g.
+# redis://localhost:6379/0) so an emit from any process reaches clients
+# connected to every other one.
+ASYNC_MODE = os.environ.get('HYDRO_ASYNC_MODE', 'threading')
+MESSAGE_QUEUE = os.environ.get('HYDRO_MESSAGE_QUEUE')
+
+class LatestStateSyncMixin:
+    """Client-manager mixin that applies queued live updates to this process's latest_cache,
+    queued schedule changes to its schedule engine and queued device commands to its long-polls"""
+
+    def _handle_emit(self, message):
+        event = message.get('event')
+        kind = LIVE_KINDS.get(event)
+        data = message.get('data')
+        if kind and isinstance(data, dict) and data.get('full'):
+            latest_cache.set(kind, data['unit_id'], data['data'])
+        elif event in SCHEDULE_EVENTS and isinstance(data, dict):
+            schedule_engine.notify(event, data)
+        elif event == 'device_command' and isinstance(data, dict):
+            device_waiters.notify(data['unit_id'], data['id'])
+        super()._handle_emit(message)
+
+class LatestStateRedisManager(LatestStateSyncMixin, RedisManager):
+    pass
+
+class LatestStateKombuManager(LatestStateSyncMixin, KombuManager):
+    pass
+
+class InstrumentedSocketIO(SocketIO):
+    """SocketIO that counts the events this process emits"""
+
+    def emit(self, event, *args, **kwargs):
+        socketio_emits.inc(1, event)
+        return super().emit(event, *args, **kwargs)
+
+socketio_options = {}
+if MESSAGE_QUEUE:
+    manager_class = LatestStateRedisManager if MESSAGE_QUEUE.startswith(('redis://', 'rediss://')) else LatestStateKombuManager
+    socketio_options['client_manager'] = manager_class(MESSAGE_QUEUE, channel='flask-socketio')
+socketio = InstrumentedSocketIO(app, cors_allowed_origins="*", async_mode=ASYNC_MODE, **socketio_options)
 
 # Configuration
 DATABASE = 'hydroponics.db'
@@ -28,18 +94,380 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Metrics
+#
+# GET /metrics answers in the Prometheus text format. Counters and histograms
+# are plain in-process tallies updated under a lock (a bisect and a few
+# additions per observation); values owned by other objects - queue depths,
+# pool and engine counters - are read only when scraped. Every process keeps
+# its own figures, so each server.py worker and the jobs process is scraped
+# separately. Request latency is measured per route template up to the
+# response headers; a streamed export's body is counted in export bytes.
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5)
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def metric_labels(names, values, extra=''):
+    """Format a label set, e.g. {route="/units/<unit_id>/relays",le="0.1"}"""
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Counter:
+    """Monotonic count per label set"""
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {} if labels else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name + metric_labels(self.labels, key), value) for key, value in self._values.items()]
+
+class Gauge(Counter):
+    """Value per label set that goes up and down"""
+    kind = 'gauge'
+
+    def dec(self, amount=1, *labels):
+        self.inc(-amount, *labels)
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label set"""
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [count per bucket..., count above the last bucket, sum]
+        self._series = {} if labels else {(): [0] * (len(buckets) + 1) + [0.0]}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            series = {key: list(counts) for key, counts in self._series.items()}
+        samples = []
+        for key, counts in series.items():
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                total += count
+                le = bound if bound == '+Inf' else f'{bound:g}'
+                samples.append((self.name + '_bucket' + metric_labels(self.labels, key, f'le="{le}"'), total))
+            samples.append((self.name + '_sum' + metric_labels(self.labels, key), counts[-1]))
+            samples.append((self.name + '_count' + metric_labels(self.labels, key), total))
+        return samples
+
+class CallbackMetric:
+    """Counter or gauge read from `function` at scrape time: a number, or {label values: number}"""
+
+    def __init__(self, name, help, kind, function, labels=()):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labels = labels
+        self.function = function
+
+    def samples(self):
+        values = self.function()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [(self.name + metric_labels(self.labels, key), value) for key, value in values.items()]
+
+class MetricsRegistry:
+    """The metrics /metrics reports, in registration order"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Text exposition format 0.0.4"""
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                print(f"Metric {metric.name} failed: {e}")
+                continue
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(f'{name} {value}' for name, value in samples)
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry()
+http_request_seconds = metrics.add(Histogram(
+    'hydro_http_request_duration_seconds', 'Time to produce a response, by route template',
+    HTTP_BUCKETS, ('method', 'route')))
+http_requests = metrics.add(Counter(
+    'hydro_http_requests_total', 'Responses sent, by route template and status', ('method', 'route', 'status')))
+db_query_seconds = metrics.add(Histogram(
+    'hydro_db_query_seconds', 'SQLite execute, executemany and commit time', DB_BUCKETS, ('operation',)))
+db_lock_wait_seconds = metrics.add(Histogram(
+    'hydro_db_lock_wait_seconds', 'Time SQLite write transactions waited for the write lock', DB_BUCKETS))
+socketio_clients = metrics.add(Gauge(
+    'hydro_socketio_clients', 'Socket.IO clients connected to this process'))
+socketio_emits = metrics.add(Counter(
+    'hydro_socketio_emits_total', 'Socket.IO events emitted by this process', ('event',)))
+export_bytes = metrics.add(Counter(
+    'hydro_export_bytes_total', 'Bytes streamed by the export endpoints', ('format',)))
+simulator_loop_seconds = metrics.add(Histogram(
+    'hydro_simulator_loop_seconds', 'Duration of one sensor simulator pass', HTTP_BUCKETS))
+metrics.add(CallbackMetric(
+    'hydro_ingest_queue_depth', 'Sensor rows waiting for the ingest writer', 'gauge', lambda: ingest_queue.depth()))
+metrics.add(CallbackMetric(
+    'hydro_ingest_queue_capacity', 'Rows the ingest queue holds before answering 503', 'gauge', lambda: INGEST_QUEUE_SIZE))
+metrics.add(CallbackMetric(
+    'hydro_ingest_rows_written_total', 'Sensor rows committed by the ingest writer', 'counter',
+    lambda: ingest_queue.rows_written))
+metrics.add(CallbackMetric(
+    'hydro_db_pool_connections', 'Pooled SQLite connections by state', 'gauge',
+    lambda: {(state,): count for state, count in db_pool.snapshot().items() if state in ('in_use', 'idle')},
+    ('state',)))
+metrics.add(CallbackMetric(
+    'hydro_schedule_transitions_total', 'Schedule transitions applied by the engine in this process', 'counter',
+    lambda: schedule_engine.transitions))
+metrics.add(CallbackMetric(
+    'hydro_thumbnail_queue_depth', 'Uploads waiting for thumbnails', 'gauge', lambda: thumbnail_workers.depth()))
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        http_request_seconds.observe(time.perf_counter() - started, request.method, route)
+        http_requests.inc(1, request.method, route, response.status_code)
+    return response
+
+# Database connections
+#
+# Opening a connection and re-preparing statements cost more than most of
+# the queries here, so connections are pooled: get_db() borrows an idle one
+# for the app context and close_db() hands it back, keeping sqlite3's
+# per-connection statement cache warm. Every connection gets DB_PRAGMAS; WAL
+# lets readers run while the ingest writer or the simulator commits. Under
+# eventlet each greenlet borrows its own connection the same way.
+DB_POOL_SIZE = 16                   # idle connections kept; 0 disables pooling
+DB_STATEMENT_CACHE = 256            # prepared statements cached per connection
+DB_PRAGMAS = (
+    'auto_vacuum = INCREMENTAL',    # must precede WAL to apply to a new database
+    'journal_mode = WAL',
+    'synchronous = NORMAL',
+    'busy_timeout = 5000',
+    'cache_size = -16384',          # KiB
+    'mmap_size = 268435456',
+)
+
+# A write that starts a transaction opens it with BEGIN IMMEDIATE, which
+# takes the write lock up front (as the write would have at once anyway); the
+# time that takes is the wait behind other writers
+WRITE_STATEMENT = re.compile(r'\s*(INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3 connection that records statement time and write-lock waits in the metrics"""
+
+    def _begin_write(self, sql):
+        if not self.in_transaction and self.isolation_level is not None and WRITE_STATEMENT.match(sql):
+            started = time.perf_counter()
+            super().execute('BEGIN IMMEDIATE')
+            db_lock_wait_seconds.observe(time.perf_counter() - started)
+
+    def execute(self, sql, parameters=()):
+        self._begin_write(sql)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            db_query_seconds.observe(time.perf_counter() - started, 'execute')
+
+    def executemany(self, sql, parameters):
+        self._begin_write(sql)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            db_query_seconds.observe(time.perf_counter() - started, 'executemany')
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            db_query_seconds.observe(time.perf_counter() - started, 'commit')
+
+# Slow-query log, off unless HYDRO_SLOW_QUERY_MS is set. Connections are then
+# SlowQueryConnections, which print any statement that takes at least that
+# many milliseconds (to its first row, not counting the write-lock wait) with
+# its EXPLAIN QUERY PLAN, and keep the newest SLOW_QUERY_LOG_SIZE for
+# GET /debug/slow-queries. Unset, connections are plain TimedConnections.
+SLOW_QUERY_MS = float(os.environ['HYDRO_SLOW_QUERY_MS']) if os.environ.get('HYDRO_SLOW_QUERY_MS') else None
+SLOW_QUERY_LOG_SIZE = 100
+slow_queries = collections.deque(maxlen=SLOW_QUERY_LOG_SIZE)
+
+def query_plan(db, sql, parameters):
+    """EXPLAIN QUERY PLAN of a statement as indented lines, or [] if it cannot be explained"""
+    try:
+        rows = sqlite3.Connection.execute(db, 'EXPLAIN QUERY PLAN ' + sql, parameters).fetchall()
+    except sqlite3.Error:
+        return []
+    depth = {0: -1}
+    lines = []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node] + detail)
+    return lines
+
+class SlowQueryConnection(TimedConnection):
+    """TimedConnection that logs statements slower than SLOW_QUERY_MS with their query plan"""
+
+    def execute(self, sql, parameters=()):
+        self._begin_write(sql)
+        started = time.perf_counter()
+        cursor = super().execute(sql, parameters)
+        self._log_if_slow(sql, parameters, time.perf_counter() - started)
+        return cursor
+
+    def executemany(self, sql, parameters):
+        # Only a list can be read again for the plan; a generator is used up
+        sample = parameters[0] if isinstance(parameters, (list, tuple)) and parameters else None
+        self._begin_write(sql)
+        started = time.perf_counter()
+        cursor = super().executemany(sql, parameters)
+        self._log_if_slow(sql, sample, time.perf_counter() - started)
+        return cursor
+
+    def _log_if_slow(self, sql, parameters, elapsed):
+        duration_ms = elapsed * 1000
+        if duration_ms < SLOW_QUERY_MS:
+            return
+        sql = ' '.join(sql.split())
+        plan = query_plan(self, sql, parameters) if parameters is not None else []
+        slow_queries.append({
+            'timestamp': int(time.time()),
+            'duration_ms': round(duration_ms, 2),
+            'sql': sql,
+            'params': repr(parameters)[:200],
+            'plan': plan
+        })
+        print(f"Slow query ({duration_ms:.1f} ms): {sql}" + ''.join(f"\n    {line}" for line in plan))
+
+class ConnectionPool:
+    """Thread-safe pool of configured SQLite connections"""
+
+    def __init__(self, size):
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+        self.stats = {'opened': 0, 'reused': 0, 'returned': 0, 'closed': 0, 'in_use': 0}
+
+    def target(self):
+        """Where connections point; idle ones for an old target are dropped"""
+        return DATABASE
+
+    def connect(self):
+        """Open a new connection with the standard pragmas (not tracked by the pool)"""
+        db = sqlite3.connect(DATABASE, check_same_thread=False, cached_statements=DB_STATEMENT_CACHE,
+                             factory=TimedConnection if SLOW_QUERY_MS is None else SlowQueryConnection)
+        db.row_factory = sqlite3.Row
+        for pragma in DB_PRAGMAS:
+            db.execute(f'PRAGMA {pragma}')
+        return db
+
+    def reset(self, db):
+        """Roll back anything a borrower left open"""
+        if db.in_transaction:
+            db.rollback()
+
+    def acquire(self):
+        """Borrow an idle connection to target(), opening one if none is free"""
+        target = self.target()
+        stale = []
+        db = None
+        with self._lock:
+            while self._idle:
+                path, candidate = self._idle.pop()
+                if path == target:
+                    db = candidate
+                    self.stats['reused'] += 1
+                    break
+                stale.append(candidate)
+            self.stats['in_use'] += 1
+            self.stats['closed'] += len(stale)
+            if db is None:
+                self.stats['opened'] += 1
+        for candidate in stale:
+            candidate.close()
+        return db if db is not None else self.connect()
+
+    def release(self, db):
+        """Return a borrowed connection, closing it if the pool is full"""
+        self.reset(db)
+        with self._lock:
+            self.stats['in_use'] -= 1
+            if len(self._idle) < self.size:
+                self._idle.append((self.target(), db))
+                self.stats['returned'] += 1
+                return
+            self.stats['closed'] += 1
+        db.close()
+
+    def snapshot(self):
+        """Pool counters plus the number of idle connections"""
+        with self._lock:
+            return {**self.stats, 'idle': len(self._idle), 'size': self.size}
+
+    def clear(self):
+        """Close every idle connection"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self.stats['closed'] += len(idle)
+        for _, db in idle:
+            db.close()
+
+db_pool = ConnectionPool(DB_POOL_SIZE)
+
 def get_db():
     """Get database connection"""
     if 'db' not in g:
-        g.db = sqlite3.connect(DATABASE)
-        g.db.row_factory = sqlite3.Row
+        g.db = db_pool.acquire()
     return g.db
 
 def close_db(error):
-    """Close database connection"""
+    """Return the database connections to their pools"""
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        db_pool.release(db)
+    g.pop('storage', None)
+    storage_db = g.pop('storage_db', None)
+    if storage_db is not None:
+        storage_pool.release(storage_db)
 
 @app.teardown_appcontext
 def close_db_handler(error):
@@ -47,7 +475,19 @@ def close_db_handler(error):
 
 def init_db():
     """Initialize database with tables"""
+    if STORAGE_URL:
+        storage = open_storage()
+        try:
+            storage.create_schema()
+        finally:
+            storage.close()
+        return
+
     with app.app_context():
+        # Pooled connections set auto_vacuum = INCREMENTAL (see DB_PRAGMAS)
+        # so retention can hand freed pages back to the OS. That only takes
+        # effect on a new database; `flask --app app run-retention
+        # --full-vacuum` converts an existing one.
         db = get_db()
 
         # Hydro Units table
@@ -77,7 +517,8 @@ def init_db():
             )
         ''')
 
-        # Relay states table
+        # Relay states table (superseded by relay_current and relay_events in
+        # migration 10, which empties it)
         db.execute('''
             CREATE TABLE IF NOT EXISTS relay_states (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -104,12 +545,6 @@ def init_db():
             )
         ''')
 
-        # Add control_mode column if it doesn't exist (for existing databases)
-        try:
-            db.execute('ALTER TABLE schedules ADD COLUMN control_mode TEXT DEFAULT "timer"')
-        except sqlite3.OperationalError:
-            # Column already exists
-            pass
 
         # Room sensors table
         db.execute('''
@@ -169,15 +604,7 @@ def init_db():
         ''')
 
         # Insert default hydro units
-        units = [
-            ('DWC1', 'Deep Water Culture 1', 'DWC'),
-            ('DWC2', 'Deep Water Culture 2', 'DWC'),
-            ('NFT', 'Nutrient Film Technique', 'NFT'),
-            ('AERO', 'Aeroponic System', 'Aeroponic'),
-            ('TROUGH', 'Trough Based System', 'Trough')
-        ]
-
-        for unit in units:
+        for unit in DEFAULT_UNITS:
             db.execute('INSERT OR IGNORE INTO hydro_units (unit_id, name, type) VALUES (?, ?, ?)', unit)
 
         # Insert default AC schedule (24 hours)
@@ -188,20 +615,2268 @@ def init_db():
 
         db.commit()
 
+        # Bring the schema up to date
+        run_migrations(db)
+
+# Schema migrations
+#
+# Each migration is (version, description, function). Migrations run in
+# order inside a transaction and the applied version is recorded in the
+# schema_migrations table, so every migration runs exactly once per database.
+# Append new migrations to the end of the list; never renumber existing ones.
+
+def _column_exists(db, table, column):
+    """Check whether a table already has a column"""
+    return any(row['name'] == column for row in db.execute(f'PRAGMA table_info({table})'))
+
+def _migration_schedule_control_mode(db):
+    """Add control_mode to schedules created before the column existed"""
+    if not _column_exists(db, 'schedules', 'control_mode'):
+        db.execute("ALTER TABLE schedules ADD COLUMN control_mode TEXT DEFAULT 'timer'")
+
+def _migration_latest_reading_indexes(db):
+    """Index (unit_id, timestamp) / (camera_id, timestamp) for latest-row lookups"""
+    db.execute('CREATE INDEX IF NOT EXISTS idx_sensor_readings_unit_ts ON sensor_readings (unit_id, timestamp)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_relay_states_unit_ts ON relay_states (unit_id, timestamp)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_room_sensors_unit_ts ON room_sensors (unit_id, timestamp)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_camera_images_camera_ts ON camera_images (camera_id, timestamp)')
+    # Export range scans filter on timestamp alone
+    db.execute('CREATE INDEX IF NOT EXISTS idx_sensor_readings_ts ON sensor_readings (timestamp)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_camera_images_ts ON camera_images (timestamp)')
+
+def _migration_climate_readings(db):
+    """Move sensor_readings.climate_data JSON blobs into the climate_readings table"""
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS climate_readings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            reading_id INTEGER NOT NULL,
+            unit_id TEXT NOT NULL,
+            timestamp INTEGER NOT NULL,
+            position TEXT NOT NULL,
+            temp REAL,
+            humidity INTEGER,
+            FOREIGN KEY (reading_id) REFERENCES sensor_readings (id)
+        )
+    ''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_climate_readings_reading ON climate_readings (reading_id)')
+    # Covering index so range aggregates are answered from the index alone
+    db.execute('CREATE INDEX IF NOT EXISTS idx_climate_readings_unit_ts ON climate_readings (unit_id, timestamp, position, temp, humidity)')
+
+    cursor = db.execute('''
+        SELECT id, unit_id, timestamp, climate_data FROM sensor_readings
+        WHERE climate_data IS NOT NULL
+    ''')
+    while True:
+        readings = cursor.fetchmany(1000)
+        if not readings:
+            break
+        rows = []
+        for reading in readings:
+            try:
+                climate = json.loads(reading['climate_data'])
+            except ValueError:
+                continue
+            rows.extend(climate_rows(reading['id'], reading['unit_id'], reading['timestamp'], climate))
+        db.executemany(INSERT_CLIMATE_SQL, rows)
+
+    db.execute('UPDATE sensor_readings SET climate_data = NULL WHERE climate_data IS NOT NULL')
+
+def _migration_sensor_rollups(db):
+    """Create the 1m/1h/1d rollup table and fill it from existing readings"""
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS sensor_rollups (
+            resolution INTEGER NOT NULL,
+            unit_id TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            position TEXT NOT NULL DEFAULT '',
+            bucket INTEGER NOT NULL,
+            min_value REAL,
+            max_value REAL,
+            sum_value REAL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (resolution, unit_id, metric, position, bucket)
+        ) WITHOUT ROWID
+    ''')
+    backfill_rollups(db)
+
+def _migration_image_path_index(db):
+    """Index image_path so retention can tell orphaned files from referenced ones"""
+    db.execute('CREATE INDEX IF NOT EXISTS idx_camera_images_path ON camera_images (image_path)')
+
+def _migration_camera_last_image_path(db):
+    """Keep each camera's newest image path on camera_status so camera lists can link it"""
+    if not _column_exists(db, 'camera_status', 'last_image_path'):
+        db.execute('ALTER TABLE camera_status ADD COLUMN last_image_path TEXT')
+    db.execute('''
+        UPDATE camera_status SET last_image_path = (
+            SELECT image_path FROM camera_images ci
+            WHERE ci.camera_id = camera_status.camera_id
+            ORDER BY ci.timestamp DESC, ci.id DESC
+            LIMIT 1
+        )
+    ''')
+
+def _migration_image_blobs(db):
+    """Content hashes on camera_images and a reference count per stored file"""
+    if not _column_exists(db, 'camera_images', 'content_hash'):
+        db.execute('ALTER TABLE camera_images ADD COLUMN content_hash TEXT')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS image_blobs (
+            content_hash TEXT PRIMARY KEY,
+            file_size INTEGER,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_at INTEGER NOT NULL
+        )
+    ''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_camera_images_hash ON camera_images (content_hash)')
+
+def _migration_camera_latest_image(db):
+    """Point each camera_status row at its newest image row, with the camera's grid position"""
+    for column in ('level', 'position', 'last_image_id'):
+        if not _column_exists(db, 'camera_status', column):
+            db.execute(f'ALTER TABLE camera_status ADD COLUMN {column} INTEGER')
+    db.execute('''
+        UPDATE camera_status
+        SET (last_image_id, level, position, last_image_timestamp, last_image_path) = (
+            SELECT id, level, position, timestamp, image_path FROM camera_images ci
+            WHERE ci.camera_id = camera_status.camera_id
+            ORDER BY ci.timestamp DESC, ci.id DESC
+            LIMIT 1
+        )
+        WHERE EXISTS (SELECT 1 FROM camera_images ci WHERE ci.camera_id = camera_status.camera_id)
+    ''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_camera_status_unit_grid ON camera_status (unit_id, level, position)')
+
+def _migration_device_commands(db):
+    """Command log for unit devices and the newest command each device acknowledged"""
+    # AUTOINCREMENT: ids are device cursors and must never be reused after a purge
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS device_commands (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            unit_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            timestamp INTEGER NOT NULL
+        )
+    ''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_device_commands_unit ON device_commands (unit_id, id)')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS device_acks (
+            unit_id TEXT PRIMARY KEY,
+            command_id INTEGER NOT NULL,
+            acked_at INTEGER NOT NULL
+        )
+    ''')
+
+def _migration_relay_current_and_events(db):
+    """Split relay_states into a per-unit current state and a log of the relays that changed"""
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS relay_current (
+            unit_id TEXT PRIMARY KEY,
+            lights TEXT NOT NULL DEFAULT 'OFF',
+            fans TEXT NOT NULL DEFAULT 'OFF',
+            pump TEXT NOT NULL DEFAULT 'OFF',
+            timestamp INTEGER NOT NULL
+        )
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS relay_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            unit_id TEXT NOT NULL,
+            timestamp INTEGER NOT NULL,
+            relay TEXT NOT NULL,
+            state TEXT NOT NULL,
+            source TEXT
+        )
+    ''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_relay_events_unit_ts ON relay_events (unit_id, timestamp, id)')
+    db.execute('''
+        INSERT OR IGNORE INTO relay_current (unit_id, lights, fans, pump, timestamp)
+        SELECT unit_id, lights, fans, pump, timestamp FROM (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY unit_id ORDER BY timestamp DESC, id DESC) AS newest
+            FROM relay_states
+        )
+        WHERE newest = 1
+    ''')
+    # Each unit's first row, then only the relays that differ from the row before
+    db.execute('''
+        INSERT INTO relay_events (unit_id, timestamp, relay, state)
+        SELECT unit_id, timestamp, relay, state FROM (
+            SELECT id, unit_id, timestamp, relay, state,
+                   LAG(state) OVER (PARTITION BY unit_id, relay ORDER BY timestamp, id) AS previous
+            FROM (
+                SELECT id, unit_id, timestamp, 'lights' AS relay, lights AS state FROM relay_states
+                UNION ALL SELECT id, unit_id, timestamp, 'fans', fans FROM relay_states
+                UNION ALL SELECT id, unit_id, timestamp, 'pump', pump FROM relay_states
+            )
+        )
+        WHERE previous IS NOT state
+        ORDER BY timestamp, id
+    ''')
+    db.execute('DELETE FROM relay_states')
+
+def _migration_unique_sensor_readings(db):
+    """Keep one sensor reading per unit and timestamp, and make the (unit_id, timestamp) index unique"""
+    duplicates = db.execute('''
+        SELECT id, unit_id, timestamp FROM (
+            SELECT id, unit_id, timestamp,
+                   ROW_NUMBER() OVER (PARTITION BY unit_id, timestamp ORDER BY id) AS copy
+            FROM sensor_readings
+        )
+        WHERE copy > 1
+    ''').fetchall()
+    if duplicates:
+        ids = [(row['id'],) for row in duplicates]
+        db.executemany('DELETE FROM climate_readings WHERE reading_id = ?', ids)
+        db.executemany('DELETE FROM sensor_readings WHERE id = ?', ids)
+        # The copies were folded into the rollups as well; rebuild the buckets they touched
+        sources = [source for source in ROLLUP_SOURCES if source[0] != 'room_sensors']
+        metrics = sorted({metric for _, metric, _ in sources})
+        for resolution in ROLLUP_RESOLUTIONS.values():
+            for unit_id, bucket in {(row['unit_id'], row['timestamp'] - row['timestamp'] % resolution)
+                                    for row in duplicates}:
+                db.execute(f'''
+                    DELETE FROM sensor_rollups
+                    WHERE resolution = ? AND unit_id = ? AND bucket = ?
+                      AND metric IN ({', '.join('?' for _ in metrics)})
+                ''', [resolution, unit_id, bucket] + metrics)
+                rollup_from_raw(db, sources, bucket, bucket + resolution, resolutions=[resolution], unit_id=unit_id)
+    db.execute('DROP INDEX IF EXISTS idx_sensor_readings_unit_ts')
+    db.execute('CREATE UNIQUE INDEX idx_sensor_readings_unit_ts ON sensor_readings (unit_id, timestamp)')
+
+def _migration_client_timestamped_readings(db):
+    """Only deduplicate readings stamped by the device: add sensor_readings.client_timestamped
+    and include it in the unique (unit_id, timestamp) index"""
+    if not _column_exists(db, 'sensor_readings', 'client_timestamped'):
+        db.execute('ALTER TABLE sensor_readings ADD COLUMN client_timestamped INTEGER')
+    db.execute('DROP INDEX IF EXISTS idx_sensor_readings_unit_ts')
+    db.execute('''
+        CREATE UNIQUE INDEX idx_sensor_readings_unit_ts
+        ON sensor_readings (unit_id, timestamp, client_timestamped)
+    ''')
+
+MIGRATIONS = [
+    (1, 'schedules.control_mode column', _migration_schedule_control_mode),
+    (2, 'latest-reading composite indexes', _migration_latest_reading_indexes),
+    (3, 'normalized climate_readings table', _migration_climate_readings),
+    (4, 'sensor_rollups table', _migration_sensor_rollups),
+    (5, 'camera_images.image_path index for retention', _migration_image_path_index),
+    (6, 'camera_status.last_image_path column', _migration_camera_last_image_path),
+    (7, 'content-addressed image_blobs table', _migration_image_blobs),
+    (8, 'camera_status latest-image pointer', _migration_camera_latest_image),
+    (9, 'device_commands and device_acks tables', _migration_device_commands),
+    (10, 'relay_current state and relay_events log', _migration_relay_current_and_events),
+    (11, 'unique sensor reading per unit and timestamp', _migration_unique_sensor_readings),
+    (12, 'sensor_readings.client_timestamped in the unique index', _migration_client_timestamped_readings),
+]
+
+def get_schema_version(db):
+    """Get the highest applied migration version (0 for a fresh database)"""
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at INTEGER NOT NULL
+        )
+    ''')
+    row = db.execute('SELECT MAX(version) AS version FROM schema_migrations').fetchone()
+    return row['version'] or 0
+
+def run_migrations(db):
+    """Apply all pending migrations in order"""
+    current = get_schema_version(db)
+    db.commit()
+
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            db.execute('BEGIN')
+            migrate(db)
+            db.execute('''
+                INSERT INTO schema_migrations (version, description, applied_at)
+                VALUES (?, ?, ?)
+            ''', (version, description, int(time.time())))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        print(f"Applied schema migration {version}: {description}")
+
+    return get_schema_version(db)
+
+# Sensor readings storage
+#
+# Reservoir values live in sensor_readings; the per-position climate grid
+# (L11..L42 temp/humidity) lives in climate_readings, one row per position,
+# so it can be filtered and aggregated in SQL. Use insert_sensor_readings()
+# for every write so both tables and the rollups stay in step. A reading whose
+# timestamp came from the device (client_timestamped, batch uploads) is
+# stored once per unit and timestamp, so a replayed batch is skipped.
+# Server-stamped readings leave client_timestamped NULL; NULLs never collide
+# in the unique index, so two posts in the same second are both kept.
+#
+# Each reading is one sensor_readings row plus one climate_readings row per
+# position (8 for a full grid). Its values would touch 3 resolutions x 21
+# series of rollups, so a batch is summed per rollup bucket first and written
+# with one executemany: a flush of many readings from the same few units and
+# minutes costs about as many rollup UPSERTs as a single reading.
+INSERT_READING_SQL = '''
+    INSERT INTO sensor_readings
+    (unit_id, timestamp, ph, tds, turbidity, water_temp, water_level, client_timestamped)
+    VALUES (:unit_id, :timestamp, :ph, :tds, :turbidity, :water_temp, :water_level, :client_timestamped)
+    ON CONFLICT DO NOTHING
+'''
+
+INSERT_CLIMATE_SQL = '''
+    INSERT INTO climate_readings (reading_id, unit_id, timestamp, position, temp, humidity)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+def climate_rows(reading_id, unit_id, timestamp, climate):
+    """Flatten a climate dict ({"L11": {"temp": .., "humidity": ..}}) into climate_readings rows"""
+    rows = []
+    for position, values in climate.items():
+        if isinstance(values, dict):
+            rows.append((reading_id, unit_id, timestamp, position,
+                         values.get('temp'), values.get('humidity')))
+    return rows
+
+def insert_sensor_readings(db, rows):
+    """Insert reading dicts (reservoir fields plus a "climate" dict) and fold them into the
+    rollups; returns the rows stored, leaving out replayed device-stamped ones"""
+    stored = []
+    climate = []
+    samples = []
+    for row in rows:
+        params = {**row, 'client_timestamped': 1 if row.get('client_timestamped') else None}
+        cursor = db.execute(INSERT_READING_SQL, params)
+        if not cursor.rowcount:
+            continue
+        stored.append(row)
+        unit_id, timestamp = row['unit_id'], row['timestamp']
+        grid = row.get('climate') or {}
+        climate.extend(climate_rows(cursor.lastrowid, unit_id, timestamp, grid))
+        samples.extend((unit_id, timestamp, metric, '', row.get(metric)) for metric in READING_ROLLUP_METRICS)
+        for position, values in grid.items():
+            if isinstance(values, dict):
+                samples.append((unit_id, timestamp, 'temp', position, values.get('temp')))
+                samples.append((unit_id, timestamp, 'humidity', position, values.get('humidity')))
+    if climate:
+        db.executemany(INSERT_CLIMATE_SQL, climate)
+    update_rollups(db, samples)
+    return stored
+
+def insert_room_readings(db, rows):
+    """Insert room_sensors reading dicts and fold them into the rollups"""
+    db.executemany('''
+        INSERT INTO room_sensors
+        (unit_id, timestamp, temp, humidity, pressure, iaq, co2, ac_temp, ac_mode)
+        VALUES (:unit_id, :timestamp, :temp, :humidity, :pressure, :iaq, :co2, :ac_temp, :ac_mode)
+    ''', rows)
+    update_rollups(db, [(row['unit_id'], row['timestamp'], metric, '', row.get(metric))
+                        for row in rows for metric in ROOM_ROLLUP_METRICS])
+
+# Rollups
+#
+# sensor_rollups keeps min/max/sum/count per unit, metric (and climate
+# position) for 1-minute, 1-hour and 1-day buckets. The insert helpers above
+# fold each batch in, summed per bucket, with UPSERTs in the same transaction,
+# so rollups never lag the raw tables. Long-range history reads the coarsest rollup whose
+# resolution still fits the requested bucket width. `flask --app app
+# backfill-rollups` rebuilds them from the raw tables.
+ROLLUP_RESOLUTIONS = {'1m': 60, '1h': 3600, '1d': 86400}
+ROLLUP_NAMES = {seconds: name for name, seconds in ROLLUP_RESOLUTIONS.items()}
+READING_ROLLUP_METRICS = ['ph', 'tds', 'turbidity', 'water_temp', 'water_level']
+ROOM_ROLLUP_METRICS = ['temp', 'humidity', 'pressure', 'iaq', 'co2', 'ac_temp']
+
+UPSERT_ROLLUP_SQL = '''
+    INSERT INTO sensor_rollups
+    (resolution, unit_id, metric, position, bucket, min_value, max_value, sum_value, count)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (resolution, unit_id, metric, position, bucket) DO UPDATE SET
+        min_value = MIN(min_value, excluded.min_value),
+        max_value = MAX(max_value, excluded.max_value),
+        sum_value = sum_value + excluded.sum_value,
+        count = count + excluded.count
+'''
+
+def update_rollups(db, samples):
+    """Fold (unit_id, timestamp, metric, position, value) samples into every rollup resolution,
+    one UPSERT per bucket touched"""
+    buckets = {}
+    for unit_id, timestamp, metric, position, value in samples:
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            continue
+        for resolution in ROLLUP_RESOLUTIONS.values():
+            key = (resolution, unit_id, metric, position, timestamp - timestamp % resolution)
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = [value, value, value, 1]
+            else:
+                bucket[0] = min(bucket[0], value)
+                bucket[1] = max(bucket[1], value)
+                bucket[2] += value
+                bucket[3] += 1
+    if buckets:
+        db.executemany(UPSERT_ROLLUP_SQL, [key + tuple(bucket) for key, bucket in buckets.items()])
+
+ROLLUP_SOURCES = (
+    [('sensor_readings', metric, "''") for metric in READING_ROLLUP_METRICS] +
+    [('climate_readings', metric, 'position') for metric in ('temp', 'humidity')] +
+    [('room_sensors', metric, "''") for metric in ROOM_ROLLUP_METRICS]
+)
+
+def rollup_from_raw(db, sources, since, until=None, on_conflict='', resolutions=None, unit_id=None):
+    """Aggregate raw rows in [since, until) into sensor_rollups for the given sources
+    (every resolution and unit unless narrowed)"""
+    if until is None:
+        until = 2 ** 62
+    unit_filter = 'AND unit_id = ?' if unit_id is not None else ''
+    unit_params = (unit_id,) if unit_id is not None else ()
+    for resolution in resolutions or ROLLUP_RESOLUTIONS.values():
+        for table, metric, position in sources:
+            db.execute(f'''
+                INSERT INTO sensor_rollups
+                (resolution, unit_id, metric, position, bucket, min_value, max_value, sum_value, count)
+                SELECT ?, unit_id, ?, {position}, timestamp - timestamp % ?,
+                       MIN({metric}), MAX({metric}), SUM({metric}), COUNT({metric})
+                FROM {table}
+                WHERE {metric} IS NOT NULL AND timestamp >= ? AND timestamp < ? {unit_filter}
+                GROUP BY unit_id, {position}, timestamp - timestamp % ?
+                {on_conflict}
+            ''', (resolution, metric, resolution, since, until) + unit_params + (resolution,))
+
+def backfill_rollups(db, since=0):
+    """Rebuild rollups from raw rows at or after `since` (aligned down to a day)"""
+    since -= since % ROLLUP_RESOLUTIONS['1d']
+    db.execute('DELETE FROM sensor_rollups WHERE bucket >= ?', (since,))
+    rollup_from_raw(db, ROLLUP_SOURCES, since)
+
+def retention_covers(days, start_time, now):
+    """True if data from start_time on is still kept under a retention of `days`"""
+    return days is None or start_time >= retention_cutoff(days, now)
+
+def pick_rollup_resolution(bucket_seconds, start_time, raw_table=None, now=None):
+    """Return the rollup resolution to serve buckets of bucket_seconds from, or None for raw.
+
+    The coarsest resolution not wider than bucket_seconds is used while its
+    retention still covers start_time. Past that, raw rows are used if
+    raw_table still holds them, else the finest rollup that does."""
+    now = int(now or time.time())
+    fitting = [r for r in ROLLUP_RESOLUTIONS.values() if r <= bucket_seconds]
+    if not fitting:
+        return None
+    kept = [seconds for name, seconds in ROLLUP_RESOLUTIONS.items()
+            if retention_covers(ROLLUP_RETENTION_DAYS.get(name), start_time, now)]
+    if set(fitting) & set(kept):
+        return max(set(fitting) & set(kept))
+    if raw_table and retention_covers(RETENTION_DAYS.get(raw_table), start_time, now):
+        return None
+    return min(kept) if kept else None
+
+def rollup_bucket_seconds(bucket_seconds, resolution):
+    """Round a bucket width up to a whole number of rollup buckets, so none straddles two"""
+    return -(-bucket_seconds // resolution) * resolution
+
+@app.cli.command('backfill-rollups')
+@click.option('--since', default=0, type=int, help='Only rebuild buckets from this unix timestamp on')
+def backfill_rollups_command(since):
+    """Rebuild sensor_rollups from the raw reading tables"""
+    with app.app_context():
+        db = get_db()
+        backfill_rollups(db, since)
+        db.commit()
+        count = db.execute('SELECT COUNT(*) FROM sensor_rollups').fetchone()[0]
+    click.echo(f"Rollups rebuilt: {count} buckets")
+
+def load_climate(db, reading_id):
+    """Rebuild the climate dict for one sensor reading"""
+    rows = db.execute('''
+        SELECT position, temp, humidity FROM climate_readings
+        WHERE reading_id = ?
+        ORDER BY position
+    ''', (reading_id,)).fetchall()
+    return {r['position']: {"temp": r['temp'], "humidity": r['humidity']} for r in rows}
+
+# Storage backends
+#
+# Readings, relay states, schedules, room sensors and camera metadata go
+# through a Storage object rather than inline SQL, so the app can run on
+# SQLite (the default) or PostgreSQL/TimescaleDB. Set HYDRO_STORAGE_URL to a
+# postgresql:// URL to use the latter; install `psycopg[binary]` for it.
+# History, climate summaries, exports and retention still query SQLite
+# directly and answer 501 on PostgreSQL. Route handlers use get_storage();
+# background threads open their own with open_storage(). Writes are not
+# committed until commit(). Storage is an abstract base class, so a backend
+# missing a method fails as soon as it is created; `python check_storage.py`
+# runs the shared conformance checks against either backend.
+STORAGE_URL = os.environ.get('HYDRO_STORAGE_URL')
+
+DEFAULT_UNITS = [
+    ('DWC1', 'Deep Water Culture 1', 'DWC'),
+    ('DWC2', 'Deep Water Culture 2', 'DWC'),
+    ('NFT', 'Nutrient Film Technique', 'NFT'),
+    ('AERO', 'Aeroponic System', 'Aeroponic'),
+    ('TROUGH', 'Trough Based System', 'Trough')
+]
+
+class Storage(ABC):
+    """Interface shared by the storage backends.
+
+    Readings are dicts shaped like the ingest rows (a sensor reading carries
+    its climate dict under "climate"); latest_* return the API payloads
+    built by sensor_payload(), relay_payload() and room_payload(), or None.
+    """
+
+    @abstractmethod
+    def ping(self):
+        """Run a trivial query; raises if the database cannot be reached"""
+
+    @abstractmethod
+    def list_units(self):
+        """Active hydro units as dicts with unit_id, name and type, in creation order"""
+
+    @abstractmethod
+    def insert_sensor_readings(self, rows):
+        """Insert readings, skipping device-stamped ones whose unit already has one at that
+        timestamp; returns the rows inserted"""
+
+    @abstractmethod
+    def latest_sensor_reading(self, unit_id):
+        """The newest reading of a unit as a sensor_payload(), or None"""
+
+    @abstractmethod
+    def insert_room_readings(self, rows):
+        """Insert room_sensors readings"""
+
+    @abstractmethod
+    def latest_room_reading(self, room_id):
+        """The newest reading of a room as a room_payload(), or None"""
+
+    @abstractmethod
+    def set_relays(self, unit_id, timestamp, changes, source=None):
+        """Merge {relay: state} changes into the unit's current state with one UPSERT and log
+        the relays whose state actually changed. Returns the new relay payload."""
+
+    @abstractmethod
+    def latest_relay_state(self, unit_id):
+        """A unit's current relay states as a relay_payload(), or None"""
+
+    @abstractmethod
+    def relay_events(self, unit_id, limit, before=None, relay=None):
+        """A unit's relay changes as {id, timestamp, relay, state, source} dicts, newest first,
+        strictly older than the (timestamp, id) `before` cursor"""
+
+    @abstractmethod
+    def load_schedule(self, unit_id):
+        """A unit's active schedules merged into one dict, plus its _control_mode"""
+
+    @abstractmethod
+    def load_schedules(self):
+        """{unit_id: load_schedule(unit_id)} for every unit with an active schedule"""
+
+    @abstractmethod
+    def save_schedule(self, unit_id, data):
+        """Replace the unit's active schedule and switch it to timer mode"""
+
+    @abstractmethod
+    def set_control_mode(self, unit_id, mode):
+        """Switch a unit between timer and manual control"""
+
+    @abstractmethod
+    def load_ac_schedule(self):
+        """{hour: temperature} for the active AC schedule"""
+
+    @abstractmethod
+    def save_ac_schedule(self, ac_schedule):
+        """Replace the active AC schedule with {hour: temperature}"""
+
+    @abstractmethod
+    def record_camera_image(self, image):
+        """Store an image row (camera_id, unit_id, level, position, image_path,
+        timestamp, file_size, and optionally content_hash) and mark its camera
+        online. The camera's latest-image pointer moves to the new row unless
+        it already points at a newer one. A content_hash adds a reference to
+        its image_blobs row."""
+
+    @abstractmethod
+    def list_cameras(self, unit_id=None):
+        """camera_status rows for one unit or all units"""
+
+    @abstractmethod
+    def camera_images(self, camera_id, limit):
+        """A camera's newest image rows, newest first"""
+
+    @abstractmethod
+    def latest_camera_images(self, unit_id):
+        """The newest image of each camera in a unit, by level and position, from camera_status"""
+
+    @abstractmethod
+    def camera_version(self, unit_id=None, camera_id=None):
+        """(token, last image timestamp); the token changes with every upload in scope"""
+
+    @abstractmethod
+    def queue_device_command(self, unit_id, kind, data, timestamp):
+        """Append a command for the unit's device; returns its id"""
+
+    @abstractmethod
+    def device_commands(self, unit_id, since):
+        """The newest command of each kind with an id above `since`, as
+        {id, kind, timestamp, data} dicts in id order"""
+
+    @abstractmethod
+    def ack_device_command(self, unit_id, command_id, timestamp):
+        """Record that the device has every command up to command_id. Returns False
+        if the unit has no such command; an older ack than the last one is ignored."""
+
+    @abstractmethod
+    def last_acked_command(self, unit_id):
+        """The id the unit's device last acknowledged, or 0"""
+
+    def commit(self):
+        self.db.commit()
+
+    def rollback(self):
+        self.db.rollback()
+
+    def close(self):
+        self.db.close()
+
+class SQLiteStorage(Storage):
+    """Storage on the SQLite database at DATABASE"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def ping(self):
+        self.db.execute('SELECT 1').fetchone()
+
+    def list_units(self):
+        rows = self.db.execute('SELECT unit_id, name, type FROM hydro_units WHERE active = 1 ORDER BY rowid')
+        return [dict(row) for row in rows]
+
+    def insert_sensor_readings(self, rows):
+        return insert_sensor_readings(self.db, rows)
+
+    def latest_sensor_reading(self, unit_id):
+        row = self.db.execute('''
+            SELECT * FROM sensor_readings
+            WHERE unit_id = ?
+            ORDER BY timestamp DESC, id DESC
+            LIMIT 1
+        ''', (unit_id,)).fetchone()
+        return sensor_payload(row, load_climate(self.db, row['id'])) if row else None
+
+    def insert_room_readings(self, rows):
+        insert_room_readings(self.db, rows)
+
+    def latest_room_reading(self, room_id):
+        row = self.db.execute('''
+            SELECT * FROM room_sensors
+            WHERE unit_id = ?
+            ORDER BY timestamp DESC
+            LIMIT 1
+        ''', (room_id,)).fetchone()
+        return room_payload(row) if row else None
+
+    def set_relays(self, unit_id, timestamp, changes, source=None):
+        # The first of these writes takes the database's write lock, so the
+        # state compared against cannot change before the UPSERT
+        for relay in RELAY_NAMES:
+            if relay in changes:
+                self.db.execute(f'''
+                    INSERT INTO relay_events (unit_id, timestamp, relay, state, source)
+                    SELECT ?, ?, ?, ?, ?
+                    WHERE ? IS NOT COALESCE((SELECT {relay} FROM relay_current WHERE unit_id = ?), 'OFF')
+                ''', (unit_id, timestamp, relay, changes[relay], source, changes[relay], unit_id))
+        row = self.db.execute('''
+            INSERT INTO relay_current (unit_id, lights, fans, pump, timestamp)
+            VALUES (:unit_id, COALESCE(:lights, 'OFF'), COALESCE(:fans, 'OFF'), COALESCE(:pump, 'OFF'), :timestamp)
+            ON CONFLICT (unit_id) DO UPDATE SET
+                lights = COALESCE(:lights, relay_current.lights),
+                fans = COALESCE(:fans, relay_current.fans),
+                pump = COALESCE(:pump, relay_current.pump),
+                timestamp = MAX(relay_current.timestamp, excluded.timestamp)
+            RETURNING *
+        ''', {'unit_id': unit_id, 'timestamp': timestamp,
+              **{relay: changes.get(relay) for relay in RELAY_NAMES}}).fetchone()
+        return relay_payload(row)
+
+    def latest_relay_state(self, unit_id):
+        row = self.db.execute('SELECT * FROM relay_current WHERE unit_id = ?', (unit_id,)).fetchone()
+        return relay_payload(row) if row else None
+
+    def relay_events(self, unit_id, limit, before=None, relay=None):
+        sql = 'SELECT id, timestamp, relay, state, source FROM relay_events WHERE unit_id = ?'
+        params = [unit_id]
+        if before is not None:
+            sql += ' AND (timestamp, id) < (?, ?)'
+            params += before
+        if relay is not None:
+            sql += ' AND relay = ?'
+            params.append(relay)
+        sql += ' ORDER BY timestamp DESC, id DESC LIMIT ?'
+        return [dict(row) for row in self.db.execute(sql, params + [limit])]
+
+    def load_schedule(self, unit_id):
+        schedules = self.db.execute('''
+            SELECT * FROM schedules
+            WHERE unit_id = ? AND active = 1
+        ''', (unit_id,)).fetchall()
+
+        result = {}
+        control_mode = 'timer'
+
+        for schedule in schedules:
+            schedule_data = json.loads(schedule['schedule_data'])
+            result.update(schedule_data)
+            control_mode = schedule['control_mode'] if schedule['control_mode'] else 'timer'
+
+        result['_control_mode'] = control_mode
+        return result
+
+    def load_schedules(self):
+        schedules = {}
+        for schedule in self.db.execute('''
+            SELECT unit_id, schedule_data, control_mode FROM schedules
+            WHERE active = 1
+            ORDER BY id
+        '''):
+            result = schedules.setdefault(schedule['unit_id'], {})
+            result.update(json.loads(schedule['schedule_data']))
+            result['_control_mode'] = schedule['control_mode'] or 'timer'
+        return schedules
+
+    def save_schedule(self, unit_id, data):
+        # Deactivate old schedules
+        self.db.execute('UPDATE schedules SET active = 0 WHERE unit_id = ?', (unit_id,))
+
+        # Insert new schedule with timer control mode
+        self.db.execute('''
+            INSERT INTO schedules (unit_id, schedule_type, schedule_data, control_mode)
+            VALUES (?, ?, ?, ?)
+        ''', (unit_id, 'time_schedule', json.dumps(data), 'timer'))
+
+    def set_control_mode(self, unit_id, mode):
+        self.db.execute('''
+            UPDATE schedules
+            SET control_mode = ?
+            WHERE unit_id = ? AND active = 1
+        ''', (mode, unit_id))
+
+    def load_ac_schedule(self):
+        schedules = self.db.execute('''
+            SELECT hour, temperature FROM ac_schedules
+            WHERE active = 1
+            ORDER BY hour
+        ''').fetchall()
+        return {schedule['hour']: schedule['temperature'] for schedule in schedules}
+
+    def save_ac_schedule(self, ac_schedule):
+        for hour, temp in ac_schedule.items():
+            self.db.execute('''
+                UPDATE ac_schedules
+                SET temperature = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE hour = ?
+            ''', (temp, hour))
+
+    def record_camera_image(self, image):
+        image = {'content_hash': None, **image}
+        image['id'] = self.db.execute('''
+            INSERT INTO camera_images
+            (camera_id, unit_id, level, position, image_path, timestamp, file_size, content_hash)
+            VALUES (:camera_id, :unit_id, :level, :position, :image_path, :timestamp, :file_size, :content_hash)
+        ''', image).lastrowid
+
+        if image['content_hash']:
+            self.db.execute('''
+                INSERT INTO image_blobs (content_hash, file_size, refcount, created_at)
+                VALUES (:content_hash, :file_size, 1, :timestamp)
+                ON CONFLICT (content_hash) DO UPDATE SET refcount = refcount + 1
+            ''', image)
+
+        self.db.execute('''
+            INSERT INTO camera_status
+            (camera_id, unit_id, level, position, last_image_id, last_image_timestamp, last_image_path,
+             total_images, status, updated_at)
+            VALUES (:camera_id, :unit_id, :level, :position, :id, :timestamp, :image_path,
+                    1, 'online', CURRENT_TIMESTAMP)
+            ON CONFLICT (camera_id) DO UPDATE SET
+                total_images = total_images + 1,
+                status = 'online',
+                updated_at = CURRENT_TIMESTAMP
+        ''', image)
+        # Images can arrive out of order; the pointer only moves forward
+        self.db.execute('''
+            UPDATE camera_status
+            SET unit_id = :unit_id, level = :level, position = :position,
+                last_image_id = :id, last_image_timestamp = :timestamp, last_image_path = :image_path
+            WHERE camera_id = :camera_id
+              AND (last_image_id IS NULL OR (last_image_timestamp, last_image_id) < (:timestamp, :id))
+        ''', image)
+
+    def list_cameras(self, unit_id=None):
+        if unit_id is None:
+            rows = self.db.execute('''
+                SELECT camera_id, unit_id, last_image_timestamp, last_image_path, total_images, status
+                FROM camera_status
+                ORDER BY unit_id, camera_id
+            ''')
+        else:
+            rows = self.db.execute('''
+                SELECT camera_id, unit_id, last_image_timestamp, last_image_path, total_images, status
+                FROM camera_status
+                WHERE unit_id = ?
+                ORDER BY camera_id
+            ''', (unit_id,))
+        return [dict(row) for row in rows]
+
+    def camera_images(self, camera_id, limit):
+        rows = self.db.execute('''
+            SELECT id, camera_id, timestamp, image_path, file_size
+            FROM camera_images
+            WHERE camera_id = ?
+            ORDER BY timestamp DESC
+            LIMIT ?
+        ''', (camera_id, limit))
+        return [dict(row) for row in rows]
+
+    def latest_camera_images(self, unit_id):
+        rows = self.db.execute('''
+            SELECT camera_id, last_image_timestamp AS timestamp, last_image_path AS image_path, level, position
+            FROM camera_status
+            WHERE unit_id = ? AND last_image_id IS NOT NULL
+            ORDER BY level, position, camera_id
+        ''', (unit_id,))
+        return [dict(row) for row in rows]
+
+    def camera_version(self, unit_id=None, camera_id=None):
+        sql = 'SELECT COUNT(*), SUM(total_images), SUM(last_image_id), MAX(last_image_timestamp) FROM camera_status'
+        params = ()
+        if camera_id is not None:
+            sql += ' WHERE camera_id = ?'
+            params = (camera_id,)
+        elif unit_id is not None:
+            sql += ' WHERE unit_id = ?'
+            params = (unit_id,)
+        count, images, pointers, last_image = self.db.execute(sql, params).fetchone()
+        return f'{count}-{images}-{pointers}', last_image
+
+    def queue_device_command(self, unit_id, kind, data, timestamp):
+        return self.db.execute('''
+            INSERT INTO device_commands (unit_id, kind, payload, timestamp)
+            VALUES (?, ?, ?, ?)
+        ''', (unit_id, kind, json.dumps(data), timestamp)).lastrowid
+
+    def device_commands(self, unit_id, since):
+        rows = self.db.execute('''
+            SELECT id, kind, timestamp, payload FROM device_commands
+            WHERE id IN (
+                SELECT MAX(id) FROM device_commands
+                WHERE unit_id = ? AND id > ?
+                GROUP BY kind
+            )
+            ORDER BY id
+        ''', (unit_id, since))
+        return [{'id': row['id'], 'kind': row['kind'], 'timestamp': row['timestamp'],
+                 'data': json.loads(row['payload'])} for row in rows]
+
+    def ack_device_command(self, unit_id, command_id, timestamp):
+        known = self.db.execute('SELECT 1 FROM device_commands WHERE id = ? AND unit_id = ?',
+                                (command_id, unit_id)).fetchone()
+        if known is None:
+            return False
+        self.db.execute('''
+            INSERT INTO device_acks (unit_id, command_id, acked_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT (unit_id) DO UPDATE
+            SET command_id = excluded.command_id, acked_at = excluded.acked_at
+            WHERE excluded.command_id > device_acks.command_id
+        ''', (unit_id, command_id, timestamp))
+        return True
+
+    def last_acked_command(self, unit_id):
+        row = self.db.execute('SELECT command_id FROM device_acks WHERE unit_id = ?', (unit_id,)).fetchone()
+        return row['command_id'] if row else 0
+
+# PostgreSQL schema. The reading, relay and image tables become TimescaleDB
+# hypertables (7-day chunks on the integer timestamp) when the extension is
+# available; on plain PostgreSQL they are ordinary tables with the same
+# indexes. Climate grids are stored as JSONB on the reading row.
+POSTGRES_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS hydro_units (
+        id BIGSERIAL,
+        unit_id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        type TEXT NOT NULL,
+        active BOOLEAN NOT NULL DEFAULT TRUE,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    CREATE TABLE IF NOT EXISTS sensor_readings (
+        unit_id TEXT NOT NULL,
+        timestamp BIGINT NOT NULL,
+        ph DOUBLE PRECISION,
+        tds INTEGER,
+        turbidity INTEGER,
+        water_temp DOUBLE PRECISION,
+        water_level INTEGER,
+        climate JSONB NOT NULL DEFAULT '{}'
+    );
+    -- id orders readings that share a timestamp. One device-stamped reading
+    -- per unit and timestamp; server-stamped ones leave client_timestamped
+    -- NULL and never collide. Older databases had a plain or a fully unique
+    -- index under other names.
+    ALTER TABLE sensor_readings ADD COLUMN IF NOT EXISTS id BIGSERIAL;
+    ALTER TABLE sensor_readings ADD COLUMN IF NOT EXISTS client_timestamped SMALLINT;
+    DROP INDEX IF EXISTS idx_sensor_readings_unit_ts;
+    DROP INDEX IF EXISTS idx_sensor_readings_unit_ts_key;
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_sensor_readings_unit_ts_client
+        ON sensor_readings (unit_id, timestamp DESC, client_timestamped);
+    CREATE TABLE IF NOT EXISTS room_sensors (
+        unit_id TEXT NOT NULL,
+        timestamp BIGINT NOT NULL,
+        temp DOUBLE PRECISION,
+        humidity INTEGER,
+        pressure INTEGER,
+        iaq INTEGER,
+        co2 INTEGER,
+        ac_temp INTEGER,
+        ac_mode TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_room_sensors_unit_ts ON room_sensors (unit_id, timestamp DESC);
+    CREATE TABLE IF NOT EXISTS relay_current (
+        unit_id TEXT PRIMARY KEY,
+        lights TEXT NOT NULL DEFAULT 'OFF',
+        fans TEXT NOT NULL DEFAULT 'OFF',
+        pump TEXT NOT NULL DEFAULT 'OFF',
+        timestamp BIGINT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS relay_events (
+        id BIGSERIAL,
+        unit_id TEXT NOT NULL,
+        timestamp BIGINT NOT NULL,
+        relay TEXT NOT NULL,
+        state TEXT NOT NULL,
+        source TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_relay_events_unit_ts ON relay_events (unit_id, timestamp DESC, id DESC);
+    -- Move a relay_states table from before the split into relay_current and relay_events
+    DO $$
+    BEGIN
+        IF to_regclass(current_schema() || '.relay_states') IS NOT NULL THEN
+            INSERT INTO relay_current (unit_id, lights, fans, pump, timestamp)
+            SELECT DISTINCT ON (unit_id) unit_id, lights, fans, pump, timestamp FROM relay_states
+            ORDER BY unit_id, timestamp DESC, id DESC
+            ON CONFLICT (unit_id) DO NOTHING;
+            INSERT INTO relay_events (unit_id, timestamp, relay, state)
+            SELECT unit_id, timestamp, relay, state FROM (
+                SELECT r.id, r.unit_id, r.timestamp, change.relay, change.state,
+                       LAG(change.state) OVER (PARTITION BY r.unit_id, change.relay ORDER BY r.timestamp, r.id) AS previous
+                FROM relay_states r
+                CROSS JOIN LATERAL (VALUES ('lights', r.lights), ('fans', r.fans), ('pump', r.pump)) change (relay, state)
+            ) states
+            WHERE previous IS DISTINCT FROM state
+            ORDER BY timestamp, id;
+            DROP TABLE relay_states;
+        END IF;
+    END $$;
+    CREATE TABLE IF NOT EXISTS schedules (
+        id BIGSERIAL PRIMARY KEY,
+        unit_id TEXT NOT NULL,
+        schedule_type TEXT NOT NULL,
+        schedule_data JSONB NOT NULL,
+        active BOOLEAN NOT NULL DEFAULT TRUE,
+        control_mode TEXT NOT NULL DEFAULT 'timer',
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    CREATE INDEX IF NOT EXISTS idx_schedules_active_unit ON schedules (unit_id) WHERE active;
+    CREATE TABLE IF NOT EXISTS ac_schedules (
+        hour TEXT PRIMARY KEY,
+        temperature INTEGER NOT NULL,
+        active BOOLEAN NOT NULL DEFAULT TRUE,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    CREATE TABLE IF NOT EXISTS camera_images (
+        id BIGSERIAL,
+        camera_id TEXT NOT NULL,
+        unit_id TEXT NOT NULL,
+        level INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        image_path TEXT NOT NULL,
+        timestamp BIGINT NOT NULL,
+        file_size INTEGER,
+        content_hash TEXT,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    ALTER TABLE camera_images ADD COLUMN IF NOT EXISTS content_hash TEXT;
+    CREATE TABLE IF NOT EXISTS image_blobs (
+        content_hash TEXT PRIMARY KEY,
+        file_size INTEGER,
+        refcount INTEGER NOT NULL DEFAULT 0,
+        created_at BIGINT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_camera_images_camera_ts ON camera_images (camera_id, timestamp DESC);
+    CREATE INDEX IF NOT EXISTS idx_camera_images_unit_ts ON camera_images (unit_id, timestamp DESC);
+    CREATE TABLE IF NOT EXISTS camera_status (
+        camera_id TEXT PRIMARY KEY,
+        unit_id TEXT NOT NULL,
+        last_image_timestamp BIGINT,
+        last_image_path TEXT,
+        total_images INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'offline',
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    ALTER TABLE camera_status ADD COLUMN IF NOT EXISTS last_image_path TEXT;
+    ALTER TABLE camera_status ADD COLUMN IF NOT EXISTS level INTEGER;
+    ALTER TABLE camera_status ADD COLUMN IF NOT EXISTS position INTEGER;
+    ALTER TABLE camera_status ADD COLUMN IF NOT EXISTS last_image_id BIGINT;
+    CREATE INDEX IF NOT EXISTS idx_camera_status_unit ON camera_status (unit_id);
+    CREATE INDEX IF NOT EXISTS idx_camera_status_unit_grid ON camera_status (unit_id, level, position);
+    -- Point cameras from before the latest-image pointer at their newest image
+    UPDATE camera_status cs
+    SET last_image_id = latest.id, level = latest.level, position = latest.position,
+        last_image_timestamp = latest.timestamp, last_image_path = latest.image_path
+    FROM camera_status pending
+    CROSS JOIN LATERAL (
+        SELECT id, level, position, timestamp, image_path FROM camera_images ci
+        WHERE ci.camera_id = pending.camera_id
+        ORDER BY ci.timestamp DESC, ci.id DESC
+        LIMIT 1
+    ) latest
+    WHERE pending.last_image_id IS NULL AND cs.camera_id = pending.camera_id;
+    CREATE TABLE IF NOT EXISTS device_commands (
+        id BIGSERIAL PRIMARY KEY,
+        unit_id TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        payload JSONB NOT NULL,
+        timestamp BIGINT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_device_commands_unit ON device_commands (unit_id, id);
+    CREATE TABLE IF NOT EXISTS device_acks (
+        unit_id TEXT PRIMARY KEY,
+        command_id BIGINT NOT NULL,
+        acked_at BIGINT NOT NULL
+    );
+'''
+POSTGRES_HYPERTABLES = ['sensor_readings', 'room_sensors', 'relay_events', 'camera_images']
+POSTGRES_CHUNK_SECONDS = 7 * 86400
+
+def connect_postgres(url):
+    """Open a psycopg connection that returns rows as dicts"""
+    try:
+        import psycopg
+        from psycopg.rows import dict_row
+    except ImportError:
+        raise RuntimeError("PostgreSQL storage needs psycopg: pip install 'psycopg[binary]'")
+    return psycopg.connect(url, row_factory=dict_row)
+
+class PostgresConnectionPool(ConnectionPool):
+    """ConnectionPool of psycopg connections to STORAGE_URL"""
+
+    def target(self):
+        return STORAGE_URL
+
+    def connect(self):
+        return connect_postgres(STORAGE_URL)
+
+    def reset(self, db):
+        db.rollback()
+
+class PostgresStorage(Storage):
+    """Storage on PostgreSQL, with TimescaleDB hypertables when available"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def create_schema(self):
+        """Create tables, hypertables and default rows; safe to run repeatedly"""
+        self.db.execute(POSTGRES_SCHEMA)
+        timescale = self.db.execute(
+            "SELECT 1 FROM pg_available_extensions WHERE name = 'timescaledb'").fetchone()
+        if timescale:
+            self.db.execute('CREATE EXTENSION IF NOT EXISTS timescaledb')
+            for table in POSTGRES_HYPERTABLES:
+                self.db.execute('''
+                    SELECT create_hypertable(%s, 'timestamp', chunk_time_interval => %s,
+                                             if_not_exists => TRUE, migrate_data => TRUE)
+                ''', (table, POSTGRES_CHUNK_SECONDS))
+        with self.db.cursor() as cursor:
+            cursor.executemany('''
+                INSERT INTO hydro_units (unit_id, name, type) VALUES (%s, %s, %s)
+                ON CONFLICT (unit_id) DO NOTHING
+            ''', DEFAULT_UNITS)
+            cursor.executemany('''
+                INSERT INTO ac_schedules (hour, temperature) VALUES (%s, 24)
+                ON CONFLICT (hour) DO NOTHING
+            ''', [(f"{hour:02d}",) for hour in range(24)])
+        self.db.commit()
+        return bool(timescale)
+
+    def ping(self):
+        self.db.execute('SELECT 1').fetchone()
+
+    def list_units(self):
+        rows = self.db.execute('SELECT unit_id, name, type FROM hydro_units WHERE active ORDER BY id')
+        return rows.fetchall()
+
+    def insert_sensor_readings(self, rows):
+        from psycopg.types.json import Jsonb
+        params = []
+        for row in rows:
+            climate = {position: {"temp": values.get('temp'), "humidity": values.get('humidity')}
+                       for position, values in (row.get('climate') or {}).items()
+                       if isinstance(values, dict)}
+            params.append({**row, 'climate': Jsonb(climate),
+                           'client_timestamped': 1 if row.get('client_timestamped') else None})
+        with self.db.cursor() as cursor:
+            cursor.executemany('''
+                INSERT INTO sensor_readings
+                (unit_id, timestamp, ph, tds, turbidity, water_temp, water_level, climate, client_timestamped)
+                VALUES (%(unit_id)s, %(timestamp)s, %(ph)s, %(tds)s, %(turbidity)s,
+                        %(water_temp)s, %(water_level)s, %(climate)s, %(client_timestamped)s)
+                ON CONFLICT DO NOTHING
+                RETURNING 1
+            ''', params, returning=True)
+            # One result set per row; an empty one means the insert was skipped
+            inserted = []
+            for row in rows:
+                if cursor.fetchone():
+                    inserted.append(row)
+                cursor.nextset()
+            return inserted
+
+    def latest_sensor_reading(self, unit_id):
+        row = self.db.execute('''
+            SELECT * FROM sensor_readings
+            WHERE unit_id = %s
+            ORDER BY timestamp DESC, id DESC
+            LIMIT 1
+        ''', (unit_id,)).fetchone()
+        return sensor_payload(row, row['climate']) if row else None
+
+    def insert_room_readings(self, rows):
+        with self.db.cursor() as cursor:
+            cursor.executemany('''
+                INSERT INTO room_sensors
+                (unit_id, timestamp, temp, humidity, pressure, iaq, co2, ac_temp, ac_mode)
+                VALUES (%(unit_id)s, %(timestamp)s, %(temp)s, %(humidity)s, %(pressure)s,
+                        %(iaq)s, %(co2)s, %(ac_temp)s, %(ac_mode)s)
+            ''', rows)
+
+    def latest_room_reading(self, room_id):
+        row = self.db.execute('''
+            SELECT * FROM room_sensors
+            WHERE unit_id = %s
+            ORDER BY timestamp DESC
+            LIMIT 1
+        ''', (room_id,)).fetchone()
+        return room_payload(row) if row else None
+
+    def set_relays(self, unit_id, timestamp, changes, source=None):
+        # Concurrent changes to the same unit queue up on its row lock
+        self.db.execute('SELECT 1 FROM relay_current WHERE unit_id = %s FOR UPDATE', (unit_id,))
+        for relay in RELAY_NAMES:
+            if relay in changes:
+                self.db.execute(f'''
+                    INSERT INTO relay_events (unit_id, timestamp, relay, state, source)
+                    SELECT %s, %s, %s, %s, %s
+                    WHERE %s IS DISTINCT FROM COALESCE((SELECT {relay} FROM relay_current WHERE unit_id = %s), 'OFF')
+                ''', (unit_id, timestamp, relay, changes[relay], source, changes[relay], unit_id))
+        row = self.db.execute('''
+            INSERT INTO relay_current (unit_id, lights, fans, pump, timestamp)
+            VALUES (%(unit_id)s, COALESCE(%(lights)s, 'OFF'), COALESCE(%(fans)s, 'OFF'), COALESCE(%(pump)s, 'OFF'),
+                    %(timestamp)s)
+            ON CONFLICT (unit_id) DO UPDATE SET
+                lights = COALESCE(%(lights)s, relay_current.lights),
+                fans = COALESCE(%(fans)s, relay_current.fans),
+                pump = COALESCE(%(pump)s, relay_current.pump),
+                timestamp = GREATEST(relay_current.timestamp, excluded.timestamp)
+            RETURNING *
+        ''', {'unit_id': unit_id, 'timestamp': timestamp,
+              **{relay: changes.get(relay) for relay in RELAY_NAMES}}).fetchone()
+        return relay_payload(row)
+
+    def latest_relay_state(self, unit_id):
+        row = self.db.execute('SELECT * FROM relay_current WHERE unit_id = %s', (unit_id,)).fetchone()
+        return relay_payload(row) if row else None
+
+    def relay_events(self, unit_id, limit, before=None, relay=None):
+        sql = 'SELECT id, timestamp, relay, state, source FROM relay_events WHERE unit_id = %s'
+        params = [unit_id]
+        if before is not None:
+            sql += ' AND (timestamp, id) < (%s, %s)'
+            params += before
+        if relay is not None:
+            sql += ' AND relay = %s'
+            params.append(relay)
+        sql += ' ORDER BY timestamp DESC, id DESC LIMIT %s'
+        return self.db.execute(sql, params + [limit]).fetchall()
+
+    def load_schedule(self, unit_id):
+        schedules = self.db.execute('''
+            SELECT schedule_data, control_mode FROM schedules
+            WHERE unit_id = %s AND active
+            ORDER BY id
+        ''', (unit_id,)).fetchall()
+
+        result = {}
+        control_mode = 'timer'
+        for schedule in schedules:
+            result.update(schedule['schedule_data'])
+            control_mode = schedule['control_mode'] or 'timer'
+
+        result['_control_mode'] = control_mode
+        return result
+
+    def load_schedules(self):
+        schedules = {}
+        for schedule in self.db.execute('''
+            SELECT unit_id, schedule_data, control_mode FROM schedules
+            WHERE active
+            ORDER BY id
+        '''):
+            result = schedules.setdefault(schedule['unit_id'], {})
+            result.update(schedule['schedule_data'])
+            result['_control_mode'] = schedule['control_mode'] or 'timer'
+        return schedules
+
+    def save_schedule(self, unit_id, data):
+        from psycopg.types.json import Jsonb
+        self.db.execute('UPDATE schedules SET active = FALSE WHERE unit_id = %s', (unit_id,))
+        self.db.execute('''
+            INSERT INTO schedules (unit_id, schedule_type, schedule_data, control_mode)
+            VALUES (%s, %s, %s, %s)
+        ''', (unit_id, 'time_schedule', Jsonb(data), 'timer'))
+
+    def set_control_mode(self, unit_id, mode):
+        self.db.execute('''
+            UPDATE schedules
+            SET control_mode = %s
+            WHERE unit_id = %s AND active
+        ''', (mode, unit_id))
+
+    def load_ac_schedule(self):
+        schedules = self.db.execute('''
+            SELECT hour, temperature FROM ac_schedules
+            WHERE active
+            ORDER BY hour
+        ''').fetchall()
+        return {schedule['hour']: schedule['temperature'] for schedule in schedules}
+
+    def save_ac_schedule(self, ac_schedule):
+        with self.db.cursor() as cursor:
+            cursor.executemany('''
+                UPDATE ac_schedules
+                SET temperature = %s, updated_at = now()
+                WHERE hour = %s
+            ''', [(temp, hour) for hour, temp in ac_schedule.items()])
+
+    def record_camera_image(self, image):
+        image = {'content_hash': None, **image}
+        image['id'] = self.db.execute('''
+            INSERT INTO camera_images
+            (camera_id, unit_id, level, position, image_path, timestamp, file_size, content_hash)
+            VALUES (%(camera_id)s, %(unit_id)s, %(level)s, %(position)s, %(image_path)s,
+                    %(timestamp)s, %(file_size)s, %(content_hash)s)
+            RETURNING id
+        ''', image).fetchone()['id']
+        if image['content_hash']:
+            self.db.execute('''
+                INSERT INTO image_blobs (content_hash, file_size, refcount, created_at)
+                VALUES (%(content_hash)s, %(file_size)s, 1, %(timestamp)s)
+                ON CONFLICT (content_hash) DO UPDATE SET refcount = image_blobs.refcount + 1
+            ''', image)
+        self.db.execute('''
+            INSERT INTO camera_status
+            (camera_id, unit_id, level, position, last_image_id, last_image_timestamp, last_image_path,
+             total_images, status)
+            VALUES (%(camera_id)s, %(unit_id)s, %(level)s, %(position)s, %(id)s, %(timestamp)s, %(image_path)s,
+                    1, 'online')
+            ON CONFLICT (camera_id) DO UPDATE SET
+                total_images = camera_status.total_images + 1,
+                status = 'online',
+                updated_at = now()
+        ''', image)
+        self.db.execute('''
+            UPDATE camera_status
+            SET unit_id = %(unit_id)s, level = %(level)s, position = %(position)s,
+                last_image_id = %(id)s, last_image_timestamp = %(timestamp)s, last_image_path = %(image_path)s
+            WHERE camera_id = %(camera_id)s
+              AND (last_image_id IS NULL OR (last_image_timestamp, last_image_id) < (%(timestamp)s, %(id)s))
+        ''', image)
+
+    def list_cameras(self, unit_id=None):
+        if unit_id is None:
+            return self.db.execute('''
+                SELECT camera_id, unit_id, last_image_timestamp, last_image_path, total_images, status
+                FROM camera_status
+                ORDER BY unit_id, camera_id
+            ''').fetchall()
+        return self.db.execute('''
+            SELECT camera_id, unit_id, last_image_timestamp, last_image_path, total_images, status
+            FROM camera_status
+            WHERE unit_id = %s
+            ORDER BY camera_id
+        ''', (unit_id,)).fetchall()
+
+    def camera_images(self, camera_id, limit):
+        return self.db.execute('''
+            SELECT id, camera_id, timestamp, image_path, file_size
+            FROM camera_images
+            WHERE camera_id = %s
+            ORDER BY timestamp DESC
+            LIMIT %s
+        ''', (camera_id, limit)).fetchall()
+
+    def latest_camera_images(self, unit_id):
+        return self.db.execute('''
+            SELECT camera_id, last_image_timestamp AS timestamp, last_image_path AS image_path, level, position
+            FROM camera_status
+            WHERE unit_id = %s AND last_image_id IS NOT NULL
+            ORDER BY level, position, camera_id
+        ''', (unit_id,)).fetchall()
+
+    def camera_version(self, unit_id=None, camera_id=None):
+        sql = '''
+            SELECT COUNT(*) AS count, SUM(total_images) AS images,
+                   SUM(last_image_id) AS pointers, MAX(last_image_timestamp) AS last_image
+            FROM camera_status
+        '''
+        params = ()
+        if camera_id is not None:
+            sql += ' WHERE camera_id = %s'
+            params = (camera_id,)
+        elif unit_id is not None:
+            sql += ' WHERE unit_id = %s'
+            params = (unit_id,)
+        row = self.db.execute(sql, params).fetchone()
+        return f"{row['count']}-{row['images']}-{row['pointers']}", row['last_image']
+
+    def queue_device_command(self, unit_id, kind, data, timestamp):
+        from psycopg.types.json import Jsonb
+        return self.db.execute('''
+            INSERT INTO device_commands (unit_id, kind, payload, timestamp)
+            VALUES (%s, %s, %s, %s)
+            RETURNING id
+        ''', (unit_id, kind, Jsonb(data), timestamp)).fetchone()['id']
+
+    def device_commands(self, unit_id, since):
+        return self.db.execute('''
+            SELECT * FROM (
+                SELECT DISTINCT ON (kind) id, kind, timestamp, payload AS data
+                FROM device_commands
+                WHERE unit_id = %s AND id > %s
+                ORDER BY kind, id DESC
+            ) newest
+            ORDER BY id
+        ''', (unit_id, since)).fetchall()
+
+    def ack_device_command(self, unit_id, command_id, timestamp):
+        known = self.db.execute('SELECT 1 FROM device_commands WHERE id = %s AND unit_id = %s',
+                                (command_id, unit_id)).fetchone()
+        if known is None:
+            return False
+        self.db.execute('''
+            INSERT INTO device_acks (unit_id, command_id, acked_at)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (unit_id) DO UPDATE
+            SET command_id = excluded.command_id, acked_at = excluded.acked_at
+            WHERE excluded.command_id > device_acks.command_id
+        ''', (unit_id, command_id, timestamp))
+        return True
+
+    def last_acked_command(self, unit_id):
+        row = self.db.execute('SELECT command_id FROM device_acks WHERE unit_id = %s', (unit_id,)).fetchone()
+        return row['command_id'] if row else 0
+
+storage_pool = PostgresConnectionPool(DB_POOL_SIZE) if STORAGE_URL else None
+
+def get_storage():
+    """Get the storage backend for this app context"""
+    if 'storage' not in g:
+        if storage_pool is not None:
+            g.storage_db = storage_pool.acquire()
+            g.storage = PostgresStorage(g.storage_db)
+        else:
+            g.storage = SQLiteStorage(get_db())
+    return g.storage
+
+def open_storage():
+    """Open a storage backend on a dedicated connection; close() it when done"""
+    if STORAGE_URL:
+        return PostgresStorage(connect_postgres(STORAGE_URL))
+    return SQLiteStorage(db_pool.connect())
+
+def sqlite_only(view):
+    """Answer 501 from endpoints that still query SQLite directly when another backend is configured"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if STORAGE_URL:
+            return jsonify({'error': 'Not available with the PostgreSQL storage backend'}), 501
+        return view(*args, **kwargs)
+    return wrapper
+
+# Latest-state cache
+#
+# The dashboard polls for the newest reading of every unit, relay bank and
+# room. Those rows were just written by this process, so the writers publish
+# the response payload here and the GET handlers serve it without touching
+# SQLite. Entries older than LATEST_CACHE_TTL seconds are re-read from the
+# database, which bounds staleness when another process writes; such a writer
+# can also drop entries immediately via POST /cache/invalidate.
+LATEST_CACHE_TTL = 60
+
+class LatestStateCache:
+    """Thread-safe store of the latest payload per (kind, key)"""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, kind, key):
+        """Return a cached payload, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get((kind, key))
+        if entry is None:
+            return None
+        payload, cached_at = entry
+        if self.ttl and time.time() - cached_at > self.ttl:
+            return None
+        return payload
+
+    def set(self, kind, key, payload):
+        """Store a payload unless a newer, unexpired one is already cached"""
+        self.replace(kind, key, payload)
+
+    def replace(self, kind, key, payload):
+        """Like set(), but returns (stored, previous payload even if expired)"""
+        with self._lock:
+            entry = self._entries.get((kind, key))
+            previous = entry[0] if entry is not None else None
+            # An expired entry always gives way, so a database refill replaces
+            # a cached value newer than what the database holds
+            fresh = entry is not None and not (self.ttl and time.time() - entry[1] > self.ttl)
+            if fresh and previous['timestamp'] > payload['timestamp']:
+                return False, previous
+            self._entries[(kind, key)] = (payload, time.time())
+            return True, previous
+
+    def invalidate(self, kind=None, key=None):
+        """Drop one entry, every entry of a kind, or the whole cache"""
+        with self._lock:
+            if kind is None:
+                count = len(self._entries)
+                self._entries.clear()
+                return count
+            keys = [k for k in self._entries if k[0] == kind and (key is None or k[1] == key)]
+            for k in keys:
+                del self._entries[k]
+            return len(keys)
+
+latest_cache = LatestStateCache(LATEST_CACHE_TTL)
+
+# Live updates
+#
+# Each unit (and ROOM_FRONT / ROOM_BACK) has a Socket.IO room. A client that
+# sends join_unit gets a unit_snapshot with the full latest state; after that
+# every new reading is pushed to the room as only the fields that changed.
+# Writers call publish_latest() instead of touching the cache directly.
+#
+# With a message queue every update is sent in full: a delta is only right
+# against the sender's previous payload, and the other processes refresh
+# their own latest_cache from the full payload as it passes through.
+LIVE_EVENTS = {'sensors': 'sensor_update', 'relays': 'relay_update', 'rooms': 'room_update'}
+LIVE_KINDS = {event: kind for kind, event in LIVE_EVENTS.items()}
+
+def payload_delta(old, new):
+    """Return the parts of `new` that differ from `old`, recursing into dicts"""
+    delta = {}
+    for key, value in new.items():
+        previous = old.get(key)
+        if isinstance(value, dict) and isinstance(previous, dict):
+            nested = payload_delta(previous, value)
+            if nested:
+                delta[key] = nested
+        elif previous != value or key not in old:
+            delta[key] = value
+    return delta
+
+def publish_latest(kind, key, payload, source=None):
+    """Cache a new latest payload and push what changed to the key's room"""
+    stored, previous = latest_cache.replace(kind, key, payload)
+    if not stored:
+        return
+
+    message = {'unit_id': key, 'timestamp': payload['timestamp']}
+    if previous is None or MESSAGE_QUEUE:
+        message['full'] = True
+        message['data'] = payload
+    else:
+        message['data'] = payload_delta(previous, payload)
+    if source:
+        message['source'] = source
+    socketio.emit(LIVE_EVENTS[kind], message, to=key)
+
+def unit_snapshot(storage, unit_id):
+    """Full latest state sent to a client when it joins a unit or room"""
+    if unit_id in ROOM_IDS.values():
+        return {'unit_id': unit_id, 'room': get_latest_room(storage, unit_id)}
+    return {
+        'unit_id': unit_id,
+        'sensors': get_latest_sensor(storage, unit_id),
+        'relays': get_latest_relay(storage, unit_id)
+    }
+
+def start_message_queue_listener():
+    """Start applying queued updates now instead of on the first client connect"""
+    server = socketio.server
+    if MESSAGE_QUEUE and not server.manager_initialized:
+        server.manager_initialized = True
+        server.manager.initialize()
+
+def payload_number(value):
+    """A sensor value as a float (null and text unchanged)
+
+    Posted JSON keeps ints like 24 while SQLite may hand back 24.0, so every
+    payload goes through this: a reading then serializes (and gets its ETag)
+    the same whether it comes from the cache or the database.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+def sensor_payload(row, climate):
+    """Build the /units/<unit_id>/sensors-data response from a reading and its climate dict"""
+    return {
+        "unit_id": row['unit_id'],
+        "timestamp": row['timestamp'],
+        "reservoir": {
+            "ph": payload_number(row['ph']),
+            "tds": payload_number(row['tds']),
+            "turbidity": payload_number(row['turbidity']),
+            "water_temp": payload_number(row['water_temp']),
+            "water_level": payload_number(row['water_level'])
+        },
+        "climate": {
+            position: {
+                "temp": payload_number(values.get('temp')),
+                "humidity": payload_number(values.get('humidity'))
+            }
+            for position, values in climate.items()
+        }
+    }
+
+RELAY_NAMES = ('lights', 'fans', 'pump')
+
+def relay_payload(row):
+    """Build the /units/<unit_id>/relays response from a relay_current row"""
+    return {
+        "unit_id": row['unit_id'],
+        "timestamp": row['timestamp'],
+        "relays": {
+            "lights": row['lights'],
+            "fans": row['fans'],
+            "pump": row['pump']
+        }
+    }
+
+def room_payload(row):
+    """Build the /room/<room>/sensors response from a room_sensors row"""
+    payload = {
+        "unit_id": row['unit_id'],
+        "timestamp": row['timestamp'],
+        "bme": {
+            "temp": payload_number(row['temp']),
+            "humidity": payload_number(row['humidity']),
+            "pressure": payload_number(row['pressure']),
+            "iaq": payload_number(row['iaq'])
+        },
+        "co2": payload_number(row['co2'])
+    }
+    if row['unit_id'] == 'ROOM_BACK':
+        payload["ac"] = {
+            "current_set_temp": payload_number(row['ac_temp']),
+            "mode": row['ac_mode']
+        }
+    return payload
+
+def get_latest_sensor(storage, unit_id):
+    """Get the latest sensor payload for a unit, from cache or storage"""
+    payload = latest_cache.get('sensors', unit_id)
+    if payload is None:
+        payload = storage.latest_sensor_reading(unit_id)
+        if payload:
+            latest_cache.set('sensors', unit_id, payload)
+    return payload
+
+def get_latest_relay(storage, unit_id):
+    """Get the latest relay payload for a unit, from cache or storage"""
+    payload = latest_cache.get('relays', unit_id)
+    if payload is None:
+        payload = storage.latest_relay_state(unit_id)
+        if payload:
+            latest_cache.set('relays', unit_id, payload)
+    return payload
+
+def get_latest_room(storage, room_id):
+    """Get the latest room sensor payload, from cache or storage"""
+    payload = latest_cache.get('rooms', room_id)
+    if payload is None:
+        payload = storage.latest_room_reading(room_id)
+        if payload:
+            latest_cache.set('rooms', room_id, payload)
+    return payload
+
+def warm_latest_cache():
+    """Load the latest reading of every unit and room into the cache"""
+    with app.app_context():
+        storage = get_storage()
+        for unit in storage.list_units():
+            unit_id = unit['unit_id']
+            latest_cache.invalidate('sensors', unit_id)
+            latest_cache.invalidate('relays', unit_id)
+            get_latest_sensor(storage, unit_id)
+            get_latest_relay(storage, unit_id)
+        for room_id in ['ROOM_FRONT', 'ROOM_BACK']:
+            latest_cache.invalidate('rooms', room_id)
+            get_latest_room(storage, room_id)
+
+# Device commands
+#
+# Relay, schedule and AC changes meant for a unit's ESP32 are appended to
+# device_commands in the transaction that makes the change, then announced
+# as a device_command event to the unit's room. Devices long-poll
+# GET /api/units/<unit_id>/commands?since=<cursor>, which answers as soon as
+# the unit has a command past the cursor, or with none after `timeout`
+# seconds. Only the newest command of each kind is returned (each carries
+# the full state) and the response cursor skips the superseded ones.
+# Devices acknowledge with POST /api/units/<unit_id>/commands/ack. Acks are
+# cumulative, and a poll without since= resumes after the last acknowledged
+# command, so a rebooted device gets everything it had not confirmed.
+#
+# A waiting poll holds no database connection. With a message queue the
+# device_command events wake polls on every worker. Socket.IO clients in
+# the unit's room receive the same events and can acknowledge with
+# ack_command.
+DEVICE_POLL_TIMEOUT = 25
+DEVICE_POLL_MAX_TIMEOUT = 55        # stay under nginx's 60 s proxy_read_timeout
+
+class DeviceCommandWaiters:
+    """Newest announced command id per unit, and an event for the long-polls waiting on each unit"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest = {}
+        self._events = {}
+
+    def notify(self, unit_id, command_id):
+        """Wake the unit's waiting polls once a command is committed"""
+        with self._lock:
+            if command_id <= self._latest.get(unit_id, 0):
+                return
+            self._latest[unit_id] = command_id
+            event = self._events.pop(unit_id, None)
+        if event:
+            event.set()
+
+    def wait(self, unit_id, since, timeout):
+        """Block until a command newer than `since` is announced; False on timeout"""
+        with self._lock:
+            if self._latest.get(unit_id, 0) > since:
+                return True
+            event = self._events.setdefault(unit_id, threading.Event())
+        return event.wait(timeout)
+
+device_waiters = DeviceCommandWaiters()
+
+def queue_device_command(storage, unit_id, kind, data, timestamp):
+    """Append a command for the unit's device (uncommitted); announce_device_command() it after the commit"""
+    command_id = storage.queue_device_command(unit_id, kind, data, timestamp)
+    return {'unit_id': unit_id, 'id': command_id, 'kind': kind, 'timestamp': timestamp, 'data': data}
+
+def announce_device_command(command):
+    """Wake the unit's long-polls in this process and, through the room event, on the others"""
+    device_waiters.notify(command['unit_id'], command['id'])
+    socketio.emit('device_command', command, to=command['unit_id'])
+
+def publish_relays(payload, command, source=None):
+    """Push a committed relay change to the unit's room and its device"""
+    publish_latest('relays', payload['unit_id'], payload, source=source)
+    announce_device_command(command)
+
+def acknowledge_device_command(storage, unit_id, command_id):
+    """Record a device's ack and tell the unit's room; False for an unknown command"""
+    timestamp = int(time.time())
+    if not storage.ack_device_command(unit_id, command_id, timestamp):
+        return False
+    storage.commit()
+    socketio.emit('command_ack', {'unit_id': unit_id, 'id': command_id, 'timestamp': timestamp}, to=unit_id)
+    return True
+
+# Sensor ingest pipeline
+#
+# ESP32 posts are queued and written by a single writer thread that writes
+# each batch with insert_sensor_readings() (an INSERT per reading, then one
+# executemany for the batch's climate rows and one for its rollup buckets)
+# and commits every INGEST_BATCH_SIZE rows or INGEST_FLUSH_INTERVAL_MS
+# milliseconds, whichever comes first. HTTP handlers
+# acknowledge as soon as the row is queued; with INGEST_DURABLE they wait for
+# the commit instead. A full queue is reported as 503 with Retry-After. Rows
+# are validated before they are queued; if a batch still fails it is retried
+# one row at a time, so a bad row cannot lose the others.
+INGEST_QUEUE_SIZE = 10000
+INGEST_BATCH_SIZE = 500
+INGEST_FLUSH_INTERVAL_MS = 50
+INGEST_DURABLE = False
+INGEST_COMMIT_TIMEOUT = 10
+INGEST_RETRY_AFTER = 1
+
+class IngestQueueFull(Exception):
+    """Raised when the ingest queue cannot accept more rows"""
+
+class SensorIngestQueue:
+    """Bounded queue of sensor reading rows drained by one writer thread"""
+
+    def __init__(self, maxsize, batch_size, flush_interval_ms):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.rows_written = 0
+        self.batches_written = 0
+
+    def depth(self):
+        """Number of rows waiting to be written"""
+        return self._queue.qsize()
+
+    def start(self):
+        """Start the writer thread if it is not already running"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='sensor-ingest', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=5):
+        """Flush queued rows and stop the writer thread"""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def submit(self, row, wait=False):
+        """Queue a row; with wait=True block until it is committed.
+
+        Returns True once queued (or committed), False if the commit failed
+        or timed out. Raises IngestQueueFull when the queue is at capacity.
+        """
+        self.start()
+        done = threading.Event() if wait else None
+        item = {'row': row, 'done': done, 'ok': False}
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            raise IngestQueueFull()
+        if done is None:
+            return True
+        return done.wait(INGEST_COMMIT_TIMEOUT) and item['ok']
+
+    def _collect(self, first):
+        """Gather a batch starting with `first` until it is full or the interval elapses"""
+        batch = [first]
+        stop = False
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                stop = True
+                break
+            batch.append(item)
+        return batch, stop
+
+    def _insert(self, storage, items):
+        inserted = storage.insert_sensor_readings([item['row'] for item in items])
+        storage.commit()
+        for item in items:
+            item['ok'] = True
+        return inserted
+
+    def _write(self, storage, batch):
+        """Insert one batch in a single transaction, or row by row if that fails"""
+        try:
+            inserted = self._insert(storage, batch)
+        except Exception:
+            storage.rollback()
+            app.logger.exception('Sensor ingest batch of %d rows failed, retrying row by row', len(batch))
+            # One bad row must not cost the rest of the batch
+            inserted = []
+            for item in batch:
+                try:
+                    inserted += self._insert(storage, [item])
+                except Exception:
+                    storage.rollback()
+                    app.logger.exception('Sensor reading from %s at %s dropped',
+                                         item['row']['unit_id'], item['row']['timestamp'])
+
+        self.rows_written += len(inserted)
+        self.batches_written += 1
+
+        for item in batch:
+            if item['done'] is not None:
+                item['done'].set()
+
+        # Only rows that were stored reach the cache and clients
+        latest = {}
+        for row in inserted:
+            latest[row['unit_id']] = row
+
+        for unit_id, row in latest.items():
+            publish_latest('sensors', unit_id, sensor_payload(row, row['climate']), source='esp32')
+
+    def _run(self):
+        storage = open_storage()
+        try:
+            while True:
+                first = self._queue.get()
+                if first is None:
+                    break
+                batch, stop = self._collect(first)
+                self._write(storage, batch)
+                if stop:
+                    break
+        finally:
+            storage.close()
+
+ingest_queue = SensorIngestQueue(INGEST_QUEUE_SIZE, INGEST_BATCH_SIZE, INGEST_FLUSH_INTERVAL_MS)
+atexit.register(ingest_queue.stop)
+
+# Camera images
+#
+# Images are stored by content: an upload is streamed to a temporary file in
+# UPLOAD_CHUNK_SIZE pieces while it is hashed, then kept as
+# IMAGE_STORE/ab/cd/<sha256>.<ext>, sharded on the first two byte pairs of the
+# hash so no directory grows past a few thousand entries. The extension comes
+# from the image's leading bytes (IMAGE_SIGNATURES), not the client's
+# filename, so identical bytes always get the same name and are served with
+# their real content type. Identical frames
+# (a static camera) share one file: image_blobs counts the camera_images rows
+# pointing at each hash, and retention deletes the file when the count drops
+# to zero. Files from before this scheme keep their flat
+# {camera_id}_{timestamp}.jpg names until `flask --app app migrate-images`
+# moves them into the store. Either kind of name works in
+# /camera_images/<filename>.
+#
+# Downscaled JPEGs for the dashboard (THUMBNAIL_SIZES) are made after the
+# upload by THUMBNAIL_WORKERS threads, off the request path, and kept under
+# THUMBNAIL_FOLDER/<size>/ with the same sharding, always as .jpg. ?size=thumb serves one,
+# rendering it on the spot if the workers have not got to it yet (or the
+# queue was full). Without Pillow installed the full image is served.
+UPLOAD_CHUNK_SIZE = 64 * 1024
+IMAGE_STORE = 'objects'  # under UPLOAD_FOLDER
+CONTENT_FILENAME = re.compile(r'^[0-9a-f]{64}\.(jpg|png|gif)$')
+# leading bytes -> extension; anything else is stored as jpg
+IMAGE_SIGNATURES = ((b'\xff\xd8\xff', 'jpg'), (b'\x89PNG\r\n\x1a\n', 'png'), (b'GIF8', 'gif'))
+THUMBNAIL_FOLDER = os.path.join(UPLOAD_FOLDER, 'thumbs')
+# size name -> bounding box; aspect ratio is kept
+THUMBNAIL_SIZES = {'thumb': (320, 240), 'preview': (960, 720)}
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_WORKERS = 2
+THUMBNAIL_QUEUE_SIZE = 1000
+
+def shard_name(filename):
+    """ab/cd/<filename> for a content-addressed image; older flat names are returned unchanged"""
+    if CONTENT_FILENAME.match(filename):
+        return os.path.join(filename[:2], filename[2:4], filename)
+    return filename
+
+def image_file_name(filename):
+    """Path of an image file relative to UPLOAD_FOLDER, from its URL filename"""
+    if CONTENT_FILENAME.match(filename):
+        return os.path.join(IMAGE_STORE, shard_name(filename))
+    return filename
+
+def image_extension(head):
+    """Extension for an image from its first bytes"""
+    for signature, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    return 'jpg'
+
+def receive_image(stream):
+    """Stream an upload to a temporary file, hashing it on the way; returns (store filename, temp path, size)"""
+    digest = hashlib.sha256()
+    size = 0
+    head = b''
+    fd, partial = tempfile.mkstemp(suffix='.part', dir=os.path.join(app.root_path, UPLOAD_FOLDER))
+    with os.fdopen(fd, 'wb') as out:
+        while True:
+            chunk = stream.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            if len(head) < 8:
+                head += chunk[:8 - len(head)]
+            digest.update(chunk)
+            out.write(chunk)
+            size += len(chunk)
+    return f'{digest.hexdigest()}.{image_extension(head)}', partial, size
+
+def store_camera_image(storage, image, stream):
+    """Stream an image into the store and record its row (not yet committed); returns
+    (store filename, True if the file is new)"""
+    filename, partial, file_size = receive_image(stream)
+    try:
+        storage.record_camera_image({
+            **image, 'image_path': os.path.join(UPLOAD_FOLDER, image_file_name(filename)),
+            'file_size': file_size, 'content_hash': filename[:64]
+        })
+        # Place the file while this transaction holds the write lock, so
+        # retention cannot drop the same blob in between
+        return filename, place_image(partial, filename)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+def place_image(partial, filename):
+    """Move a received upload into the store, or drop it if identical bytes are there; True if new"""
+    target = os.path.join(app.root_path, UPLOAD_FOLDER, image_file_name(filename))
+    if os.path.exists(target):
+        os.remove(partial)
+        return False
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(partial, target)
+    return True
+
+def remove_image_file(image_path):
+    """Delete an image file and its thumbnails; returns bytes freed"""
+    freed = 0
+    try:
+        path = os.path.join(app.root_path, image_path)
+        size = os.path.getsize(path)
+        os.remove(path)
+        freed += size
+    except OSError:
+        pass
+    return freed + remove_thumbnails(os.path.basename(image_path))
+
+def thumbnail_name(filename):
+    """Name of the thumbnails of an uploaded file, relative to their size folder; they are JPEGs"""
+    return shard_name(f'{os.path.splitext(filename)[0]}.jpg')
+
+def thumbnail_path(filename, size):
+    """Where the `size` thumbnail of an uploaded file lives"""
+    return os.path.join(app.root_path, THUMBNAIL_FOLDER, size, thumbnail_name(filename))
+
+def make_thumbnail(filename, size):
+    """Write the `size` thumbnail of an uploaded file; returns its path, or None if there is no source"""
+    source = os.path.join(app.root_path, UPLOAD_FOLDER, image_file_name(filename))
+    if Image is None or not os.path.isfile(source):
+        return None
+
+    target = thumbnail_path(filename, size)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    partial = f'{target}.{threading.get_ident()}.part'
+    with Image.open(source) as image:
+        # For JPEGs, decode straight at a reduced scale instead of full size
+        image.draft('RGB', THUMBNAIL_SIZES[size])
+        image.thumbnail(THUMBNAIL_SIZES[size])
+        image.convert('RGB').save(partial, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+    os.replace(partial, target)
+    return target
+
+def render_thumbnail(filename, size):
+    """make_thumbnail(), in a real OS thread under eventlet so the event loop keeps serving"""
+    if ASYNC_MODE == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(make_thumbnail, filename, size)
+    return make_thumbnail(filename, size)
+
+def remove_thumbnails(filename):
+    """Delete every thumbnail of an uploaded file; returns bytes freed"""
+    freed = 0
+    for size in THUMBNAIL_SIZES:
+        path = thumbnail_path(filename, size)
+        try:
+            file_size = os.path.getsize(path)
+            os.remove(path)
+            freed += file_size
+        except OSError:
+            pass
+    return freed
+
+def image_url(image_path, size='full'):
+    """URL of an image at `size` (full or a THUMBNAIL_SIZES name), or None without an image"""
+    if not image_path:
+        return None
+    url = f'/camera_images/{os.path.basename(image_path)}'
+    return url if size == 'full' else f'{url}?size={size}'
+
+def requested_image_size():
+    """Size camera lists link images at: ?size=full|preview|thumb, thumbnails by default"""
+    size = request.args.get('size', 'thumb')
+    return size if size == 'full' or size in THUMBNAIL_SIZES else 'thumb'
+
+# Image responses
+#
+# An image URL never changes meaning: store names are the hash of the bytes,
+# flat names are no longer written, and thumbnails derive from either. So
+# image responses may be cached for IMAGE_MAX_AGE with `immutable`, and
+# browsers stop refetching them on every dashboard refresh. Store originals
+# carry their hash as a strong ETag; thumbnails and flat files get
+# Werkzeug's file-based one. Conditional and Range requests are answered
+# here.
+#
+# With HYDRO_IMAGE_SENDFILE=x-accel-redirect (nginx) or x-sendfile (Apache
+# mod_xsendfile, lighttpd) the worker only checks the request and its
+# validators, then leaves the bytes and ranges to the front proxy. For nginx,
+# IMAGE_ACCEL_PREFIX must be an internal location aliased to UPLOAD_FOLDER
+# (see deploy-ec2.txt).
+IMAGE_MAX_AGE = 365 * 86400
+# A thumbnail URL answered with the original (no Pillow yet, unreadable
+# file) should pick up the real thumbnail later
+IMAGE_FALLBACK_MAX_AGE = 300
+IMAGE_SENDFILE = os.environ.get('HYDRO_IMAGE_SENDFILE')
+IMAGE_ACCEL_PREFIX = os.environ.get('HYDRO_IMAGE_ACCEL_PREFIX', '/_camera_images/')
+
+def send_image(folder, name, etag=True, immutable=True):
+    """Send an image file under `folder`, or hand it to the front proxy with IMAGE_SENDFILE"""
+    path = safe_join(os.path.join(app.root_path, folder), name)
+    if path is None or not os.path.isfile(path):
+        return jsonify({'error': 'Image not found'}), 404
+
+    response = send_file(path, request.environ, etag=etag, use_x_sendfile=bool(IMAGE_SENDFILE),
+                         max_age=IMAGE_MAX_AGE if immutable else IMAGE_FALLBACK_MAX_AGE,
+                         conditional=not IMAGE_SENDFILE, response_class=app.response_class)
+    response.cache_control.immutable = immutable or None
+    response.accept_ranges = 'bytes'
+    if IMAGE_SENDFILE:
+        # Revalidations end here; a Range is served by the proxy from the whole file
+        response.make_conditional(request)
+        if response.status_code == 304:
+            response.headers.pop('X-Sendfile', None)
+        elif IMAGE_SENDFILE == 'x-accel-redirect':
+            relative = os.path.relpath(response.headers.pop('X-Sendfile'), os.path.join(app.root_path, UPLOAD_FOLDER))
+            response.headers['X-Accel-Redirect'] = IMAGE_ACCEL_PREFIX + relative.replace(os.sep, '/')
+            # nginx takes the length from the file; this response itself has no body
+            response.content_length = 0
+    return response
+
+class ThumbnailWorkers:
+    """Bounded queue of uploaded filenames turned into thumbnails by worker threads"""
+
+    def __init__(self, workers, maxsize):
+        self.workers = workers
+        self._queue = queue.Queue(maxsize)
+        self._threads = []
+        self._lock = threading.Lock()
+        self.generated = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def depth(self):
+        """Number of files waiting for thumbnails"""
+        return self._queue.qsize()
+
+    def start(self):
+        """Start any worker threads that are not running"""
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name='thumbnails', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, filename):
+        """Queue thumbnails for an uploaded file; False if they will be made on first request instead"""
+        if Image is None:
+            return False
+        self.start()
+        try:
+            self._queue.put_nowait(filename)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            filename = self._queue.get()
+            for size in THUMBNAIL_SIZES:
+                try:
+                    render_thumbnail(filename, size)
+                    self.generated += 1
+                except Exception as e:
+                    self.failed += 1
+                    print(f"Thumbnail {size} of {filename} failed: {e}")
+
+thumbnail_workers = ThumbnailWorkers(THUMBNAIL_WORKERS, THUMBNAIL_QUEUE_SIZE)
+
+# camera_images rows handled per transaction by migrate-images
+MIGRATE_IMAGES_BATCH = 500
+
+def file_sha256(path):
+    """Hex SHA-256 of a file, read in UPLOAD_CHUNK_SIZE pieces"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def migrate_images(db, batch_size=MIGRATE_IMAGES_BATCH):
+    """Move flat-named image files into the content-addressed store; returns (rows, files, missing)
+
+    Each file is hard-linked into the store, its rows are repointed and
+    counted in one transaction, and the old name is removed after the commit,
+    so an interrupted run leaves nothing broken and can simply be rerun.
+    """
+    rows = files = missing = 0
+    last_id = 0
+    while True:
+        images = db.execute('''
+            SELECT id, image_path, file_size, timestamp FROM camera_images
+            WHERE content_hash IS NULL AND id > ?
+            ORDER BY id
+            LIMIT ?
+        ''', (last_id, batch_size)).fetchall()
+        if not images:
+            return rows, files, missing
+        last_id = images[-1]['id']
+
+        moved = []
+        for image in images:
+            old_path = image['image_path']
+            if old_path in moved:
+                continue
+            source = os.path.join(app.root_path, old_path)
+            if not os.path.isfile(source):
+                missing += 1
+                continue
+
+            content_hash = file_sha256(source)
+            with open(source, 'rb') as f:
+                extension = image_extension(f.read(8))
+            new_path = os.path.join(UPLOAD_FOLDER, image_file_name(f'{content_hash}.{extension}'))
+            target = os.path.join(app.root_path, new_path)
+            if not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                try:
+                    os.link(source, target)
+                except OSError:
+                    shutil.copy2(source, target)
+
+            # Every row naming this file moves at once, including ones in later batches
+            count = db.execute('''
+                UPDATE camera_images SET image_path = ?, content_hash = ?
+                WHERE image_path = ? AND content_hash IS NULL
+            ''', (new_path, content_hash, old_path)).rowcount
+            db.execute('''
+                INSERT INTO image_blobs (content_hash, file_size, refcount, created_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (content_hash) DO UPDATE SET refcount = refcount + excluded.refcount
+            ''', (content_hash, image['file_size'], count, image['timestamp']))
+            db.execute('UPDATE camera_status SET last_image_path = ? WHERE last_image_path = ?',
+                       (new_path, old_path))
+            rows += count
+            moved.append(old_path)
+        db.commit()
+
+        # The old names (and their thumbnails) are unreferenced now
+        for old_path in moved:
+            remove_image_file(old_path)
+            files += 1
+
+@app.cli.command('migrate-images')
+def migrate_images_command():
+    """Move flat-named camera images into the content-addressed store"""
+    if STORAGE_URL:
+        raise click.ClickException('migrate-images works on the SQLite database only')
+    with app.app_context():
+        rows, files, missing = migrate_images(get_db())
+    click.echo(f"Moved {files} files ({rows} camera_images rows); {missing} rows point at missing files")
+
+# Conditional GET
+#
+# Polling clients send back the ETag (and Last-Modified) of their previous
+# response. Read endpoints work out a cheap validator first - the cached
+# latest payload, or a small query on camera_status - and answer 304 before
+# building the body when it still matches. Larger JSON bodies are gzipped
+# for clients that accept it.
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+COMPRESS_MIMETYPES = {'application/json'}
+
+def payload_etag(payload):
+    """Strong ETag for a latest-state payload: its timestamp plus a content digest"""
+    digest = hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:16]
+    return f"{payload['timestamp']}-{digest}"
+
+def set_validators(response, etag, last_modified=None):
+    """Attach an ETag and optional Last-Modified (epoch seconds) to a response"""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = datetime.fromtimestamp(last_modified, timezone.utc)
+    # Let browsers cache the body but revalidate it on every request
+    response.cache_control.no_cache = True
+    return response
+
+def not_modified(etag, last_modified=None):
+    """Return a 304 response if the client's copy is current, else None"""
+    modified_at = datetime.fromtimestamp(last_modified, timezone.utc) if last_modified is not None else None
+    if is_resource_modified(request.environ, etag=etag, last_modified=modified_at):
+        return None
+    return set_validators(app.response_class(status=304), etag, last_modified)
+
+def etagged_json(body):
+    """jsonify() with an ETag computed over the body, for small payloads without a cheap validator"""
+    response = jsonify(body)
+    response.add_etag()
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def latest_response(payload):
+    """Conditional response for a latest sensor, relay or room payload"""
+    etag = payload_etag(payload)
+    return not_modified(etag, payload['timestamp']) or set_validators(jsonify(payload), etag, payload['timestamp'])
+
+def camera_status_validator(storage, unit_id=None, camera_id=None):
+    """ETag and last image time for camera lists: one camera, one unit, or all"""
+    version, last_image = storage.camera_version(unit_id, camera_id)
+    return f'cameras-{version}', last_image
+
+@app.after_request
+def compress_response(response):
+    """Gzip larger JSON responses when the client accepts it"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or response.mimetype not in COMPRESS_MIMETYPES or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    if 'gzip' not in request.accept_encodings or response.content_length < COMPRESS_MIN_SIZE:
+        return response
+
+    response.set_data(gzip.compress(response.get_data(), COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    # The compressed body is a different representation of the same resource
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
 # API Routes
 
 @app.route('/units/<unit_id>/sensors-data', methods=['GET'])
 def get_unit_sensors(unit_id):
     """Get latest sensor data for a hydro unit"""
-    db = get_db()
+    storage = get_storage()
 
     # Get latest sensor reading
-    sensor = db.execute('''
-        SELECT * FROM sensor_readings
-        WHERE unit_id = ?
-        ORDER BY timestamp DESC
-        LIMIT 1
-    ''', (unit_id,)).fetchone()
+    sensor = get_latest_sensor(storage, unit_id)
 
     if not sensor:
         # Return mock data if no readings
@@ -227,32 +2902,205 @@ def get_unit_sensors(unit_id):
             }
         })
 
-    climate_data = json.loads(sensor['climate_data']) if sensor['climate_data'] else {}
+    return latest_response(sensor)
+
+@app.route('/units/<unit_id>/climate/summary', methods=['GET'])
+@sqlite_only
+def get_unit_climate_summary(unit_id):
+    """Get per-position temperature/humidity averages for a hydro unit"""
+    db = get_db()
+    end_time = request.args.get('to', int(time.time()), type=int)
+    start_time = request.args.get('from', end_time - 86400, type=int)
+
+    rows = db.execute('''
+        SELECT position,
+               AVG(temp) AS avg_temp, MIN(temp) AS min_temp, MAX(temp) AS max_temp,
+               AVG(humidity) AS avg_humidity, MIN(humidity) AS min_humidity, MAX(humidity) AS max_humidity,
+               COUNT(*) AS samples
+        FROM climate_readings
+        WHERE unit_id = ? AND timestamp BETWEEN ? AND ?
+        GROUP BY position
+        ORDER BY position
+    ''', (unit_id, start_time, end_time)).fetchall()
+
+    positions = {}
+    for row in rows:
+        positions[row['position']] = {
+            "temp": {
+                "avg": round(row['avg_temp'], 2) if row['avg_temp'] is not None else None,
+                "min": row['min_temp'],
+                "max": row['max_temp']
+            },
+            "humidity": {
+                "avg": round(row['avg_humidity'], 2) if row['avg_humidity'] is not None else None,
+                "min": row['min_humidity'],
+                "max": row['max_humidity']
+            },
+            "samples": row['samples']
+        }
 
     return jsonify({
         "unit_id": unit_id,
-        "timestamp": sensor['timestamp'],
-        "reservoir": {
-            "ph": sensor['ph'],
-            "tds": sensor['tds'],
-            "turbidity": sensor['turbidity'],
-            "water_temp": sensor['water_temp'],
-            "water_level": sensor['water_level']
-        },
-        "climate": climate_data
+        "from": start_time,
+        "to": end_time,
+        "positions": positions
     })
 
+# Time-series history
+#
+# History endpoints aggregate raw rows into at most `points` equal-width
+# buckets (min/max/avg/count per bucket) in SQL, so the response size is
+# bounded however long the requested range is.
+MAX_HISTORY_POINTS = 2000
+DEFAULT_HISTORY_POINTS = 500
+
+# metric -> (table, column)
+UNIT_HISTORY_METRICS = {
+    'ph': ('sensor_readings', 'ph'),
+    'tds': ('sensor_readings', 'tds'),
+    'turbidity': ('sensor_readings', 'turbidity'),
+    'water_temp': ('sensor_readings', 'water_temp'),
+    'water_level': ('sensor_readings', 'water_level'),
+    'temp': ('climate_readings', 'temp'),
+    'humidity': ('climate_readings', 'humidity'),
+}
+
+ROOM_HISTORY_METRICS = {
+    'temp': ('room_sensors', 'temp'),
+    'humidity': ('room_sensors', 'humidity'),
+    'pressure': ('room_sensors', 'pressure'),
+    'iaq': ('room_sensors', 'iaq'),
+    'co2': ('room_sensors', 'co2'),
+    'ac_temp': ('room_sensors', 'ac_temp'),
+}
+
+ROOM_IDS = {'front': 'ROOM_FRONT', 'back': 'ROOM_BACK'}
+
+def parse_history_args():
+    """Read from/to/points query args; returns (start, end, points, bucket_seconds)"""
+    end_time = request.args.get('to', int(time.time()), type=int)
+    start_time = request.args.get('from', end_time - 86400, type=int)
+    points = request.args.get('points', DEFAULT_HISTORY_POINTS, type=int)
+    if start_time > end_time:
+        raise ValueError("'from' must not be after 'to'")
+    points = max(1, min(points, MAX_HISTORY_POINTS))
+    # Ceiling division so the buckets always cover the whole range
+    bucket_seconds = max(1, -(-(end_time - start_time + 1) // points))
+    return start_time, end_time, points, bucket_seconds
+
+def query_rollup_history(db, resolution, metric, key, start_time, end_time, bucket_seconds, position=None):
+    """Re-aggregate rollup buckets of one resolution into buckets of bucket_seconds (a multiple
+    of the resolution), counted from the rollup bucket holding start_time"""
+    origin = start_time - start_time % resolution
+    params = [origin, origin, bucket_seconds, bucket_seconds,
+              resolution, key, metric, origin, end_time]
+    position_filter = ''
+    if position:
+        position_filter = 'AND position = ?'
+        params.append(position)
+
+    rows = db.execute(f'''
+        SELECT ? + ((bucket - ?) / ?) * ? AS bucket_start,
+               MIN(min_value) AS min, MAX(max_value) AS max,
+               SUM(sum_value) / SUM(count) AS avg, SUM(count) AS count
+        FROM sensor_rollups
+        WHERE resolution = ? AND unit_id = ? AND metric = ?
+          AND bucket >= ? AND bucket <= ? {position_filter}
+        GROUP BY 1
+        ORDER BY 1
+    ''', params).fetchall()
+
+    return [{
+        't': row['bucket_start'],
+        'min': row['min'],
+        'max': row['max'],
+        'avg': round(row['avg'], 3) if row['avg'] is not None else None,
+        'count': row['count']
+    } for row in rows if row['count']]
+
+def query_history(db, table, column, key, start_time, end_time, bucket_seconds, position=None):
+    """Aggregate one raw metric into time buckets of bucket_seconds"""
+    params = [start_time, start_time, bucket_seconds, bucket_seconds, key, start_time, end_time]
+    position_filter = ''
+    if position:
+        position_filter = 'AND position = ?'
+        params.append(position)
+
+    rows = db.execute(f'''
+        SELECT ? + ((timestamp - ?) / ?) * ? AS bucket,
+               MIN({column}) AS min, MAX({column}) AS max, AVG({column}) AS avg, COUNT({column}) AS count
+        FROM {table}
+        WHERE unit_id = ? AND timestamp BETWEEN ? AND ? {position_filter}
+        GROUP BY bucket
+        ORDER BY bucket
+    ''', params).fetchall()
+
+    return [{
+        't': row['bucket'],
+        'min': row['min'],
+        'max': row['max'],
+        'avg': round(row['avg'], 3) if row['avg'] is not None else None,
+        'count': row['count']
+    } for row in rows if row['count']]
+
+def history_response(db, metrics, key, metric):
+    """Build a history response for a unit or room, or an error tuple"""
+    if metric not in metrics:
+        return jsonify({
+            'error': f'Unknown metric: {metric}',
+            'metrics': sorted(metrics)
+        }), 400
+
+    try:
+        start_time, end_time, points, bucket_seconds = parse_history_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    table, column = metrics[metric]
+    position = request.args.get('position') if table == 'climate_readings' else None
+
+    resolution = pick_rollup_resolution(bucket_seconds, start_time, table)
+    if resolution:
+        bucket_seconds = rollup_bucket_seconds(bucket_seconds, resolution)
+        series = query_rollup_history(db, resolution, column, key, start_time, end_time, bucket_seconds, position)
+    else:
+        series = query_history(db, table, column, key, start_time, end_time, bucket_seconds, position)
+
+    response = {
+        'unit_id': key,
+        'metric': metric,
+        'from': start_time,
+        'to': end_time,
+        'bucket_seconds': bucket_seconds,
+        'source': ROLLUP_NAMES[resolution] if resolution else 'raw',
+        'points': series
+    }
+    if position:
+        response['position'] = position
+    return jsonify(response)
+
+@app.route('/units/<unit_id>/history', methods=['GET'])
+@sqlite_only
+def get_unit_history(unit_id):
+    """Get downsampled history of one sensor metric for a hydro unit"""
+    metric = request.args.get('metric', 'ph')
+    return history_response(get_db(), UNIT_HISTORY_METRICS, unit_id, metric)
+
+@app.route('/room/<room>/history', methods=['GET'])
+@sqlite_only
+def get_room_history(room):
+    """Get downsampled history of one room sensor metric"""
+    if room not in ROOM_IDS:
+        return jsonify({'error': f'Unknown room: {room}'}), 404
+    metric = request.args.get('metric', 'temp')
+    return history_response(get_db(), ROOM_HISTORY_METRICS, ROOM_IDS[room], metric)
+
 @app.route('/units/<unit_id>/relays', methods=['GET'])
 def get_unit_relays(unit_id):
     """Get current relay states for a hydro unit"""
-    db = get_db()
+    storage = get_storage()
 
-    relay = db.execute('''
-        SELECT * FROM relay_states
-        WHERE unit_id = ?
-        ORDER BY timestamp DESC
-        LIMIT 1
-    ''', (unit_id,)).fetchone()
+    relay = get_latest_relay(storage, unit_id)
 
     if not relay:
         # Return default states
@@ -266,114 +3114,92 @@ def get_unit_relays(unit_id):
             }
         })
 
-    return jsonify({
-        "unit_id": unit_id,
-        "timestamp": relay['timestamp'],
-        "relays": {
-            "lights": relay['lights'],
-            "fans": relay['fans'],
-            "pump": relay['pump']
-        }
-    })
+    return latest_response(relay)
 
 @app.route('/units/<unit_id>/relay', methods=['POST'])
 def update_unit_relay(unit_id):
     """Update relay state for a hydro unit - switches to manual mode"""
     data = request.get_json()
-    db = get_db()
+    storage = get_storage()
     timestamp = int(time.time())
 
-    # Get current states
-    current = db.execute('''
-        SELECT * FROM relay_states
-        WHERE unit_id = ?
-        ORDER BY timestamp DESC
-        LIMIT 1
-    ''', (unit_id,)).fetchone()
+    # Merge the switched relays into the current state (relays not named keep
+    # theirs) and queue the result for the unit's device
+    changes = {relay: data[relay] for relay in RELAY_NAMES if relay in data}
+    payload = storage.set_relays(unit_id, timestamp, changes, source='manual')
+    command = queue_device_command(storage, unit_id, 'relays', payload['relays'], timestamp)
 
-    lights = data.get('lights', current['lights'] if current else 'OFF')
-    fans = data.get('fans', current['fans'] if current else 'OFF')
-    pump = data.get('pump', current['pump'] if current else 'OFF')
+    # Switch to manual mode when relay is manually controlled
+    storage.set_control_mode(unit_id, 'manual')
 
-    # Insert new relay state
-    db.execute('''
-        INSERT INTO relay_states (unit_id, timestamp, lights, fans, pump)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (unit_id, timestamp, lights, fans, pump))
+    storage.commit()
+    publish_schedule(unit_id, storage.load_schedule(unit_id))
 
-    # Switch to manual mode when relay is manually controlled
-    db.execute('''
-        UPDATE schedules
-        SET control_mode = 'manual'
-        WHERE unit_id = ? AND active = 1
-    ''', (unit_id,))
+    # Push the change to the unit's WebSocket room and its device
+    publish_relays(payload, command)
 
-    db.commit()
+    return jsonify(payload)
 
-    # Broadcast update via WebSocket
-    socketio.emit('relay_update', {
-        'unit_id': unit_id,
-        'timestamp': timestamp,
-        'relays': {'lights': lights, 'fans': fans, 'pump': pump}
-    })
+# Relay history page size
+RELAY_HISTORY_LIMIT = 100
+RELAY_HISTORY_MAX_LIMIT = 1000
+
+@app.route('/units/<unit_id>/relays/history', methods=['GET'])
+def get_unit_relay_history(unit_id):
+    """Page through a unit's relay changes, newest first, with a keyset cursor"""
+    relay = request.args.get('relay')
+    if relay is not None and relay not in RELAY_NAMES:
+        return jsonify({'error': f'Unknown relay: {relay}'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', RELAY_HISTORY_LIMIT)), 1), RELAY_HISTORY_MAX_LIMIT)
+        cursor = request.args.get('cursor')
+        before = tuple(int(part) for part in cursor.split(':')) if cursor else None
+        if before is not None and len(before) != 2:
+            raise ValueError(cursor)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer and cursor a next_cursor value'}), 400
+
+    # One extra row tells whether there is another page
+    events = get_storage().relay_events(unit_id, limit + 1, before, relay)
+    next_cursor = None
+    if len(events) > limit:
+        events = events[:limit]
+        next_cursor = f"{events[-1]['timestamp']}:{events[-1]['id']}"
 
     return jsonify({
-        "unit_id": unit_id,
-        "timestamp": timestamp,
-        "relays": {"lights": lights, "fans": fans, "pump": pump}
+        'unit_id': unit_id,
+        'events': events,
+        'next_cursor': next_cursor
     })
 
 @app.route('/units/<unit_id>/schedule', methods=['GET'])
 def get_unit_schedule(unit_id):
     """Get schedule for a hydro unit"""
-    db = get_db()
-
-    schedules = db.execute('''
-        SELECT * FROM schedules
-        WHERE unit_id = ? AND active = 1
-    ''', (unit_id,)).fetchall()
-
-    result = {}
-    control_mode = 'timer'
-
-    for schedule in schedules:
-        schedule_data = json.loads(schedule['schedule_data'])
-        result.update(schedule_data)
-        control_mode = schedule['control_mode'] if schedule['control_mode'] else 'timer'
-
-    result['_control_mode'] = control_mode
-    return jsonify(result)
+    return etagged_json(get_storage().load_schedule(unit_id))
 
 @app.route('/units/<unit_id>/schedule', methods=['POST'])
 def update_unit_schedule(unit_id):
     """Update schedule for a hydro unit - switches to timer mode"""
     data = request.get_json()
-    db = get_db()
+    storage = get_storage()
 
-    # Deactivate old schedules
-    db.execute('UPDATE schedules SET active = 0 WHERE unit_id = ?', (unit_id,))
+    # Replace the active schedule; this switches the unit back to timer mode
+    schedule = {**data, '_control_mode': 'timer'}
+    storage.save_schedule(unit_id, data)
+    command = queue_device_command(storage, unit_id, 'schedule', schedule, int(time.time()))
+    storage.commit()
+    publish_schedule(unit_id, schedule)
+    announce_device_command(command)
 
-    # Insert new schedule with timer control mode
-    db.execute('''
-        INSERT INTO schedules (unit_id, schedule_type, schedule_data, control_mode)
-        VALUES (?, ?, ?, ?)
-    ''', (unit_id, 'time_schedule', json.dumps(data), 'timer'))
-    db.commit()
-
-    return jsonify({**data, '_control_mode': 'timer'})
+    return jsonify(schedule)
 
 
 @app.route('/room/front/sensors', methods=['GET'])
 def get_front_room_sensors():
     """Get front room sensor data"""
-    db = get_db()
+    storage = get_storage()
 
-    sensor = db.execute('''
-        SELECT * FROM room_sensors
-        WHERE unit_id = 'ROOM_FRONT'
-        ORDER BY timestamp DESC
-        LIMIT 1
-    ''', ).fetchone()
+    sensor = get_latest_room(storage, 'ROOM_FRONT')
 
     if not sensor:
         return jsonify({
@@ -388,29 +3214,14 @@ def get_front_room_sensors():
             "co2": 780
         })
 
-    return jsonify({
-        "unit_id": "ROOM_FRONT",
-        "timestamp": sensor['timestamp'],
-        "bme": {
-            "temp": sensor['temp'],
-            "humidity": sensor['humidity'],
-            "pressure": sensor['pressure'],
-            "iaq": sensor['iaq']
-        },
-        "co2": sensor['co2']
-    })
+    return latest_response(sensor)
 
 @app.route('/room/back/sensors', methods=['GET'])
 def get_back_room_sensors():
     """Get back room sensor data with AC info"""
-    db = get_db()
+    storage = get_storage()
 
-    sensor = db.execute('''
-        SELECT * FROM room_sensors
-        WHERE unit_id = 'ROOM_BACK'
-        ORDER BY timestamp DESC
-        LIMIT 1
-    ''', ).fetchone()
+    sensor = get_latest_room(storage, 'ROOM_BACK')
 
     if not sensor:
         return jsonify({
@@ -429,69 +3240,39 @@ def get_back_room_sensors():
             }
         })
 
-    return jsonify({
-        "unit_id": "ROOM_BACK",
-        "timestamp": sensor['timestamp'],
-        "bme": {
-            "temp": sensor['temp'],
-            "humidity": sensor['humidity'],
-            "pressure": sensor['pressure'],
-            "iaq": sensor['iaq']
-        },
-        "co2": sensor['co2'],
-        "ac": {
-            "current_set_temp": sensor['ac_temp'],
-            "mode": sensor['ac_mode']
-        }
-    })
+    return latest_response(sensor)
 
 @app.route('/room/back/ac_schedule', methods=['GET'])
 def get_ac_schedule():
     """Get AC hourly temperature schedule"""
-    db = get_db()
-
-    schedules = db.execute('''
-        SELECT hour, temperature FROM ac_schedules
-        WHERE active = 1
-        ORDER BY hour
-    ''').fetchall()
-
-    ac_schedule = {}
-    for schedule in schedules:
-        ac_schedule[schedule['hour']] = schedule['temperature']
+    ac_schedule = get_storage().load_ac_schedule()
 
-    return jsonify({"ac_schedule": ac_schedule})
+    return etagged_json({"ac_schedule": ac_schedule})
 
 @app.route('/room/back/ac_schedule', methods=['POST'])
 def update_ac_schedule():
     """Update AC hourly temperature schedule"""
     data = request.get_json()
-    db = get_db()
-
-    ac_schedule = data.get('ac_schedule', {})
+    storage = get_storage()
 
-    for hour, temp in ac_schedule.items():
-        db.execute('''
-            UPDATE ac_schedules
-            SET temperature = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE hour = ?
-        ''', (temp, hour))
-
-    db.commit()
+    storage.save_ac_schedule(data.get('ac_schedule', {}))
+    storage.commit()
+    publish_ac_schedule(storage.load_ac_schedule())
     return jsonify(data)
 
 # Camera API endpoints
 @app.route('/cameras/<unit_id>', methods=['GET'])
 def get_unit_cameras(unit_id):
     """Get camera status for a hydro unit"""
-    db = get_db()
+    storage = get_storage()
+
+    validators = camera_status_validator(storage, unit_id)
+    unchanged = not_modified(*validators)
+    if unchanged:
+        return unchanged
 
-    cameras = db.execute('''
-        SELECT camera_id, last_image_timestamp, total_images, status
-        FROM camera_status
-        WHERE unit_id = ?
-        ORDER BY camera_id
-    ''', (unit_id,)).fetchall()
+    cameras = storage.list_cameras(unit_id)
+    size = requested_image_size()
 
     camera_list = []
     for camera in cameras:
@@ -499,27 +3280,28 @@ def get_unit_cameras(unit_id):
             'camera_id': camera['camera_id'],
             'last_image_timestamp': camera['last_image_timestamp'],
             'total_images': camera['total_images'],
-            'status': camera['status']
+            'status': camera['status'],
+            'image_url': image_url(camera['last_image_path'], size),
+            'full_image_url': image_url(camera['last_image_path'])
         })
 
-    return jsonify({
+    return set_validators(jsonify({
         'unit_id': unit_id,
         'cameras': camera_list
-    })
+    }), *validators)
 
 @app.route('/cameras/<camera_id>/images', methods=['GET'])
 def get_camera_images(camera_id):
     """Get recent images from a specific camera"""
-    db = get_db()
+    storage = get_storage()
     limit = request.args.get('limit', 10, type=int)
 
-    images = db.execute('''
-        SELECT id, camera_id, timestamp, image_path, file_size
-        FROM camera_images
-        WHERE camera_id = ?
-        ORDER BY timestamp DESC
-        LIMIT ?
-    ''', (camera_id, limit)).fetchall()
+    validators = camera_status_validator(storage, camera_id=camera_id)
+    unchanged = not_modified(*validators)
+    if unchanged:
+        return unchanged
+
+    images = storage.camera_images(camera_id, limit)
 
     image_list = []
     for image in images:
@@ -529,13 +3311,14 @@ def get_camera_images(camera_id):
             'timestamp': image['timestamp'],
             'image_path': image['image_path'],
             'file_size': image['file_size'],
-            'url': f'/camera_images/{os.path.basename(image["image_path"])}'
+            'url': f'/camera_images/{os.path.basename(image["image_path"])}',
+            'thumbnail_url': image_url(image['image_path'], 'thumb')
         })
 
-    return jsonify({
+    return set_validators(jsonify({
         'camera_id': camera_id,
         'images': image_list
-    })
+    }), *validators)
 
 @app.route('/cameras/<camera_id>/upload', methods=['POST'])
 def upload_camera_image(camera_id):
@@ -548,7 +3331,7 @@ def upload_camera_image(camera_id):
         return jsonify({'error': 'No image file selected'}), 400
 
     if file and allowed_file(file.filename):
-        db = get_db()
+        storage = get_storage()
         timestamp = int(time.time())
 
         # Parse camera ID to get unit, level, position
@@ -558,31 +3341,21 @@ def upload_camera_image(camera_id):
         level = int(level_pos[0])
         position = int(level_pos[1])
 
-        # Generate secure filename
-        filename = f"{camera_id}_{timestamp}.jpg"
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-
-        # Save file
-        file.save(filepath)
-        file_size = os.path.getsize(filepath)
-
-        # Insert image record
-        db.execute('''
-            INSERT INTO camera_images
-            (camera_id, unit_id, level, position, image_path, timestamp, file_size)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (camera_id, unit_id, level, position, filepath, timestamp, file_size))
-
-        # Update camera status
-        db.execute('''
-            INSERT OR REPLACE INTO camera_status
-            (camera_id, unit_id, last_image_timestamp, total_images, status, updated_at)
-            VALUES (?, ?, ?,
-                COALESCE((SELECT total_images FROM camera_status WHERE camera_id = ?), 0) + 1,
-                'online', CURRENT_TIMESTAMP)
-        ''', (camera_id, unit_id, timestamp, camera_id))
-
-        db.commit()
+        try:
+            # Store the file under its content, insert the image record, count
+            # the reference and update camera status
+            filename, stored = store_camera_image(storage, {
+                'camera_id': camera_id, 'unit_id': unit_id, 'level': level, 'position': position,
+                'timestamp': timestamp
+            }, file.stream)
+            storage.commit()
+        except Exception:
+            storage.rollback()
+            raise
+
+        # Thumbnails are made in the background; a duplicate frame already has them
+        if stored:
+            thumbnail_workers.submit(filename)
 
         # Log successful upload
         print(f"Camera {camera_id} uploaded image at {timestamp}")
@@ -591,7 +3364,10 @@ def upload_camera_image(camera_id):
             'message': 'Image uploaded successfully',
             'camera_id': camera_id,
             'timestamp': timestamp,
-            'image_url': f'/camera_images/{filename}'
+            'image_url': f'/camera_images/{filename}',
+            'thumbnail_url': image_url(filename, 'thumb'),
+            'content_hash': filename[:64],
+            'duplicate': not stored
         })
 
     return jsonify({'error': 'Invalid file type'}), 400
@@ -607,35 +3383,23 @@ def post_unit_sensors(unit_id):
         if not data:
             return jsonify({"error": "Invalid JSON"}), 400
 
-        reservoir = data.get('reservoir', {})
-        climate = data.get('climate', {})
-
         timestamp = int(time.time())
-        db = get_db()
 
-        db.execute('''
-            INSERT INTO sensor_readings
-            (unit_id, timestamp, ph, tds, turbidity, water_temp, water_level, climate_data)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            unit_id,
-            timestamp,
-            reservoir.get('ph'),
-            reservoir.get('tds'),
-            reservoir.get('turbidity'),
-            reservoir.get('water_temp'),
-            reservoir.get('water_level'),
-            json.dumps(climate)
-        ))
+        try:
+            row = reading_row(unit_id, timestamp, data.get('reservoir'), data.get('climate'))
+        except ValueError as e:
+            return jsonify({"error": f"Reading {e}"}), 400
 
-        db.commit()
+        # Queue for the batched writer; cache update and broadcast happen on commit
+        try:
+            committed = ingest_queue.submit(row, wait=INGEST_DURABLE)
+        except IngestQueueFull:
+            response = jsonify({"error": "Ingest queue full, retry later"})
+            response.headers['Retry-After'] = str(INGEST_RETRY_AFTER)
+            return response, 503
 
-        # WebSocket broadcast
-        socketio.emit('sensor_update', {
-            'unit_id': unit_id,
-            'timestamp': timestamp,
-            'source': 'esp32'
-        })
+        if not committed:
+            return jsonify({"error": "Server error"}), 500
 
         return jsonify({
             "status": "success",
@@ -650,22 +3414,176 @@ def post_unit_sensors(unit_id):
 
 
 
+@app.route('/api/units/<unit_id>/commands', methods=['GET'])
+def poll_device_commands(unit_id):
+    """
+    Long-poll for commands to a unit's ESP32 newer than ?since=
+    """
+    try:
+        since = request.args.get('since')
+        since = int(since) if since is not None else None
+        timeout = float(request.args.get('timeout', DEVICE_POLL_TIMEOUT))
+    except ValueError:
+        return jsonify({"error": "since must be a command id and timeout a number of seconds"}), 400
+    timeout = min(max(timeout, 0), DEVICE_POLL_MAX_TIMEOUT)
+
+    storage = get_storage()
+    if since is None:
+        since = storage.last_acked_command(unit_id)
+    deadline = time.monotonic() + timeout
+    commands = storage.device_commands(unit_id, since)
+    while not commands:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        # Give the connection back while waiting; a thousand devices may be polling
+        close_db(None)
+        if not device_waiters.wait(unit_id, since, remaining):
+            break
+        commands = get_storage().device_commands(unit_id, since)
+
+    return jsonify({
+        "unit_id": unit_id,
+        "cursor": commands[-1]['id'] if commands else since,
+        "commands": commands
+    })
+
+@app.route('/api/units/<unit_id>/commands/ack', methods=['POST'])
+def ack_device_commands(unit_id):
+    """
+    Acknowledge every command to a unit's ESP32 up to the given id
+    """
+    data = request.get_json(silent=True) or {}
+    command_id = data.get('id')
+    if not isinstance(command_id, int) or isinstance(command_id, bool):
+        return jsonify({"error": "id must be a command id"}), 400
+
+    if not acknowledge_device_command(get_storage(), unit_id, command_id):
+        return jsonify({"error": f"Unknown command {command_id} for unit {unit_id}"}), 404
+
+    return jsonify({
+        "status": "success",
+        "unit_id": unit_id,
+        "acked": command_id
+    })
+
+# Bulk upload limit for buffered ESP32 readings
+MAX_BATCH_READINGS = 5000
+
+def is_reading_value(value):
+    """True for a number or null, the only values a sensor field may hold"""
+    return value is None or (isinstance(value, (int, float)) and not isinstance(value, bool))
+
+def reading_row(unit_id, timestamp, reservoir, climate):
+    """Build a reading dict from a posted reservoir and climate; raises ValueError if they are malformed"""
+    reservoir = {} if reservoir is None else reservoir
+    climate = {} if climate is None else climate
+    if not isinstance(reservoir, dict):
+        raise ValueError('has a reservoir that is not an object')
+    if not isinstance(climate, dict) or not all(isinstance(values, dict) for values in climate.values()):
+        raise ValueError('has a climate that is not an object of objects')
+
+    values = [reservoir.get(field) for field in READING_ROLLUP_METRICS]
+    values += [position.get(field) for position in climate.values() for field in ('temp', 'humidity')]
+    if not all(is_reading_value(value) for value in values):
+        raise ValueError('has a sensor value that is not a number')
+
+    row = {'unit_id': unit_id, 'timestamp': timestamp, 'climate': climate}
+    for field in READING_ROLLUP_METRICS:
+        row[field] = reservoir.get(field)
+    return row
+
+def parse_batch_readings(default_unit_id=None):
+    """Parse a JSON array, {"readings": [...]} or NDJSON body into reading dicts"""
+    content_type = request.mimetype or ''
+    if content_type in ('application/x-ndjson', 'application/jsonl', 'application/jsonlines'):
+        text = request.get_data(as_text=True)
+        readings = [json.loads(line) for line in text.splitlines() if line.strip()]
+    else:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            data = data.get('readings')
+        if not isinstance(data, list):
+            raise ValueError('Expected a JSON array of readings or newline-delimited JSON')
+        readings = data
+
+    rows = []
+    for index, reading in enumerate(readings):
+        if not isinstance(reading, dict):
+            raise ValueError(f'Reading {index} is not an object')
+        unit_id = reading.get('unit_id', default_unit_id)
+        if not unit_id:
+            raise ValueError(f'Reading {index} has no unit_id')
+        timestamp = reading.get('timestamp', int(time.time()))
+        if not isinstance(timestamp, (int, float)) or isinstance(timestamp, bool) or timestamp <= 0:
+            raise ValueError(f'Reading {index} has an invalid timestamp')
+
+        try:
+            row = reading_row(unit_id, int(timestamp), reading.get('reservoir'), reading.get('climate'))
+        except ValueError as e:
+            raise ValueError(f'Reading {index} {e}')
+        # Only readings the device stamped itself are checked for replays
+        row['client_timestamped'] = 'timestamp' in reading
+        rows.append(row)
+    return rows
+
+@app.route('/api/sensors/batch', methods=['POST'])
+@app.route('/api/units/<unit_id>/sensors/batch', methods=['POST'])
+def post_sensor_batch(unit_id=None):
+    """
+    Receive buffered sensor readings from one or more ESP32 units in one request
+    """
+    try:
+        try:
+            rows = parse_batch_readings(unit_id)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if not rows:
+            return jsonify({"error": "No readings provided"}), 400
+        if len(rows) > MAX_BATCH_READINGS:
+            return jsonify({"error": f"Too many readings (max {MAX_BATCH_READINGS})"}), 413
+
+        # Dedupe device-stamped readings within the batch, keeping the last per (unit_id, timestamp)
+        unique = {}
+        for index, row in enumerate(rows):
+            unique[(row['unit_id'], row['timestamp']) if row['client_timestamped'] else index] = row
+        rows = sorted(unique.values(), key=lambda r: r['timestamp'])
+
+        storage = get_storage()
+        # Readings already stored (e.g. a replay after a lost response) are skipped by the insert
+        inserted = storage.insert_sensor_readings(rows)
+        storage.commit()
+
+        # One coalesced update per unit for the whole batch, from the rows actually stored
+        latest = {row['unit_id']: row for row in inserted}
+        for row in latest.values():
+            publish_latest('sensors', row['unit_id'], sensor_payload(row, row['climate']), source='esp32_batch')
+
+        return jsonify({
+            "status": "success",
+            "received": len(unique),
+            "inserted": len(inserted),
+            "duplicates": len(unique) - len(inserted),
+            "units": sorted({row['unit_id'] for row in rows})
+        }), 200
+
+    except Exception as e:
+        print("ESP32 SENSOR BATCH ERROR:", e)
+        return jsonify({"error": "Server error"}), 500
+
 @app.route('/units/<unit_id>/cameras/latest', methods=['GET'])
 def get_unit_latest_images(unit_id):
     """Get latest image from each camera in a unit"""
-    db = get_db()
+    storage = get_storage()
 
-    images = db.execute('''
-        SELECT DISTINCT ci.camera_id, ci.timestamp, ci.image_path, ci.level, ci.position
-        FROM camera_images ci
-        INNER JOIN (
-            SELECT camera_id, MAX(timestamp) as max_timestamp
-            FROM camera_images
-            WHERE unit_id = ?
-            GROUP BY camera_id
-        ) latest ON ci.camera_id = latest.camera_id AND ci.timestamp = latest.max_timestamp
-        ORDER BY ci.level, ci.position
-    ''', (unit_id,)).fetchall()
+    validators = camera_status_validator(storage, unit_id)
+    unchanged = not_modified(*validators)
+    if unchanged:
+        return unchanged
+
+    images = storage.latest_camera_images(unit_id)
+    size = requested_image_size()
 
     camera_grid = {}
     for image in images:
@@ -676,31 +3594,52 @@ def get_unit_latest_images(unit_id):
         camera_grid[level][f"pos{image['position']}"] = {
             'camera_id': image['camera_id'],
             'timestamp': image['timestamp'],
-            'image_url': f'/camera_images/{os.path.basename(image["image_path"])}'
+            'image_url': image_url(image['image_path'], size),
+            'full_image_url': image_url(image['image_path'])
         }
 
-    return jsonify({
+    return set_validators(jsonify({
         'unit_id': unit_id,
         'camera_grid': camera_grid
-    })
+    }), *validators)
 
 # Serve camera images
 @app.route('/camera_images/<filename>')
 def serve_camera_image(filename):
-    """Serve camera images"""
-    from flask import send_from_directory
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    """Serve camera images; ?size=thumb or ?size=preview for a downscaled copy"""
+    size = request.args.get('size', 'full')
+    if size != 'full' and size not in THUMBNAIL_SIZES:
+        return jsonify({'error': f"Invalid size, use one of: full, {', '.join(THUMBNAIL_SIZES)}"}), 400
+    if safe_join(UPLOAD_FOLDER, filename) is None:
+        return jsonify({'error': 'Image not found'}), 404
+    # Store files are named by their content, which makes the hash a strong ETag
+    etag = filename[:64] if CONTENT_FILENAME.match(filename) else True
+    if size == 'full':
+        return send_image(UPLOAD_FOLDER, image_file_name(filename), etag)
+
+    if not os.path.isfile(thumbnail_path(filename, size)):
+        try:
+            rendered = render_thumbnail(filename, size)
+        except Exception as e:
+            print(f"Thumbnail {size} of {filename} failed: {e}")
+            rendered = None
+        if not rendered:
+            # No Pillow, or an unreadable original: send what we have
+            return send_image(UPLOAD_FOLDER, image_file_name(filename), etag, immutable=False)
+    return send_image(os.path.join(THUMBNAIL_FOLDER, size), thumbnail_name(filename))
 
 @app.route('/cameras/status', methods=['GET'])
 def get_all_cameras_status():
     """Get status of all cameras across all units"""
-    db = get_db()
+    storage = get_storage()
 
-    cameras = db.execute('''
-        SELECT camera_id, unit_id, last_image_timestamp, total_images, status
-        FROM camera_status
-        ORDER BY unit_id, camera_id
-    ''').fetchall()
+    validators = camera_status_validator(storage)
+    unchanged = not_modified(*validators)
+    if unchanged:
+        return unchanged
+
+    cameras = storage.list_cameras()
+    size = requested_image_size()
 
     camera_summary = {}
     for camera in cameras:
@@ -712,22 +3651,151 @@ def get_all_cameras_status():
             'camera_id': camera['camera_id'],
             'last_image_timestamp': camera['last_image_timestamp'],
             'total_images': camera['total_images'],
-            'status': camera['status']
+            'status': camera['status'],
+            'image_url': image_url(camera['last_image_path'], size),
+            'full_image_url': image_url(camera['last_image_path'])
         })
 
-    return jsonify({
+    return set_validators(jsonify({
         'timestamp': int(time.time()),
         'total_units': len(camera_summary),
         'total_cameras': len(cameras),
         'units': camera_summary
+    }), *validators)
+
+# Cameras count as online if they sent an image within this many seconds
+CAMERA_ONLINE_WINDOW = 300
+
+@app.route('/dashboard/snapshot', methods=['GET'])
+def get_dashboard_snapshot():
+    """Get everything the overview page shows in one response.
+
+    Latest readings come from the latest-state cache; schedules and camera
+    status are read through this request's storage connection. The body carries a
+    strong ETag, so a client sending If-None-Match gets a bodiless 304 while
+    nothing has changed.
+    """
+    storage = get_storage()
+    online_since = int(time.time()) - CAMERA_ONLINE_WINDOW
+
+    units = {}
+    for unit in storage.list_units():
+        unit_id = unit['unit_id']
+        units[unit_id] = {
+            'name': unit['name'],
+            'type': unit['type'],
+            'sensors': get_latest_sensor(storage, unit_id),
+            'relays': get_latest_relay(storage, unit_id),
+            'schedule': storage.load_schedule(unit_id)
+        }
+
+    rooms = {
+        'front': get_latest_room(storage, ROOM_IDS['front']),
+        'back': get_latest_room(storage, ROOM_IDS['back'])
+    }
+
+    cameras = {}
+    for camera in storage.list_cameras():
+        summary = cameras.setdefault(camera['unit_id'], {'total': 0, 'online': 0, 'last_image_timestamp': None})
+        last_image = camera['last_image_timestamp']
+        summary['total'] += 1
+        if last_image is not None and last_image >= online_since:
+            summary['online'] += 1
+        if last_image is not None and (summary['last_image_timestamp'] is None
+                                       or last_image > summary['last_image_timestamp']):
+            summary['last_image_timestamp'] = last_image
+
+    return etagged_json({
+        'units': units,
+        'rooms': rooms,
+        'cameras': {
+            'total': sum(c['total'] for c in cameras.values()),
+            'online': sum(c['online'] for c in cameras.values()),
+            'units': cameras
+        }
     })
 
 # Export endpoints
+
+# Rows fetched from SQLite per streamed chunk
+EXPORT_CHUNK_ROWS = 1000
+# Bytes read from an image file per streamed ZIP chunk
+EXPORT_FILE_CHUNK = 64 * 1024
+
+class ZipStreamBuffer(io.RawIOBase):
+    """Write-only, non-seekable sink for zipfile that hands bytes back via drain()
+
+    Because seek() is unsupported, zipfile writes entries with data
+    descriptors and never goes back to patch headers, so the archive can be
+    sent as it is produced.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        """Return and forget everything written since the last drain"""
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+# Rollup metric -> export column; air temp/humidity average every climate position
+EXPORT_ROLLUP_COLUMNS = ['ph', 'tds', 'turbidity', 'water_temp', 'water_level', 'air_temp', 'humidity']
+EXPORT_ROLLUP_METRICS = [('ph', 'ph'), ('tds', 'tds'), ('turbidity', 'turbidity'),
+                         ('water_temp', 'water_temp'), ('water_level', 'water_level'),
+                         ('temp', 'air_temp'), ('humidity', 'humidity')]
+
+def metered(chunks, export_format):
+    """Pass a streamed export's chunks through as bytes, counting them in export_bytes"""
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        export_bytes.inc(len(chunk), export_format)
+        yield chunk
+
+def rollup_export_query(unit, start_time, end_time, resolution, interval_seconds):
+    """Build the per-interval sensor export query over one rollup resolution"""
+    averages = ',\n'.join(
+        f"ROUND(SUM(CASE WHEN metric = '{metric}' THEN sum_value END) / "
+        f"SUM(CASE WHEN metric = '{metric}' THEN count END), 3) AS {column}"
+        for metric, column in EXPORT_ROLLUP_METRICS
+    )
+    if unit == 'ALL':
+        unit_filter = f"unit_id NOT IN ({', '.join('?' for _ in ROOM_IDS)})"
+        unit_params = list(ROOM_IDS.values())
+    else:
+        unit_filter = 'unit_id = ?'
+        unit_params = [unit]
+
+    query = f'''
+        SELECT unit_id, (bucket / ?) * ? AS timestamp,
+               {averages}
+        FROM sensor_rollups
+        WHERE resolution = ? AND {unit_filter} AND bucket BETWEEN ? AND ?
+        GROUP BY unit_id, (bucket / ?) * ?
+        ORDER BY timestamp DESC
+    '''
+    params = [interval_seconds, interval_seconds, resolution] + unit_params + \
+             [start_time - start_time % resolution, end_time, interval_seconds, interval_seconds]
+    return query, params
+
 @app.route('/export/sensors/csv', methods=['GET'])
+@sqlite_only
 def export_sensors_csv():
-    """Export sensor data as CSV"""
+    """Export sensor data as a streamed CSV"""
     import csv
-    import io
     from datetime import datetime, timedelta
 
     unit = request.args.get('unit', 'ALL')
@@ -768,10 +3836,29 @@ def export_sensors_csv():
     else:
         start_time = end_time - (7 * 86400)  # Default to last 7 days
 
+    # Optional aggregation interval (1m/1h/1d or seconds), served from rollups
+    interval = request.args.get('interval', 'raw')
+    resolution = None
+    if interval != 'raw':
+        try:
+            interval_seconds = ROLLUP_RESOLUTIONS.get(interval) or int(interval)
+        except ValueError:
+            return jsonify({'error': f'Invalid interval: {interval}'}), 400
+        resolution = pick_rollup_resolution(interval_seconds, start_time)
+        if resolution:
+            interval_seconds = rollup_bucket_seconds(interval_seconds, resolution)
+
     # Build query
-    if unit == 'ALL':
+    if resolution:
+        query, params = rollup_export_query(unit, start_time, end_time, resolution, interval_seconds)
+        header = ['Unit ID', 'Timestamp', 'DateTime', 'pH', 'TDS (ppm)', 'Turbidity (NTU)',
+                  'Water Temp (°C)', 'Water Level (%)', 'Air Temp (°C)', 'Humidity (%)']
+        value_columns = EXPORT_ROLLUP_COLUMNS
+    elif unit == 'ALL':
         query = '''
-            SELECT unit_id, timestamp, ph, tds, turbidity, water_temp, water_level, climate_data
+            SELECT unit_id, timestamp, ph, tds, turbidity, water_temp, water_level,
+                (SELECT json_group_object(position, json_object('temp', temp, 'humidity', humidity))
+                 FROM climate_readings WHERE reading_id = sensor_readings.id) AS climate_data
             FROM sensor_readings
             WHERE timestamp BETWEEN ? AND ?
             ORDER BY timestamp DESC
@@ -779,56 +3866,63 @@ def export_sensors_csv():
         params = (start_time, end_time)
     else:
         query = '''
-            SELECT unit_id, timestamp, ph, tds, turbidity, water_temp, water_level, climate_data
+            SELECT unit_id, timestamp, ph, tds, turbidity, water_temp, water_level,
+                (SELECT json_group_object(position, json_object('temp', temp, 'humidity', humidity))
+                 FROM climate_readings WHERE reading_id = sensor_readings.id) AS climate_data
             FROM sensor_readings
             WHERE unit_id = ? AND timestamp BETWEEN ? AND ?
             ORDER BY timestamp DESC
         '''
         params = (unit, start_time, end_time)
 
-    readings = db.execute(query, params).fetchall()
-
-    # Create CSV
-    output = io.StringIO()
-    writer = csv.writer(output)
-
-    # Write header
-    header = ['Unit ID', 'Timestamp', 'DateTime', 'pH', 'TDS (ppm)', 'Turbidity (NTU)',
-              'Water Temp (°C)', 'Water Level (%)', 'Climate Data']
-    writer.writerow(header)
-
-    # Write data
-    for reading in readings:
-        timestamp = reading['timestamp']
-        dt = datetime.fromtimestamp(timestamp)
-
-        row = [
-            reading['unit_id'],
-            timestamp,
-            dt.strftime('%Y-%m-%d %H:%M:%S'),
-            reading['ph'],
-            reading['tds'],
-            reading['turbidity'],
-            reading['water_temp'],
-            reading['water_level'],
-            reading['climate_data'] or '{}'
-        ]
-        writer.writerow(row)
-
-    output.seek(0)
+    if not resolution:
+        header = ['Unit ID', 'Timestamp', 'DateTime', 'pH', 'TDS (ppm)', 'Turbidity (NTU)',
+                  'Water Temp (°C)', 'Water Level (%)', 'Climate Data']
+        value_columns = ['ph', 'tds', 'turbidity', 'water_temp', 'water_level', 'climate_data']
+
+    cursor = db.execute(query, params)
+
+    def generate():
+        # csv.writer needs a file; this one hands each formatted row straight back
+        class RowBuffer:
+            def write(self, value):
+                return value
+
+        writer = csv.writer(RowBuffer())
+
+        # Write header
+        yield writer.writerow(header)
+
+        # Write data one fetchmany() chunk at a time so memory stays flat
+        while True:
+            readings = cursor.fetchmany(EXPORT_CHUNK_ROWS)
+            if not readings:
+                break
+
+            lines = []
+            for reading in readings:
+                timestamp = reading['timestamp']
+                dt = datetime.fromtimestamp(timestamp)
+
+                row = [
+                    reading['unit_id'],
+                    timestamp,
+                    dt.strftime('%Y-%m-%d %H:%M:%S')
+                ] + [reading[column] for column in value_columns]
+                lines.append(writer.writerow(row))
+            yield ''.join(lines)
 
     return Response(
-        output.getvalue(),
+        stream_with_context(metered(generate(), 'csv')),
         mimetype='text/csv',
         headers={'Content-Disposition': f'attachment; filename=sensor-data-{unit}-{date_range}.csv'}
     )
 
 @app.route('/export/images/zip', methods=['GET'])
+@sqlite_only
 def export_images_zip():
-    """Export camera images as ZIP"""
+    """Export camera images as a streamed ZIP"""
     import zipfile
-    import io
-    import glob
     from datetime import datetime, timedelta
 
     unit = request.args.get('unit', 'ALL')
@@ -872,7 +3966,7 @@ def export_images_zip():
     # Get image records from database
     if unit == 'ALL':
         query = '''
-            SELECT camera_id, timestamp, image_path
+            SELECT id, camera_id, timestamp, image_path
             FROM camera_images
             WHERE timestamp BETWEEN ? AND ?
             ORDER BY camera_id, timestamp
@@ -880,63 +3974,241 @@ def export_images_zip():
         params = (start_time, end_time)
     else:
         query = '''
-            SELECT camera_id, timestamp, image_path
+            SELECT id, camera_id, timestamp, image_path
             FROM camera_images
             WHERE camera_id LIKE ? AND timestamp BETWEEN ? AND ?
             ORDER BY camera_id, timestamp
         '''
         params = (f'{unit}%', start_time, end_time)
 
-    images = db.execute(query, params).fetchall()
+    cursor = db.execute(query, params)
+    first_batch = cursor.fetchmany(EXPORT_CHUNK_ROWS)
 
-    if not images:
+    if not first_batch:
         return jsonify({'error': 'No images found for the specified criteria'}), 404
 
-    # Create ZIP file in memory
-    zip_buffer = io.BytesIO()
+    def image_batches():
+        batch = first_batch
+        while batch:
+            yield batch
+            batch = cursor.fetchmany(EXPORT_CHUNK_ROWS)
+
+    def generate():
+        # Stream the ZIP as it is written; JPEGs are already compressed, so store them
+        buffer = ZipStreamBuffer()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as zip_file:
+            for images in image_batches():
+                for image in images:
+                    camera_id = image['camera_id']
+                    timestamp = image['timestamp']
+                    image_path = image['image_path']
+
+                    # Extract unit from camera_id (e.g., DWC1L11 -> DWC1)
+                    unit_id = camera_id[:camera_id.index('L')] if 'L' in camera_id else 'UNKNOWN'
+
+                    # Create organized path in ZIP
+                    dt = datetime.fromtimestamp(timestamp)
+                    date_str = dt.strftime('%Y-%m-%d')
+                    time_str = dt.strftime('%H-%M-%S')
+
+                    # The image id keeps two uploads within one second apart
+                    extension = os.path.splitext(image_path)[1] or '.jpg'
+                    zip_path = f"{unit_id}/{camera_id}/{date_str}/{camera_id}_{time_str}_{image['id']}{extension}"
+
+                    # Add file to ZIP
+                    try:
+                        full_path = os.path.join(app.root_path, image_path)
+                        if not os.path.exists(full_path):
+                            print(f"Warning: Image file not found: {full_path}")
+                            continue
+
+                        zip_info = zipfile.ZipInfo.from_file(full_path, zip_path, strict_timestamps=False)
+                        zip_info.compress_type = zipfile.ZIP_STORED
+                        with open(full_path, 'rb') as source, zip_file.open(zip_info, 'w') as entry:
+                            while True:
+                                chunk = source.read(EXPORT_FILE_CHUNK)
+                                if not chunk:
+                                    break
+                                entry.write(chunk)
+                                yield buffer.drain()
+                    except Exception as e:
+                        print(f"Error adding image to ZIP: {e}")
+
+                    yield buffer.drain()
+
+        # Central directory
+        yield buffer.drain()
 
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        for image in images:
-            camera_id = image['camera_id']
-            timestamp = image['timestamp']
-            image_path = image['image_path']
+    return Response(
+        stream_with_context(metered(generate(), 'zip')),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename=camera-images-{unit}-{date_range}.zip'}
+    )
 
-            # Extract unit from camera_id (e.g., DWC1L11 -> DWC1)
-            unit_id = camera_id[:camera_id.index('L')] if 'L' in camera_id else 'UNKNOWN'
+@app.route('/cache/invalidate', methods=['POST'])
+def invalidate_latest_cache():
+    """Drop cached latest-state entries after an out-of-process write"""
+    data = request.get_json(silent=True) or {}
+    kind = data.get('kind')
+    key = data.get('key')
 
-            # Create organized path in ZIP
-            dt = datetime.fromtimestamp(timestamp)
-            date_str = dt.strftime('%Y-%m-%d')
-            time_str = dt.strftime('%H-%M-%S')
+    if kind is not None and kind not in ('sensors', 'relays', 'rooms'):
+        return jsonify({'error': f'Unknown cache kind: {kind}'}), 400
 
-            zip_path = f"{unit_id}/{camera_id}/{date_str}/{camera_id}_{time_str}.jpg"
+    dropped = latest_cache.invalidate(kind, key)
+    return jsonify({'invalidated': dropped})
 
-            # Add file to ZIP
-            try:
-                full_path = os.path.join(app.root_path, image_path)
-                if os.path.exists(full_path):
-                    zip_file.write(full_path, zip_path)
-                else:
-                    print(f"Warning: Image file not found: {full_path}")
-            except Exception as e:
-                print(f"Error adding image to ZIP: {e}")
+@app.route('/retention/report', methods=['GET'])
+@sqlite_only
+def get_retention_report():
+    """Get the result of the last retention run"""
+    return jsonify({
+        'policy_days': RETENTION_DAYS,
+        'rollup_policy_days': ROLLUP_RETENTION_DAYS,
+        'last_run': retention_report or None
+    })
 
-    zip_buffer.seek(0)
+@app.route('/db/pool', methods=['GET'])
+@sqlite_only
+def get_db_pool_stats():
+    """Get database connection pool counters for this process"""
+    return jsonify(db_pool.snapshot())
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Get this process's metrics in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({'status': 'ok', 'timestamp': int(time.time())})
+
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """Readiness: the database answers, its schema is current and the ingest queue has room"""
+    checks = {}
+    try:
+        get_storage().ping()
+        checks['database'] = 'ok'
+        if not STORAGE_URL:
+            version = get_db().execute('SELECT MAX(version) FROM schema_migrations').fetchone()[0]
+            latest = MIGRATIONS[-1][0]
+            checks['schema'] = 'ok' if version == latest else f'at version {version}, expected {latest}'
+    except Exception as e:
+        checks['database'] = f'error: {e}'
+    depth = ingest_queue.depth()
+    checks['ingest_queue'] = 'ok' if depth < INGEST_QUEUE_SIZE else f'full ({depth} rows)'
+
+    ready = all(check == 'ok' for check in checks.values())
+    return jsonify({'status': 'ready' if ready else 'not ready', 'checks': checks}), 200 if ready else 503
+
+@app.route('/debug/slow-queries', methods=['GET'])
+@sqlite_only
+def get_slow_queries():
+    """Get this process's newest slow queries with their plans"""
+    return jsonify({'threshold_ms': SLOW_QUERY_MS, 'queries': list(reversed(slow_queries))})
+
+# Sampling profiler
+#
+# GET /debug/profile?seconds=10 records every thread's Python stack each
+# interval_ms for that long and answers with the counts in the collapsed
+# format flamegraph.pl, inferno and speedscope read: one
+# "thread;outermost;...;innermost count" line per distinct stack. Stacks are
+# sampled whether running or waiting, so idle threads show up under their
+# own root. The sampler is an OS thread even under eventlet, where it then
+# sees whichever greenlet holds the worker. It only exists while a profile is
+# being taken, and the endpoint answers 403 unless HYDRO_PROFILER=1.
+PROFILER_ENABLED = os.environ.get('HYDRO_PROFILER') == '1'
+PROFILE_SECONDS = 10
+PROFILE_MAX_SECONDS = 120
+PROFILE_INTERVAL_MS = 10
+profile_lock = threading.Lock()
+
+def native_threading():
+    """The threading and time modules as they were before eventlet patched them"""
+    if ASYNC_MODE == 'eventlet':
+        from eventlet import patcher
+        return patcher.original('threading'), patcher.original('time')
+    return threading, time
+
+def frame_label(code):
+    """function (dir/file.py:first line) for a code object"""
+    path = code.co_filename.replace(os.sep, '/').rsplit('/', 2)
+    return f"{code.co_name} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+
+def sample_stacks(seconds, interval, skip=()):
+    """Count the collapsed Python stack of every other thread every `interval` seconds for `seconds`"""
+    os_threading, os_time = native_threading()
+    skip = {os_threading.get_ident(), *skip}
+    names = {thread.ident: thread.name for thread in (*threading.enumerate(), *os_threading.enumerate())}
+    labels = {}
+    stacks = collections.Counter()
+    deadline = os_time.monotonic() + seconds
+    while os_time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident in skip:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                label = labels.get(code)
+                if label is None:
+                    label = labels[code] = frame_label(code)
+                stack.append(label)
+                frame = frame.f_back
+            stack.append(names.get(ident, f'thread-{ident}'))
+            stacks[';'.join(reversed(stack))] += 1
+        os_time.sleep(interval)
+    return stacks
+
+@app.route('/debug/profile', methods=['GET'])
+def get_profile():
+    """Sample this process's stacks for a few seconds and return them collapsed for a flamegraph"""
+    if not PROFILER_ENABLED:
+        return jsonify({'error': 'Profiler is disabled; start the server with HYDRO_PROFILER=1'}), 403
+    try:
+        seconds = float(request.args.get('seconds', PROFILE_SECONDS))
+        interval_ms = float(request.args.get('interval_ms', PROFILE_INTERVAL_MS))
+    except ValueError:
+        return jsonify({'error': 'seconds and interval_ms must be numbers'}), 400
+    if not 0 < seconds <= PROFILE_MAX_SECONDS or not 1 <= interval_ms <= 1000:
+        return jsonify({'error': f'seconds must be in (0, {PROFILE_MAX_SECONDS}] and interval_ms in [1, 1000]'}), 400
+    if not profile_lock.acquire(blocking=False):
+        return jsonify({'error': 'A profile is already being taken'}), 409
 
-    return Response(
-        zip_buffer.read(),
-        mimetype='application/zip',
-        headers={'Content-Disposition': f'attachment; filename=camera-images-{unit}-{date_range}.zip'}
-    )
+    try:
+        result = {}
+        # A threaded server's request thread would only show itself waiting here;
+        # under eventlet its OS thread is the whole worker
+        skip = () if ASYNC_MODE == 'eventlet' else (threading.get_ident(),)
+        os_threading, _ = native_threading()
+        sampler = os_threading.Thread(
+            target=lambda: result.update(stacks=sample_stacks(seconds, interval_ms / 1000, skip)),
+            name='profiler', daemon=True)
+        sampler.start()
+        # Poll rather than join, so under eventlet the worker keeps serving meanwhile
+        while sampler.is_alive():
+            time.sleep(0.05)
+    finally:
+        profile_lock.release()
+
+    stacks = result.get('stacks', {})
+    body = ''.join(f'{stack} {count}\n' for stack, count in sorted(stacks.items()))
+    filename = f'profile-{os.getpid()}-{int(time.time())}.folded'
+    return Response(body, mimetype='text/plain',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
 
 # WebSocket events
 @socketio.on('connect')
 def handle_connect():
+    socketio_clients.inc()
     print(f'Client connected: {request.sid}')
     emit('connected', {'data': 'Connected to hydroponics system'})
 
 @socketio.on('disconnect')
 def handle_disconnect():
+    socketio_clients.dec()
     print(f'Client disconnected: {request.sid}')
 
 @socketio.on('join_unit')
@@ -944,6 +4216,8 @@ def handle_join_unit(data):
     unit_id = data['unit_id']
     join_room(unit_id)
     emit('joined', {'unit_id': unit_id})
+    # Initial full state; later updates in this room are deltas
+    emit('unit_snapshot', unit_snapshot(get_storage(), unit_id))
 
 @socketio.on('leave_unit')
 def handle_leave_unit(data):
@@ -951,14 +4225,648 @@ def handle_leave_unit(data):
     leave_room(unit_id)
     emit('left', {'unit_id': unit_id})
 
+@socketio.on('ack_command')
+def handle_ack_command(data):
+    # The return value answers the client's ack callback
+    unit_id = data['unit_id']
+    if not acknowledge_device_command(get_storage(), unit_id, data['id']):
+        return {'error': f"Unknown command {data['id']} for unit {unit_id}"}
+    return {'unit_id': unit_id, 'acked': data['id']}
+
+# Retention
+#
+# Raw readings, relay history, device commands, camera images and
+# fine-grained rollups are deleted once older than their retention window
+# (days; None keeps forever).
+# Deletes run in small batches with a commit and a short pause between them
+# so the ingest writer is never blocked for long. Before raw readings are
+# dropped, any of their buckets missing from sensor_rollups are filled in, so
+# long-range history survives the purge; this too runs a unit and a day at a
+# time, and skips resolutions whose own retention has passed. Freed pages are returned with
+# incremental vacuum.
+RETENTION_DAYS = {
+    'sensor_readings': 90,
+    'climate_readings': 90,
+    'room_sensors': 90,
+    'relay_events': 365,
+    'device_commands': 30,
+    'camera_images': 30,
+}
+ROLLUP_RETENTION_DAYS = {'1m': 30, '1h': 365, '1d': None}
+RETENTION_AGGREGATE = True
+RETENTION_BATCH_SIZE = 1000
+RETENTION_BATCH_PAUSE = 0.05
+RETENTION_AGGREGATE_WINDOW = 86400  # a whole number of days, so no 1d bucket is split
+RETENTION_INTERVAL = 3600
+ORPHAN_IMAGE_GRACE = 86400
+
+retention_report = {}
+
+def retention_cutoff(days, now):
+    """Start of the oldest day to keep"""
+    cutoff = now - days * 86400
+    return cutoff - cutoff % 86400
+
+def purge_batches(db, delete_sql, params):
+    """Run a LIMIT-ed delete repeatedly, committing each batch; returns rows deleted"""
+    total = 0
+    while True:
+        deleted = db.execute(delete_sql, params + (RETENTION_BATCH_SIZE,)).rowcount
+        db.commit()
+        total += deleted
+        if deleted < RETENTION_BATCH_SIZE:
+            return total
+        time.sleep(RETENTION_BATCH_PAUSE)
+
+def table_units(db, table):
+    """Distinct unit_ids of a raw table, stepping through its (unit_id, timestamp) index"""
+    units = []
+    unit_id = db.execute(f'SELECT MIN(unit_id) FROM {table}').fetchone()[0]
+    while unit_id is not None:
+        units.append(unit_id)
+        unit_id = db.execute(f'SELECT MIN(unit_id) FROM {table} WHERE unit_id > ?', (unit_id,)).fetchone()[0]
+    return units
+
+def aggregate_before_purge(db, table, cutoff, now):
+    """Fill missing rollup buckets for raw rows older than cutoff, committing each unit and window"""
+    sources = [source for source in ROLLUP_SOURCES if source[0] == table]
+    # Buckets older than a resolution's own retention would only be purged again
+    since = {}
+    for name, resolution in ROLLUP_RESOLUTIONS.items():
+        days = ROLLUP_RETENTION_DAYS.get(name)
+        since[resolution] = retention_cutoff(days, now) if days is not None else 0
+    since = {resolution: start for resolution, start in since.items() if start < cutoff}
+    if not since:
+        return
+
+    for unit_id in table_units(db, table):
+        oldest = db.execute(f'SELECT MIN(timestamp) FROM {table} WHERE unit_id = ?', (unit_id,)).fetchone()[0]
+        start = max(oldest - oldest % RETENTION_AGGREGATE_WINDOW, min(since.values()))
+        while start < cutoff:
+            end = min(start + RETENTION_AGGREGATE_WINDOW, cutoff)
+            resolutions = [resolution for resolution, first in since.items() if first <= start]
+            rollup_from_raw(db, sources, start, end, 'ON CONFLICT DO NOTHING', resolutions, unit_id)
+            db.commit()
+            time.sleep(RETENTION_BATCH_PAUSE)
+            start = end
+
+def purge_camera_images(db, cutoff):
+    """Delete old camera_images rows, dropping files no row refers to any more; returns (rows, bytes)"""
+    rows = 0
+    freed = 0
+    while True:
+        images = db.execute('''
+            SELECT id, image_path, content_hash FROM camera_images
+            WHERE timestamp < ?
+            LIMIT ?
+        ''', (cutoff, RETENTION_BATCH_SIZE)).fetchall()
+        if not images:
+            return rows, freed
+        db.executemany('DELETE FROM camera_images WHERE id = ?', [(image['id'],) for image in images])
+        rows += len(images)
+
+        # Files from before the content-addressed store have no refcount; keep
+        # one while any remaining row still names it
+        unreferenced = [image_path for image_path in {image['image_path'] for image in images
+                                                      if not image['content_hash']}
+                        if not db.execute('SELECT 1 FROM camera_images WHERE image_path = ? LIMIT 1',
+                                          (image_path,)).fetchone()]
+        released = {}
+        for image in images:
+            if image['content_hash']:
+                released.setdefault(image['content_hash'], [0, image['image_path']])[0] += 1
+        for content_hash, (count, image_path) in released.items():
+            refcount = db.execute('''
+                UPDATE image_blobs SET refcount = refcount - ?
+                WHERE content_hash = ?
+                RETURNING refcount
+            ''', (count, content_hash)).fetchone()
+            if refcount is None or refcount[0] <= 0:
+                db.execute('DELETE FROM image_blobs WHERE content_hash = ?', (content_hash,))
+                unreferenced.append(image_path)
+
+        repoint_latest_images(db)
+
+        # Remove files before committing: an upload of the same bytes waits
+        # for this transaction, then finds the file gone and stores it again
+        for image_path in unreferenced:
+            freed += remove_image_file(image_path)
+        db.commit()
+        time.sleep(RETENTION_BATCH_PAUSE)
+
+def repoint_latest_images(db):
+    """Point cameras whose latest image row was deleted at their newest remaining one"""
+    stale = db.execute('''
+        SELECT camera_id FROM camera_status cs
+        WHERE last_image_id IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM camera_images ci WHERE ci.id = cs.last_image_id)
+    ''').fetchall()
+    for camera in stale:
+        latest = db.execute('''
+            SELECT id, timestamp, image_path FROM camera_images
+            WHERE camera_id = ?
+            ORDER BY timestamp DESC, id DESC
+            LIMIT 1
+        ''', (camera['camera_id'],)).fetchone()
+        if latest:
+            db.execute('''
+                UPDATE camera_status SET last_image_id = ?, last_image_timestamp = ?, last_image_path = ?
+                WHERE camera_id = ?
+            ''', (latest['id'], latest['timestamp'], latest['image_path'], camera['camera_id']))
+        else:
+            # Nothing left to show; last_image_timestamp still says when it was last seen
+            db.execute('''
+                UPDATE camera_status SET last_image_id = NULL, last_image_path = NULL
+                WHERE camera_id = ?
+            ''', (camera['camera_id'],))
+
+def remove_orphaned_images(db, now):
+    """Delete image files nothing in the database points to; returns (files, bytes)"""
+    files = 0
+    freed = 0
+
+    def remove(entry):
+        nonlocal files, freed
+        try:
+            os.remove(entry.path)
+            files += 1
+            freed += entry.stat().st_size
+        except OSError:
+            pass
+        freed += remove_thumbnails(entry.name)
+
+    def scan(folder):
+        """Old enough files directly in `folder`"""
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                # Leave recent files alone so in-flight uploads are not raced
+                if entry.is_file() and now - entry.stat().st_mtime >= ORPHAN_IMAGE_GRACE:
+                    yield entry
+
+    # Flat files from before the content-addressed store, and abandoned uploads
+    for entry in scan(os.path.join(app.root_path, UPLOAD_FOLDER)):
+        referenced = db.execute(
+            'SELECT 1 FROM camera_images WHERE image_path = ? LIMIT 1',
+            (os.path.join(UPLOAD_FOLDER, entry.name),)
+        ).fetchone()
+        if not referenced:
+            remove(entry)
+
+    # Stored blobs whose image_blobs row is gone
+    store = os.path.join(app.root_path, UPLOAD_FOLDER, IMAGE_STORE)
+    for directory, _, _ in os.walk(store):
+        for entry in scan(directory):
+            content_hash = entry.name.split('.')[0]
+            referenced = db.execute(
+                'SELECT 1 FROM image_blobs WHERE content_hash = ?', (content_hash,)
+            ).fetchone()
+            if not referenced:
+                remove(entry)
+    return files, freed
+
+def incremental_vacuum(db):
+    """Release free pages back to the filesystem; returns bytes reclaimed"""
+    page_size = db.execute('PRAGMA page_size').fetchone()[0]
+    before = db.execute('PRAGMA page_count').fetchone()[0]
+    if db.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        while db.execute('PRAGMA freelist_count').fetchone()[0]:
+            db.execute('PRAGMA incremental_vacuum(1000)').fetchall()
+            time.sleep(RETENTION_BATCH_PAUSE)
+    after = db.execute('PRAGMA page_count').fetchone()[0]
+    return (before - after) * page_size
+
+def run_retention(db, now=None):
+    """Apply the retention policy once and return a report"""
+    now = int(now or time.time())
+    started = time.time()
+    report = {'started_at': now, 'rows': {}, 'bytes': {}}
+
+    for table in ('sensor_readings', 'climate_readings', 'room_sensors'):
+        days = RETENTION_DAYS.get(table)
+        if days is None:
+            continue
+        cutoff = retention_cutoff(days, now)
+        if RETENTION_AGGREGATE:
+            # Fill rollup buckets that were never maintained (e.g. rows written
+            # by another process); existing buckets are left as they are
+            aggregate_before_purge(db, table, cutoff, now)
+        report['rows'][table] = purge_batches(db, f'''
+            DELETE FROM {table} WHERE rowid IN (
+                SELECT rowid FROM {table} WHERE timestamp < ? LIMIT ?
+            )
+        ''', (cutoff,))
+
+    # Relay history; each unit's current state lives in relay_current
+    days = RETENTION_DAYS.get('relay_events')
+    if days is not None:
+        report['rows']['relay_events'] = purge_batches(db, '''
+            DELETE FROM relay_events WHERE id IN (
+                SELECT id FROM relay_events WHERE timestamp < ? LIMIT ?
+            )
+        ''', (retention_cutoff(days, now),))
+
+    # Device commands: keep each unit's newest command of every kind for
+    # devices that resume from an old cursor
+    days = RETENTION_DAYS.get('device_commands')
+    if days is not None:
+        report['rows']['device_commands'] = purge_batches(db, '''
+            DELETE FROM device_commands WHERE id IN (
+                SELECT id FROM device_commands
+                WHERE timestamp < ?
+                  AND id NOT IN (SELECT MAX(id) FROM device_commands GROUP BY unit_id, kind)
+                LIMIT ?
+            )
+        ''', (retention_cutoff(days, now),))
+
+    for name, days in ROLLUP_RETENTION_DAYS.items():
+        if days is None:
+            continue
+        deleted = purge_batches(db, '''
+            DELETE FROM sensor_rollups WHERE (resolution, unit_id, metric, position, bucket) IN (
+                SELECT resolution, unit_id, metric, position, bucket FROM sensor_rollups
+                WHERE resolution = ? AND bucket < ?
+                LIMIT ?
+            )
+        ''', (ROLLUP_RESOLUTIONS[name], retention_cutoff(days, now)))
+        report['rows'][f'sensor_rollups_{name}'] = deleted
+
+    days = RETENTION_DAYS.get('camera_images')
+    if days is not None:
+        rows, freed = purge_camera_images(db, retention_cutoff(days, now))
+        report['rows']['camera_images'] = rows
+        report['bytes']['camera_images'] = freed
+
+    files, freed = remove_orphaned_images(db, now)
+    report['rows']['orphaned_image_files'] = files
+    report['bytes']['orphaned_image_files'] = freed
+
+    report['bytes']['database'] = incremental_vacuum(db)
+    report['total_rows'] = sum(report['rows'].values())
+    report['total_bytes'] = sum(report['bytes'].values())
+    report['duration_sec'] = round(time.time() - started, 3)
+    return report
+
+def retention_worker():
+    """Background task that applies the retention policy every RETENTION_INTERVAL"""
+    global retention_report
+    while True:
+        try:
+            with app.app_context():
+                retention_report = run_retention(get_db())
+            print(f"Retention reclaimed {retention_report['total_rows']} rows, "
+                  f"{retention_report['total_bytes']} bytes")
+        except Exception as e:
+            print(f"Error in retention job: {e}")
+
+        time.sleep(RETENTION_INTERVAL)
+
+@app.cli.command('run-retention')
+@click.option('--full-vacuum', is_flag=True, help='Run VACUUM afterwards (switches old databases to incremental auto-vacuum)')
+def run_retention_command(full_vacuum):
+    """Apply the retention policy once"""
+    with app.app_context():
+        db = get_db()
+        report = run_retention(db)
+        if full_vacuum:
+            db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            db.execute('VACUUM')
+    click.echo(json.dumps(report, indent=2))
+
+# Schedule engine
+#
+# Carries out unit schedules and the AC schedule on the server. Each unit's
+# active schedule is compiled into one spec per relay (lights and fans: a
+# daily ON window in server local time, overnight when `off` is earlier than
+# `on`; pump_cycle: ON for on_duration_sec at the start of every
+# interval_sec, counted from the Unix epoch). The AC schedule becomes hourly
+# set points. The engine keeps one heap entry per unit at its next
+# transition and sleeps until the earliest one, so each transition costs a
+# heap pop and push. A due unit's relays are set, announced with a
+# relay_update and sent to its device only if the scheduled state differs
+# from the current one.
+#
+# Units in manual control_mode are left alone until a schedule is saved
+# again. Schedule changes reach the engine through publish_schedule(); with a
+# message queue they travel as schedule_update / ac_schedule_update events,
+# so the engine in the jobs process hears about changes made on any worker.
+# Before acting, the engine re-reads the unit's schedule, which guards
+# against a missed notification or a manual switch racing the transition.
+# A transition that fails to apply or commit (a locked database, say) is
+# retried after SCHEDULE_RETRY_DELAY seconds rather than waiting for the
+# schedule's next change.
+SCHEDULE_EVENTS = {'schedule_update', 'ac_schedule_update'}
+SCHEDULE_RETRY_DELAY = 5
+AC_ROOM = 'ROOM_BACK'
+
+def local_time(t, hour, minute=0, day_offset=0):
+    """Epoch seconds of hour:minute server local time on the day of `t` (plus day_offset days)"""
+    tm = time.localtime(t)
+    return int(time.mktime((tm.tm_year, tm.tm_mon, tm.tm_mday + day_offset, hour, minute, 0, 0, 0, -1)))
+
+def parse_time_of_day(value):
+    """(hour, minute) from 'HH:MM'"""
+    hour, minute = (int(part) for part in value.split(':'))
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f'Invalid time of day: {value}')
+    return hour, minute
+
+class DailyWindow:
+    """A relay that is ON from `on` to `off` each day, local time"""
+
+    def __init__(self, on, off):
+        self.on = parse_time_of_day(on)
+        self.off = parse_time_of_day(off)
+
+    def state(self, t):
+        tm = time.localtime(t)
+        now = (tm.tm_hour, tm.tm_min)
+        if self.on < self.off:
+            return 'ON' if self.on <= now < self.off else 'OFF'
+        if self.on > self.off:
+            return 'ON' if now >= self.on or now < self.off else 'OFF'
+        return 'OFF'
+
+    def next_change(self, t):
+        if self.on == self.off:
+            return None
+        return min(change for day in (0, 1) for change in (local_time(t, *self.on, day), local_time(t, *self.off, day))
+                   if change > t)
+
+class PumpCycle:
+    """A relay that is ON for `duration` seconds at the start of every `interval`"""
+
+    def __init__(self, on_duration_sec, interval_sec):
+        self.duration = int(on_duration_sec)
+        self.interval = int(interval_sec)
+        if self.interval <= 0:
+            raise ValueError('interval_sec must be positive')
+
+    def state(self, t):
+        return 'ON' if t % self.interval < self.duration else 'OFF'
+
+    def next_change(self, t):
+        if self.duration <= 0 or self.duration >= self.interval:
+            return None
+        start = t - t % self.interval
+        return start + self.duration if t - start < self.duration else start + self.interval
+
+class HourlySetpoints:
+    """AC set point for each local hour, from {'00': 24, ...}"""
+
+    def __init__(self, ac_schedule):
+        self.temperatures = {int(hour): temp for hour, temp in ac_schedule.items()}
+
+    def state(self, t):
+        return self.temperatures.get(time.localtime(t).tm_hour)
+
+    def next_change(self, t):
+        current = self.state(t)
+        hour = time.localtime(t).tm_hour
+        for offset in range(1, 25):
+            change = local_time(t, hour + offset)
+            if self.state(change) != current:
+                return change
+        return None
+
+def compile_schedule(schedule):
+    """{relay: spec} for the relays a unit schedule drives; malformed entries are skipped"""
+    specs = {}
+    for relay in ('lights', 'fans'):
+        window = schedule.get(relay)
+        if isinstance(window, dict) and window.get('on') and window.get('off'):
+            try:
+                specs[relay] = DailyWindow(window['on'], window['off'])
+            except (TypeError, ValueError) as e:
+                print(f"Ignoring {relay} schedule {window}: {e}")
+    cycle = schedule.get('pump_cycle')
+    if isinstance(cycle, dict):
+        try:
+            specs['pump'] = PumpCycle(cycle['on_duration_sec'], cycle['interval_sec'])
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"Ignoring pump_cycle schedule {cycle}: {e}")
+    return specs
+
+class ScheduleEngine:
+    """Heap of each schedule's next transition, applied by one thread that sleeps in between"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._heap = []
+        # (kind, key) -> {'source', 'specs', 'generation', 'due'}; heap entries
+        # of an older generation were superseded and are skipped when popped
+        self._jobs = {}
+        self._generation = 0
+        self._thread = None
+        self.ac_set_temp = None
+        self.transitions = 0
+
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        """Load every active schedule and start the engine thread"""
+        with self._lock:
+            if self._thread:
+                return
+            self._thread = threading.Thread(target=self._run, name='schedule-engine', daemon=True)
+        storage = open_storage()
+        try:
+            schedules = storage.load_schedules()
+            ac_schedule = storage.load_ac_schedule()
+        finally:
+            storage.close()
+        for unit_id, schedule in schedules.items():
+            self.update_unit(unit_id, schedule)
+        self.update_ac(ac_schedule)
+        self._thread.start()
+
+    def update_unit(self, unit_id, schedule):
+        """Recompile a unit's schedule and check it right away; no-op where the engine is not running"""
+        if not self.running():
+            return
+        specs = {} if schedule.get('_control_mode') == 'manual' else compile_schedule(schedule)
+        self._set(('relays', unit_id), schedule, specs)
+
+    def update_ac(self, ac_schedule):
+        """Recompile the AC schedule and check it right away"""
+        if self.running():
+            self._set(('ac', AC_ROOM), ac_schedule, {'set_temp': HourlySetpoints(ac_schedule)})
+
+    def notify(self, event, data):
+        """Apply a schedule_update or ac_schedule_update message"""
+        if event == 'schedule_update':
+            self.update_unit(data['unit_id'], data['data'])
+        else:
+            self.update_ac(data['data'])
+
+    def pending(self):
+        """Number of schedules with a transition ahead"""
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job['due'] is not None)
+
+    def _set(self, key, source, specs, due=None):
+        with self._lock:
+            if not specs:
+                self._jobs.pop(key, None)
+                return
+            self._generation += 1
+            job = {'source': source, 'specs': specs, 'generation': self._generation, 'due': None}
+            self._jobs[key] = job
+            self._push(key, job, due if due is not None else time.time())
+        self._wake.set()
+
+    def _push(self, key, job, due):
+        job['due'] = due
+        heapq.heappush(self._heap, (due, job['generation'], key))
+        # Superseded entries pile up when schedules change often; rebuild then
+        if len(self._heap) > 2 * len(self._jobs) + 64:
+            self._heap = [(j['due'], j['generation'], k) for k, j in self._jobs.items() if j['due'] is not None]
+            heapq.heapify(self._heap)
+
+    def _take_due(self):
+        """Pop the schedules due now; returns ([(due, key, job)], seconds until the next one or None)"""
+        with self._lock:
+            self._wake.clear()
+            now = time.time()
+            due = []
+            while self._heap and self._heap[0][0] <= now:
+                when, generation, key = heapq.heappop(self._heap)
+                job = self._jobs.get(key)
+                if job and job['generation'] == generation:
+                    job['due'] = None
+                    due.append((when, key, job))
+            return due, (self._heap[0][0] - now if self._heap else None)
+
+    def _run(self):
+        storage = open_storage()
+        while True:
+            due, wait = self._take_due()
+            if not due:
+                self._wake.wait(wait)
+                continue
+
+            # Everything due now is written in one transaction, then announced
+            applied = []
+            failed = None
+            for when, key, job in due:
+                try:
+                    job, announce = self._apply(storage, when, key, job)
+                except Exception:
+                    app.logger.exception('Error applying schedule %s, retrying in %ss', key, SCHEDULE_RETRY_DELAY)
+                    failed = key
+                    break
+                applied.append((when, key, job, announce))
+            if failed is not None:
+                # Drop whatever the failed schedule half wrote; it comes back
+                # after a short backoff and the others are redone right away
+                storage.rollback()
+                with self._lock:
+                    for when, key, job in due:
+                        if self._jobs.get(key) is job:
+                            self._push(key, job, time.time() + SCHEDULE_RETRY_DELAY if key == failed else when)
+                continue
+            try:
+                storage.commit()
+            except Exception:
+                storage.rollback()
+                app.logger.exception('Error saving scheduled relay states, retrying in %ss', SCHEDULE_RETRY_DELAY)
+                with self._lock:
+                    for when, key, job, announce in applied:
+                        if job is not None and self._jobs.get(key) is job:
+                            self._push(key, job, time.time() + SCHEDULE_RETRY_DELAY)
+                continue
+
+            for when, key, job, announce in applied:
+                if announce:
+                    self.transitions += 1
+                    announce()
+                if job is None:
+                    continue
+                changes = [change for change in (spec.next_change(int(when)) for spec in job['specs'].values())
+                           if change is not None]
+                with self._lock:
+                    if self._jobs.get(key) is job and changes:
+                        self._push(key, job, min(changes))
+
+    def _apply(self, storage, when, key, job):
+        """Bring one unit's relays (or the AC) to their scheduled state, uncommitted.
+        Returns (job to keep or None, callable announcing the change or None)."""
+        kind, unit_id = key
+        if kind == 'ac':
+            source = storage.load_ac_schedule()
+        else:
+            source = storage.load_schedule(unit_id)
+        if source != job['source']:
+            # Changed without a notification reaching us: recompile and come back
+            if kind == 'ac':
+                self.update_ac(source)
+            else:
+                self.update_unit(unit_id, source)
+            return None, None
+
+        desired = {name: spec.state(int(when)) for name, spec in job['specs'].items()}
+        timestamp = int(time.time())
+        if kind == 'ac':
+            set_temp = desired['set_temp']
+            if set_temp == self.ac_set_temp:
+                return job, None
+            command = queue_device_command(storage, unit_id, 'ac', {'set_temp': set_temp}, timestamp)
+            message = {'unit_id': unit_id, 'timestamp': timestamp, 'set_temp': set_temp, 'source': 'schedule'}
+            return job, functools.partial(self._announce_ac, message, command)
+
+        current = get_latest_relay(storage, unit_id)
+        relays = current['relays'] if current else {}
+        changes = {name: state for name, state in desired.items() if relays.get(name, 'OFF') != state}
+        if not changes:
+            return job, None
+        payload = storage.set_relays(unit_id, timestamp, changes, source='schedule')
+        command = queue_device_command(storage, unit_id, 'relays', payload['relays'], timestamp)
+        return job, functools.partial(publish_relays, payload, command, source='schedule')
+
+    def _announce_ac(self, message, command):
+        # Only once committed, so a failed commit is retried with the same set point
+        self.ac_set_temp = message['set_temp']
+        socketio.emit('ac_update', message, to=message['unit_id'])
+        announce_device_command(command)
+
+schedule_engine = ScheduleEngine()
+
+def publish_schedule(unit_id, schedule):
+    """Hand a unit's changed schedule to the schedule engine and push it to the unit's room"""
+    schedule_engine.update_unit(unit_id, schedule)
+    socketio.emit('schedule_update', {'unit_id': unit_id, 'data': schedule}, to=unit_id)
+
+def publish_ac_schedule(ac_schedule):
+    """Hand the changed AC schedule to the schedule engine and push it to the back room"""
+    schedule_engine.update_ac(ac_schedule)
+    socketio.emit('ac_schedule_update', {'unit_id': AC_ROOM, 'data': ac_schedule}, to=AC_ROOM)
+
+def mock_camera_image(camera_id):
+    """A small solid-colour PNG standing in for a simulated camera's frame"""
+    width, height = 64, 48
+    pixel = hashlib.sha1(camera_id.encode()).digest()[:3]
+    rows = (b'\x00' + pixel * width) * height
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(rows)) +
+            chunk(b'IEND', b''))
+
 # Background task to simulate sensor data updates
 def simulate_sensor_updates():
     """Background task to simulate sensor data updates"""
     while True:
+        started = time.perf_counter()
         try:
             with app.app_context():
-                db = get_db()
+                storage = get_storage()
                 timestamp = int(time.time())
+                readings = []
+                room_readings = []
 
                 # Update hydro units
                 unit_ids = ['DWC1', 'DWC2', 'NFT', 'AERO', 'TROUGH']
@@ -974,46 +4882,54 @@ def simulate_sensor_updates():
                                 "humidity": random.randint(65, 75)
                             }
 
-                    # Insert sensor reading
-                    db.execute('''
-                        INSERT INTO sensor_readings
-                        (unit_id, timestamp, ph, tds, turbidity, water_temp, water_level, climate_data)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        unit_id, timestamp,
-                        round(random.uniform(5.5, 7.0), 1),
-                        random.randint(800, 1200),
-                        random.randint(8, 20),
-                        round(random.uniform(20, 25), 1),
-                        random.randint(70, 90),
-                        json.dumps(climate_data)
-                    ))
+                    reading = {
+                        'unit_id': unit_id,
+                        'timestamp': timestamp,
+                        'ph': round(random.uniform(5.5, 7.0), 1),
+                        'tds': random.randint(800, 1200),
+                        'turbidity': random.randint(8, 20),
+                        'water_temp': round(random.uniform(20, 25), 1),
+                        'water_level': random.randint(70, 90),
+                        'climate': climate_data
+                    }
+
+                    readings.append(reading)
 
                 # Update room sensors
                 for room in ['ROOM_FRONT', 'ROOM_BACK']:
                     ac_temp = random.randint(22, 26) if room == 'ROOM_BACK' else None
                     ac_mode = 'COOL' if room == 'ROOM_BACK' else None
 
-                    db.execute('''
-                        INSERT INTO room_sensors
-                        (unit_id, timestamp, temp, humidity, pressure, iaq, co2, ac_temp, ac_mode)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        room, timestamp,
-                        round(random.uniform(22, 28), 1),
-                        random.randint(55, 70),
-                        random.randint(1000, 1020),
-                        random.randint(100, 200),
-                        random.randint(400, 1000),
-                        ac_temp, ac_mode
-                    ))
-
-                db.commit()
+                    reading = {
+                        'unit_id': room,
+                        'timestamp': timestamp,
+                        'temp': round(random.uniform(22, 28), 1),
+                        'humidity': random.randint(55, 70),
+                        'pressure': random.randint(1000, 1020),
+                        'iaq': random.randint(100, 200),
+                        'co2': random.randint(400, 1000),
+                        'ac_temp': ac_temp,
+                        'ac_mode': ac_mode
+                    }
+
+                    room_readings.append(reading)
+
+                readings = storage.insert_sensor_readings(readings)
+                storage.insert_room_readings(room_readings)
+                storage.commit()
+
+                # Push new readings to each unit's and room's WebSocket room
+                for reading in readings:
+                    publish_latest('sensors', reading['unit_id'], sensor_payload(reading, reading['climate']),
+                                   source='simulator')
+                for reading in room_readings:
+                    publish_latest('rooms', reading['unit_id'], room_payload(reading), source='simulator')
 
                 # Simulate camera images every 5 minutes (300 seconds)
                 if timestamp % 300 == 0:  # Every 5 minutes
                     # Generate mock camera images for each unit
                     unit_ids = ['DWC1', 'DWC2', 'NFT', 'AERO', 'TROUGH']
+                    new_images = []
                     for unit_id in unit_ids:
                         # Each unit can have 1-8 cameras (simulating random presence)
                         num_cameras = random.randint(2, 6)
@@ -1023,47 +4939,54 @@ def simulate_sensor_updates():
                             position = random.randint(1, 2)
                             camera_id = f"{unit_id}L{level}{position}"
 
-                            # Create mock image data (you would normally receive actual image)
-                            mock_image_path = f"{UPLOAD_FOLDER}/mock_{camera_id}_{timestamp}.jpg"
-
-                            # Insert camera image record
-                            db.execute('''
-                                INSERT INTO camera_images
-                                (camera_id, unit_id, level, position, image_path, timestamp, file_size)
-                                VALUES (?, ?, ?, ?, ?, ?, ?)
-                            ''', (camera_id, unit_id, level, position, mock_image_path, timestamp, 1024))
-
-                            # Update camera status
-                            db.execute('''
-                                INSERT OR REPLACE INTO camera_status
-                                (camera_id, unit_id, last_image_timestamp, total_images, status, updated_at)
-                                VALUES (?, ?, ?,
-                                    COALESCE((SELECT total_images FROM camera_status WHERE camera_id = ?), 0) + 1,
-                                    'online', CURRENT_TIMESTAMP)
-                            ''', (camera_id, unit_id, timestamp, camera_id))
+                            # Store a mock frame like an upload (you would normally receive actual image);
+                            # a camera's frames are identical, so they share one file
+                            filename, stored = store_camera_image(storage, {
+                                'camera_id': camera_id, 'unit_id': unit_id, 'level': level,
+                                'position': position, 'timestamp': timestamp
+                            }, io.BytesIO(mock_camera_image(camera_id)))
+                            if stored:
+                                new_images.append(filename)
 
                             # Log camera simulation
                             print(f"Simulated camera {camera_id} image at {timestamp}")
 
-                # Broadcast updates via WebSocket
-                socketio.emit('sensor_update', {
-                    'timestamp': timestamp,
-                    'message': 'Sensor data updated'
-                })
+                    storage.commit()
+                    for filename in new_images:
+                        thumbnail_workers.submit(filename)
 
         except Exception as e:
             print(f"Error in sensor simulation: {e}")
+        simulator_loop_seconds.observe(time.perf_counter() - started)
 
         time.sleep(30)  # Update every 30 seconds
 
-if __name__ == '__main__':
-    # Initialize database
-    init_db()
-
+def start_background_jobs():
+    """Start the simulator, schedule engine and retention threads. Run these in exactly one process."""
     # Start background sensor simulation
     sensor_thread = threading.Thread(target=simulate_sensor_updates)
     sensor_thread.daemon = True
     sensor_thread.start()
 
+    # Carry out unit and AC schedules
+    schedule_engine.start()
+
+    # Start background retention job (it works on the SQLite tables only)
+    if not STORAGE_URL:
+        retention_thread = threading.Thread(target=retention_worker)
+        retention_thread.daemon = True
+        retention_thread.start()
+
+if __name__ == '__main__':
+    # Development server: one process with the reloader and debugger.
+    # Use server.py in production.
+    init_db()
+    warm_latest_cache()
+
+    # The reloader runs this block in a file watcher and again in the serving
+    # child; only the child starts the background jobs
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_jobs()
+
     # Run Flask app with SocketIO
-    socketio.run(app, host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    socketio.run(app, host='0.0.0.0', port=5000, debug=True)
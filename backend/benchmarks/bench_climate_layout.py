@@ -0,0 +1,117 @@
+"""Benchmark a 30-day per-position climate average: JSON blob vs climate_readings.
+
+Builds a scratch database holding the same readings twice: once in the old
+layout (sensor_readings.climate_data as a json.dumps blob) and once in the
+normalized climate_readings table from schema migration 3, then times the
+per-position temperature/humidity average for one unit over 30 days.
+
+Usage:
+    python benchmarks/bench_climate_layout.py             # 30 days at 30 s
+    python benchmarks/bench_climate_layout.py --days 90
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app as hydro  # noqa: E402
+
+UNIT_IDS = ['DWC1', 'DWC2', 'NFT', 'AERO', 'TROUGH']
+POSITIONS = [f"L{level}{pos}" for level in (1, 2, 3, 4) for pos in (1, 2)]
+INTERVAL = 30
+
+
+def fill(db, days):
+    """Write `days` of 30-second readings for every unit in both layouts"""
+    start = int(time.time()) - days * 86400
+    for ts in range(start, start + days * 86400, INTERVAL):
+        for unit_id in UNIT_IDS:
+            climate = {p: {"temp": round(random.uniform(22, 26), 1),
+                           "humidity": random.randint(65, 75)} for p in POSITIONS}
+            reading_id = db.execute('''
+                INSERT INTO sensor_readings (unit_id, timestamp, ph, climate_data)
+                VALUES (?, ?, ?, ?)
+            ''', (unit_id, ts, 6.0, json.dumps(climate))).lastrowid
+            db.executemany(hydro.INSERT_CLIMATE_SQL, hydro.climate_rows(reading_id, unit_id, ts, climate))
+    db.commit()
+    return start
+
+
+def blob_python(db, unit_id, start, end):
+    """Old layout: fetch every blob and json.loads it in Python"""
+    sums = {}
+    for row in db.execute('''
+        SELECT climate_data FROM sensor_readings
+        WHERE unit_id = ? AND timestamp BETWEEN ? AND ?
+    ''', (unit_id, start, end)):
+        for position, values in json.loads(row[0]).items():
+            acc = sums.setdefault(position, [0.0, 0.0, 0])
+            acc[0] += values['temp']
+            acc[1] += values['humidity']
+            acc[2] += 1
+    return {p: (t / n, h / n) for p, (t, h, n) in sums.items()}
+
+
+def blob_sql(db, unit_id, start, end):
+    """Old layout: parse the blob inside SQLite with json_each"""
+    return db.execute('''
+        SELECT j.key, AVG(json_extract(j.value, '$.temp')), AVG(json_extract(j.value, '$.humidity'))
+        FROM sensor_readings s, json_each(s.climate_data) j
+        WHERE s.unit_id = ? AND s.timestamp BETWEEN ? AND ?
+        GROUP BY j.key
+    ''', (unit_id, start, end)).fetchall()
+
+
+def columnar(db, unit_id, start, end):
+    """New layout: plain GROUP BY on climate_readings"""
+    return db.execute('''
+        SELECT position, AVG(temp), AVG(humidity)
+        FROM climate_readings
+        WHERE unit_id = ? AND timestamp BETWEEN ? AND ?
+        GROUP BY position
+    ''', (unit_id, start, end)).fetchall()
+
+
+def best_of(fn, repeat, *args):
+    """Return the fastest run in milliseconds"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--days', type=int, default=30, help='days of readings to generate')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per layout (best is reported)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        hydro.DATABASE = os.path.join(tmp, 'bench.db')
+        hydro.init_db()
+
+        db = sqlite3.connect(hydro.DATABASE)
+        start = fill(db, args.days)
+        end = start + args.days * 86400
+        readings = db.execute('SELECT COUNT(*) FROM sensor_readings').fetchone()[0]
+        print(f"{readings} readings, {readings * len(POSITIONS)} climate rows, 30-day average for DWC1")
+
+        for name, fn in (('blob + json.loads', blob_python),
+                         ('blob + json_each', blob_sql),
+                         ('climate_readings', columnar)):
+            print(f"{name:>20}: {best_of(fn, args.repeat, db, 'DWC1', end - 30 * 86400, end):9.1f} ms")
+
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Benchmark read latency with and without the connection pool and WAL pragmas.
+
+Runs the same workload twice against a scratch database: first the old
+setup (a fresh connection per request, rollback journal, default pragmas),
+then the pooled connections with DB_PRAGMAS. READERS threads issue small
+dashboard GETs (schedule, AC schedule, camera list, one-hour climate
+summary) through the Flask test client, while a writer thread inserts
+sensor readings at 10 Hz, committing each one, like the ingest path under
+load. Reports p50/p99 read latency and throughput for each setup.
+
+Usage:
+    python benchmarks/bench_db_pool.py
+    python benchmarks/bench_db_pool.py --readers 16 --duration 20 --write-hz 50
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app as hydro  # noqa: E402
+
+UNIT_IDS = ['DWC1', 'DWC2', 'NFT', 'AERO', 'TROUGH']
+POSITIONS = [f"L{level}{pos}" for level in (1, 2, 3, 4) for pos in (1, 2)]
+LEGACY_PRAGMAS = ('journal_mode = DELETE',)
+
+
+def reading(unit_id, timestamp):
+    """A random sensor row in the shape insert_sensor_readings() expects"""
+    return {
+        'unit_id': unit_id, 'timestamp': timestamp,
+        'ph': round(random.uniform(5.5, 7.0), 1), 'tds': random.randint(800, 1200),
+        'turbidity': random.randint(8, 20), 'water_temp': round(random.uniform(20, 25), 1),
+        'water_level': random.randint(70, 90),
+        'climate': {p: {'temp': round(random.uniform(22, 26), 1), 'humidity': random.randint(65, 75)}
+                    for p in POSITIONS}
+    }
+
+
+def fill(hours):
+    """Write `hours` of 30-second readings for every unit"""
+    db = hydro.db_pool.connect()
+    now = int(time.time())
+    for ts in range(now - hours * 3600, now, 30):
+        for unit_id in UNIT_IDS:
+            hydro.insert_sensor_readings(db, [reading(unit_id, ts)])
+    db.commit()
+    db.close()
+
+
+def reader(client, deadline, latencies):
+    """Issue GETs until the deadline, appending each latency in ms"""
+    now = int(time.time())
+    i = 0
+    while time.time() < deadline:
+        unit_id = UNIT_IDS[i % len(UNIT_IDS)]
+        path = [
+            f'/units/{unit_id}/schedule',
+            '/room/back/ac_schedule',
+            f'/cameras/{unit_id}',
+            f'/units/{unit_id}/climate/summary?from={now - 3600}&to={now}',
+        ][i % 4]
+        start = time.perf_counter()
+        client.get(path)
+        latencies.append((time.perf_counter() - start) * 1000)
+        i += 1
+
+
+def writer(deadline, hz):
+    """Insert and commit one reading every 1/hz seconds until the deadline"""
+    db = hydro.db_pool.connect()
+    i = 0
+    while time.time() < deadline:
+        hydro.insert_sensor_readings(db, [reading(UNIT_IDS[i % len(UNIT_IDS)], int(time.time()))])
+        db.commit()
+        i += 1
+        time.sleep(1 / hz)
+    db.close()
+
+
+def run(label, args, tmp):
+    """Build a fresh database with the current settings and measure the workload"""
+    hydro.DATABASE = os.path.join(tmp, f'{label}.db')
+    hydro.init_db()
+    fill(args.hours)
+
+    client = hydro.app.test_client()
+    deadline = time.time() + args.duration
+    per_thread = [[] for _ in range(args.readers)]
+    threads = [threading.Thread(target=reader, args=(client, deadline, per_thread[n])) for n in range(args.readers)]
+    threads.append(threading.Thread(target=writer, args=(deadline, args.write_hz)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies = sorted(latency for samples in per_thread for latency in samples)
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[int(len(latencies) * 0.99)]
+    print(f"{label:>8}  {len(latencies) / args.duration:>8.0f}  {p50:>7.2f}  {p99:>7.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=8, help='concurrent reader threads')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per setup')
+    parser.add_argument('--write-hz', type=float, default=10, help='sensor inserts per second')
+    parser.add_argument('--hours', type=int, default=24, help='hours of readings to preload')
+    args = parser.parse_args()
+
+    pooled_size, pooled_pragmas = hydro.db_pool.size, hydro.DB_PRAGMAS
+
+    print(f"{'setup':>8}  {'reads/s':>8}  {'p50 ms':>7}  {'p99 ms':>7}")
+    with tempfile.TemporaryDirectory() as tmp:
+        # Old behaviour: connect per request, rollback journal, default pragmas
+        hydro.db_pool.size = 0
+        hydro.DB_PRAGMAS = LEGACY_PRAGMAS
+        run('before', args, tmp)
+
+        hydro.db_pool.size = pooled_size
+        hydro.DB_PRAGMAS = pooled_pragmas
+        run('after', args, tmp)
+
+
+if __name__ == '__main__':
+    main()
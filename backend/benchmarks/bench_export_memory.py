@@ -0,0 +1,93 @@
+"""Check that the streamed sensor CSV export runs in constant memory.
+
+Fills a scratch database with --rows sensor readings, downloads
+/export/sensors/csv for every unit through the Flask test client while
+consuming the body chunk by chunk, and reports throughput and peak RSS.
+Exits non-zero if peak RSS goes above --ceiling-mb.
+
+Usage:
+    python benchmarks/bench_export_memory.py                  # 5M rows
+    python benchmarks/bench_export_memory.py --rows 500000 --ceiling-mb 150
+"""
+import argparse
+import os
+import random
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app as hydro  # noqa: E402
+
+UNIT_IDS = ['DWC1', 'DWC2', 'NFT', 'AERO', 'TROUGH']
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MiB (Linux reports KiB)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def fill(db, rows, end):
+    """Insert `rows` reservoir readings ending at `end`, bypassing rollups for speed"""
+    def readings():
+        for i in range(rows):
+            yield (UNIT_IDS[i % len(UNIT_IDS)], end - (rows - i) // len(UNIT_IDS) * 30 % (29 * 86400),
+                   round(random.uniform(5.5, 7.0), 1), random.randint(800, 1200),
+                   random.randint(8, 20), round(random.uniform(20, 25), 1), random.randint(70, 90))
+
+    db.executemany('''
+        INSERT INTO sensor_readings (unit_id, timestamp, ph, tds, turbidity, water_temp, water_level)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', readings())
+    db.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5000000, help='readings to export')
+    parser.add_argument('--ceiling-mb', type=float, default=200, help='maximum allowed peak RSS')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        hydro.DATABASE = os.path.join(tmp, 'bench.db')
+        hydro.init_db()
+
+        db = sqlite3.connect(hydro.DATABASE)
+        fill(db, args.rows, int(time.time()) - 60)
+        db.close()
+        print(f"filled {args.rows} rows, peak RSS so far {peak_rss_mb():.1f} MiB")
+
+        client = hydro.app.test_client()
+        start = time.perf_counter()
+        response = client.get('/export/sensors/csv?unit=ALL&range=last30days', buffered=False)
+        first_byte = None
+        size = 0
+        lines = 0
+        for chunk in response.response:
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            size += len(chunk)
+            lines += chunk.count(b'\n') if isinstance(chunk, bytes) else chunk.count('\n')
+        response.close()
+        elapsed = time.perf_counter() - start
+
+        peak = peak_rss_mb()
+        print(f"exported {lines - 1} rows, {size / 2**20:.1f} MiB in {elapsed:.1f} s "
+              f"(first byte after {first_byte * 1000:.1f} ms)")
+        print(f"peak RSS {peak:.1f} MiB (ceiling {args.ceiling_mb:.0f} MiB)")
+
+        if lines - 1 != args.rows:
+            print("FAIL: row count mismatch")
+            return 1
+        if peak > args.ceiling_mb:
+            print("FAIL: peak RSS above ceiling")
+            return 1
+        print("OK")
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""Benchmark concurrent camera image fetches from one app process.
+
+Fills a scratch store with IMAGES stored images of FILE_BYTES each and
+serves the app from a threaded Werkzeug server. CLIENTS client processes
+then fetch random images over keep-alive connections for DURATION seconds,
+once for each kind of request the dashboard and browsers make:
+
+- full: plain GET of the whole image, sent by the worker
+- revalidate: GET with the image's ETag in If-None-Match (304, no body)
+- range: GET of the first RANGE_BYTES (206)
+- x-accel-redirect: plain GET with HYDRO_IMAGE_SENDFILE=x-accel-redirect;
+  the worker answers with headers only and nginx would send the bytes
+
+Reports requests/s, MB/s of image bytes and p50/p99 latency for each.
+
+Usage:
+    python benchmarks/bench_image_serve.py
+    python benchmarks/bench_image_serve.py --clients 32 --file-bytes 250000
+"""
+import argparse
+import hashlib
+import http.client
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app as hydro  # noqa: E402
+
+MODES = ['full', 'revalidate', 'range', 'x-accel-redirect']
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def fill_store(count, file_bytes):
+    """Write `count` stored images; returns {hash: etag}"""
+    etags = {}
+    for _ in range(count):
+        data = os.urandom(file_bytes)
+        content_hash = hashlib.sha256(data).hexdigest()
+        target = os.path.join(hydro.app.root_path, hydro.UPLOAD_FOLDER, hydro.image_file_name(f'{content_hash}.jpg'))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(data)
+        etags[content_hash] = f'"{content_hash}"'
+    return etags
+
+
+def run_client(args):
+    """Fetch random images until the deadline; return (ok, errors, body bytes, latencies in ms)"""
+    port, mode, etags, range_bytes, deadline, seed = args
+    rng = random.Random(seed)
+    hashes = list(etags)
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    ok = errors = received = 0
+    latencies = []
+    while time.time() < deadline:
+        content_hash = rng.choice(hashes)
+        headers = {}
+        if mode == 'revalidate':
+            headers['If-None-Match'] = etags[content_hash]
+        elif mode == 'range':
+            headers['Range'] = f'bytes=0-{range_bytes - 1}'
+        start = time.perf_counter()
+        try:
+            connection.request('GET', f'/camera_images/{content_hash}.jpg', headers=headers)
+            response = connection.getresponse()
+            received += len(response.read())
+            if response.status < 400:
+                ok += 1
+            else:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            connection.close()
+        latencies.append((time.perf_counter() - start) * 1000)
+    connection.close()
+    return ok, errors, received, latencies
+
+
+def measure(mode, port, etags, args):
+    """Run the clients against the server in `mode`; returns (req/s, MB/s, errors, p50 ms, p99 ms)"""
+    hydro.IMAGE_SENDFILE = 'x-accel-redirect' if mode == 'x-accel-redirect' else None
+    deadline = time.time() + args.duration
+    with multiprocessing.Pool(args.clients) as pool:
+        results = pool.map(run_client, [(port, mode, etags, args.range_bytes, deadline, n)
+                                        for n in range(args.clients)])
+
+    ok = sum(r[0] for r in results)
+    errors = sum(r[1] for r in results)
+    received = sum(r[2] for r in results)
+    latencies = sorted(latency for r in results for latency in r[3])
+    p50 = latencies[len(latencies) // 2] if latencies else 0
+    p99 = latencies[int(len(latencies) * 0.99)] if latencies else 0
+    return ok / args.duration, received / args.duration / 1e6, errors, p50, p99
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--images', type=int, default=2000, help='images in the store')
+    parser.add_argument('--file-bytes', type=int, default=100 * 1024, help='size of each image')
+    parser.add_argument('--range-bytes', type=int, default=16 * 1024, help='bytes asked for by range requests')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent client processes')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per measurement')
+    parser.add_argument('--port', type=int, default=5200, help='port to serve the app on')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        hydro.app.root_path = tmp
+        hydro.DATABASE = os.path.join(tmp, 'bench.db')
+        os.makedirs(os.path.join(tmp, hydro.UPLOAD_FOLDER))
+        hydro.init_db()
+
+        print(f"Filling the store with {args.images} images of {args.file_bytes} bytes...")
+        etags = fill_store(args.images, args.file_bytes)
+
+        server = make_server('127.0.0.1', args.port, hydro.app, threaded=True, request_handler=QuietHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            print(f"\n{args.clients} clients, {args.duration:g}s per mode")
+            print(f"{'mode':<18}  {'req/s':>8}  {'MB/s':>7}  {'errors':>6}  {'p50 ms':>7}  {'p99 ms':>7}")
+            for mode in MODES:
+                rate, throughput, errors, p50, p99 = measure(mode, args.port, etags, args)
+                print(f"{mode:<18}  {rate:>8.0f}  {throughput:>7.1f}  {errors:>6}  {p50:>7.2f}  {p99:>7.2f}")
+        finally:
+            server.shutdown()
+            hydro.db_pool.clear()
+
+
+if __name__ == '__main__':
+    main()
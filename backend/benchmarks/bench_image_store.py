@@ -0,0 +1,174 @@
+"""Benchmark camera upload and image serve latency with a large image store.
+
+Fills a scratch store with IMAGES stored images (files sharded by content
+hash, with their camera_images and image_blobs rows), then measures through
+the Flask test client:
+
+- upload: POST /cameras/<id>/upload of a new frame
+- duplicate upload: POST of bytes already in the store (no new file)
+- serve: GET /camera_images/<hash>.jpg of a random stored image
+
+For comparison, it also times opening a random file and creating a new one
+in a single flat directory holding the same number of files, which is the
+layout uploads used before.
+
+Usage:
+    python benchmarks/bench_image_store.py
+    python benchmarks/bench_image_store.py --images 100000 --samples 2000
+"""
+import argparse
+import hashlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app as hydro  # noqa: E402
+
+CAMERA_IDS = [f"{unit_id}L{level}{pos}" for unit_id in ['DWC1', 'DWC2', 'NFT', 'AERO', 'TROUGH']
+              for level in (1, 2, 3, 4) for pos in (1, 2)]
+FILL_BATCH = 10000
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def fill_store(count, file_bytes):
+    """Write `count` small stored images and their rows; returns their hashes"""
+    db = hydro.db_pool.connect()
+    storage = hydro.SQLiteStorage(db)
+    hashes = []
+    now = int(time.time())
+    for i in range(count):
+        data = os.urandom(file_bytes)
+        content_hash = hashlib.sha256(data).hexdigest()
+        path = os.path.join(hydro.UPLOAD_FOLDER, hydro.image_file_name(f'{content_hash}.jpg'))
+        target = os.path.join(hydro.app.root_path, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(data)
+        camera_id = CAMERA_IDS[i % len(CAMERA_IDS)]
+        storage.record_camera_image({
+            'camera_id': camera_id, 'unit_id': camera_id[:camera_id.index('L')],
+            'level': int(camera_id[-2]), 'position': int(camera_id[-1]), 'image_path': path,
+            'timestamp': now - count + i, 'file_size': file_bytes, 'content_hash': content_hash
+        })
+        hashes.append(content_hash)
+        if i % FILL_BATCH == FILL_BATCH - 1:
+            storage.commit()
+            print(f"  {i + 1} images stored", end='\r', flush=True)
+    storage.commit()
+    db.close()
+    print()
+    return hashes
+
+
+def fill_flat(folder, count, file_bytes):
+    """Write `count` files named like the old uploads into one directory; returns their names"""
+    os.makedirs(folder)
+    names = []
+    for i in range(count):
+        name = f"{CAMERA_IDS[i % len(CAMERA_IDS)]}_{1700000000 + i}.jpg"
+        with open(os.path.join(folder, name), 'wb') as f:
+            f.write(os.urandom(file_bytes))
+        names.append(name)
+    return names
+
+
+def time_uploads(client, samples, frame_bytes, duplicate):
+    """Latency in ms of uploading new (or repeated) frames"""
+    frame = os.urandom(frame_bytes)
+    latencies = []
+    for i in range(samples):
+        data = frame if duplicate else os.urandom(frame_bytes)
+        camera_id = CAMERA_IDS[i % len(CAMERA_IDS)]
+        start = time.perf_counter()
+        response = client.post(f'/cameras/{camera_id}/upload', data={'image': (io.BytesIO(data), 'frame.jpg')})
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.status_code
+    return latencies
+
+
+def time_serves(client, hashes, samples):
+    """Latency in ms of fetching random stored images"""
+    latencies = []
+    for content_hash in random.sample(hashes, min(samples, len(hashes))):
+        start = time.perf_counter()
+        response = client.get(f'/camera_images/{content_hash}.jpg')
+        response.get_data()
+        response.close()
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.status_code
+    return latencies
+
+
+def time_flat(folder, names, samples, frame_bytes):
+    """(open+read, create) latencies in ms in a flat directory"""
+    reads, creates = [], []
+    for name in random.sample(names, min(samples, len(names))):
+        start = time.perf_counter()
+        with open(os.path.join(folder, name), 'rb') as f:
+            f.read()
+        reads.append((time.perf_counter() - start) * 1000)
+    frame = os.urandom(frame_bytes)
+    for i in range(samples):
+        start = time.perf_counter()
+        with open(os.path.join(folder, f'new_{i}.jpg'), 'wb') as f:
+            f.write(frame)
+        creates.append((time.perf_counter() - start) * 1000)
+    return reads, creates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--images', type=int, default=1000000, help='images in the store before measuring')
+    parser.add_argument('--samples', type=int, default=1000, help='requests per measurement')
+    parser.add_argument('--file-bytes', type=int, default=256, help='size of each prefilled file')
+    parser.add_argument('--frame-bytes', type=int, default=64 * 1024, help='size of each uploaded frame')
+    parser.add_argument('--skip-flat', action='store_true', help='do not build the flat-directory comparison')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        hydro.app.root_path = tmp
+        hydro.DATABASE = os.path.join(tmp, 'bench.db')
+        os.makedirs(os.path.join(tmp, hydro.UPLOAD_FOLDER))
+        hydro.init_db()
+        # Thumbnails would compete with the measured requests for the CPU
+        hydro.thumbnail_workers.submit = lambda filename: False
+
+        print(f"Filling the store with {args.images} images...")
+        hashes = fill_store(args.images, args.file_bytes)
+
+        client = hydro.app.test_client()
+        results = {
+            'upload (new frame)': time_uploads(client, args.samples, args.frame_bytes, duplicate=False),
+            'upload (duplicate frame)': time_uploads(client, args.samples, args.frame_bytes, duplicate=True),
+            'serve': time_serves(client, hashes, args.samples),
+        }
+
+        if not args.skip_flat:
+            print(f"Filling a flat directory with {args.images} files...")
+            folder = os.path.join(tmp, 'flat')
+            names = fill_flat(folder, args.images, args.file_bytes)
+            reads, creates = time_flat(folder, names, args.samples, args.frame_bytes)
+            results['flat dir: open+read file'] = reads
+            results['flat dir: create file'] = creates
+
+        print(f"\n{args.images} images, {args.samples} samples each")
+        print(f"{'operation':<28}  {'p50 ms':>8}  {'p99 ms':>8}")
+        for name, latencies in results.items():
+            p50, p99 = percentiles(latencies)
+            print(f"{name:<28}  {p50:>8.3f}  {p99:>8.3f}")
+
+        # Let the temporary directory go without open connections recreating WAL files
+        hydro.db_pool.clear()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Benchmark the camera grid query: GROUP BY self-join vs the camera_status pointer.
+
+Fills a scratch database (schema up to migration 7) with ROWS camera_images
+rows spread over the 40 cameras of the five units, then times migration 8,
+which points every camera_status row at its newest image. Then it compares,
+per unit, the `MAX(timestamp) GROUP BY camera_id` self-join that
+GET /units/<unit_id>/cameras/latest used to run with
+SQLiteStorage.latest_camera_images(), which reads the pointers. Finally it
+times record_camera_image() plus commit, the upload's write path, which now
+also moves the pointer.
+
+Usage:
+    python benchmarks/bench_latest_images.py              # 5M rows
+    python benchmarks/bench_latest_images.py --rows 500000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app as hydro  # noqa: E402
+
+UNIT_IDS = ['DWC1', 'DWC2', 'NFT', 'AERO', 'TROUGH']
+CAMERA_IDS = [f"{unit_id}L{level}{pos}" for unit_id in UNIT_IDS for level in (1, 2, 3, 4) for pos in (1, 2)]
+FILL_BATCH = 50000
+GROUP_BY_QUERY = '''
+    SELECT DISTINCT ci.camera_id, ci.timestamp, ci.image_path, ci.level, ci.position
+    FROM camera_images ci
+    INNER JOIN (
+        SELECT camera_id, MAX(timestamp) as max_timestamp
+        FROM camera_images
+        WHERE unit_id = ?
+        GROUP BY camera_id
+    ) latest ON ci.camera_id = latest.camera_id AND ci.timestamp = latest.max_timestamp
+    ORDER BY ci.level, ci.position
+'''
+
+
+def row(i, start):
+    camera_id = CAMERA_IDS[i % len(CAMERA_IDS)]
+    timestamp = start + (i // len(CAMERA_IDS)) * 60
+    return (camera_id, camera_id[:camera_id.index('L')], int(camera_id[-2]), int(camera_id[-1]),
+            f'camera_images/{camera_id}_{timestamp}.jpg', timestamp, 120000)
+
+
+def fill(db, count):
+    """Insert `count` image rows, one per camera per minute, and their camera_status rows"""
+    start = int(time.time()) - (count // len(CAMERA_IDS)) * 60
+    for offset in range(0, count, FILL_BATCH):
+        db.executemany('''
+            INSERT INTO camera_images (camera_id, unit_id, level, position, image_path, timestamp, file_size)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [row(i, start) for i in range(offset, min(offset + FILL_BATCH, count))])
+        db.commit()
+        print(f"  {min(offset + FILL_BATCH, count)} rows", end='\r', flush=True)
+    print()
+    db.execute('''
+        INSERT INTO camera_status (camera_id, unit_id, last_image_timestamp, total_images, status)
+        SELECT camera_id, unit_id, MAX(timestamp), COUNT(*), 'online' FROM camera_images GROUP BY camera_id
+    ''')
+    db.commit()
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def time_query(query, repeat):
+    """Latencies in ms of query(unit_id), round-robin over the units"""
+    latencies = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        query(UNIT_IDS[i % len(UNIT_IDS)])
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5000000, help='camera_images rows')
+    parser.add_argument('--repeat', type=int, default=20, help='executions of each query')
+    parser.add_argument('--uploads', type=int, default=1000, help='image rows recorded for the write timing')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        hydro.DATABASE = os.path.join(tmp, 'bench.db')
+        migrations = hydro.MIGRATIONS
+        pointer = [m for m in migrations if m[2] is hydro._migration_camera_latest_image]
+        hydro.MIGRATIONS = [m for m in migrations if m not in pointer]
+        hydro.init_db()
+        hydro.MIGRATIONS = migrations
+
+        db = hydro.db_pool.connect()
+        print(f"Filling camera_images with {args.rows} rows...")
+        fill(db, args.rows)
+
+        start = time.perf_counter()
+        pointer[0][2](db)
+        db.commit()
+        print(f"Migration 8 (backfill the pointers): {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        storage = hydro.SQLiteStorage(db)
+        results = {
+            'GROUP BY self-join': time_query(lambda unit_id: db.execute(GROUP_BY_QUERY, (unit_id,)).fetchall(),
+                                             args.repeat),
+            'camera_status pointer': time_query(storage.latest_camera_images, args.repeat),
+        }
+
+        latencies = []
+        now = int(time.time())
+        for i in range(args.uploads):
+            camera_id = CAMERA_IDS[i % len(CAMERA_IDS)]
+            start = time.perf_counter()
+            storage.record_camera_image({
+                'camera_id': camera_id, 'unit_id': camera_id[:camera_id.index('L')],
+                'level': int(camera_id[-2]), 'position': int(camera_id[-1]),
+                'image_path': f'camera_images/{camera_id}_{now + i}.jpg', 'timestamp': now + i, 'file_size': 1024
+            })
+            storage.commit()
+            latencies.append((time.perf_counter() - start) * 1000)
+        results['record_camera_image'] = latencies
+
+        print(f"\n{args.rows} image rows")
+        print(f"{'operation':<24}  {'p50 ms':>9}  {'p99 ms':>9}")
+        for name, latencies in results.items():
+            p50, p99 = percentiles(latencies)
+            print(f"{name:<24}  {p50:>9.3f}  {p99:>9.3f}")
+
+        db.close()
+        hydro.db_pool.clear()
+
+
+if __name__ == '__main__':
+    main()
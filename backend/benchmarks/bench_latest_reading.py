@@ -0,0 +1,109 @@
+"""Benchmark latest-row lookups with and without the composite indexes.
+
+Fills a scratch database with sensor readings for the five default units and
+times the `ORDER BY timestamp DESC LIMIT 1` query used by the dashboard's
+latest-reading endpoints. With the (unit_id, timestamp) index from schema
+migration 2 the latency stays flat as the table grows; without it every
+lookup sorts the whole table.
+
+Usage:
+    python benchmarks/bench_latest_reading.py              # 10k, 100k, 1M
+    python benchmarks/bench_latest_reading.py --max 10000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app as hydro  # noqa: E402
+
+UNIT_IDS = ['DWC1', 'DWC2', 'NFT', 'AERO', 'TROUGH']
+LATEST_QUERY = '''
+    SELECT * FROM sensor_readings
+    WHERE unit_id = ?
+    ORDER BY timestamp DESC
+    LIMIT 1
+'''
+
+
+def fill(db, start, count):
+    """Append `count` readings, round-robin across units, 30 s apart"""
+    batch = []
+    for i in range(start, start + count):
+        batch.append((UNIT_IDS[i % len(UNIT_IDS)], 1700000000 + (i // len(UNIT_IDS)) * 30,
+                      round(random.uniform(5.5, 7.0), 1), random.randint(800, 1200),
+                      random.randint(8, 20), round(random.uniform(20, 25), 1),
+                      random.randint(70, 90), '{}'))
+        if len(batch) >= 50000:
+            db.executemany('''
+                INSERT INTO sensor_readings
+                (unit_id, timestamp, ph, tds, turbidity, water_temp, water_level, climate_data)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', batch)
+            batch = []
+    if batch:
+        db.executemany('''
+            INSERT INTO sensor_readings
+            (unit_id, timestamp, ph, tds, turbidity, water_temp, water_level, climate_data)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', batch)
+    db.commit()
+
+
+def time_latest(db, repeat):
+    """Return the median latency of the latest-row query in milliseconds"""
+    samples = []
+    for i in range(repeat):
+        unit_id = UNIT_IDS[i % len(UNIT_IDS)]
+        start = time.perf_counter()
+        db.execute(LATEST_QUERY, (unit_id,)).fetchone()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--max', type=int, default=1000000, help='largest table size (rows)')
+    parser.add_argument('--repeat', type=int, default=50, help='lookups per measurement')
+    args = parser.parse_args()
+
+    sizes = [n for n in (10000, 100000, 1000000, 10000000) if n <= args.max]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        hydro.DATABASE = os.path.join(tmp, 'bench.db')
+        hydro.init_db()
+
+        db = sqlite3.connect(hydro.DATABASE)
+        db.row_factory = sqlite3.Row
+
+        print(f"{'rows':>10}  {'indexed ms':>10}  {'no index ms':>11}")
+        rows = 0
+        for size in sizes:
+            fill(db, rows, size - rows)
+            rows = size
+
+            indexed = time_latest(db, args.repeat)
+
+            # Same query with the indexes hidden from the planner
+            db.execute('DROP INDEX idx_sensor_readings_unit_ts')
+            db.execute('DROP INDEX idx_sensor_readings_ts')
+            unindexed = time_latest(db, max(3, args.repeat // 10))
+            db.execute('''
+                CREATE UNIQUE INDEX idx_sensor_readings_unit_ts
+                ON sensor_readings (unit_id, timestamp, client_timestamped)
+            ''')
+            db.execute('CREATE INDEX idx_sensor_readings_ts ON sensor_readings (timestamp)')
+
+            print(f"{rows:>10}  {indexed:>10.3f}  {unindexed:>11.3f}")
+
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Benchmark the schedule engine with thousands of pump cycles.
+
+Gives UNITS units a pump_cycle schedule (a random on duration of 1-5 s in a
+10-30 s interval, so transitions are spread over time) on a scratch SQLite
+database, runs the schedule engine for DURATION seconds and reports how
+many transitions it applied, the lag between a transition's due time and
+the moment the engine reached it, and the engine thread's CPU time per
+transition. Each transition is a heap pop and push plus a schedule read, a
+relay_current UPSERT with its relay_events row, a device command, the
+commit, and a relay_update emit.
+
+Usage:
+    python benchmarks/bench_schedule_engine.py
+    python benchmarks/bench_schedule_engine.py --units 20000 --duration 60
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app as hydro  # noqa: E402
+
+
+class TimedScheduleEngine(hydro.ScheduleEngine):
+    """ScheduleEngine that records how late each due schedule is reached"""
+
+    def __init__(self):
+        super().__init__()
+        self.lags = []
+        self.cpu = 0.0
+
+    def _apply(self, storage, when, key, job):
+        self.lags.append((time.time() - when) * 1000)
+        start = time.thread_time()
+        try:
+            return super()._apply(storage, when, key, job)
+        finally:
+            self.cpu += time.thread_time() - start
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--units', type=int, default=5000, help='units with a pump cycle')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run the engine')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        hydro.DATABASE = os.path.join(tmp, 'bench.db')
+        hydro.init_db()
+
+        storage = hydro.open_storage()
+        for i in range(args.units):
+            storage.save_schedule(f'UNIT{i}', {'pump_cycle': {'on_duration_sec': random.randint(1, 5),
+                                                              'interval_sec': random.randint(10, 30)}})
+        storage.commit()
+        storage.close()
+
+        engine = TimedScheduleEngine()
+        start = time.perf_counter()
+        engine.start()
+        # The first pass brings every unit to its scheduled state; measure from the second
+        while engine.pending() < args.units or len(engine.lags) < args.units:
+            time.sleep(0.05)
+        print(f"Loaded and applied {args.units} schedules in {time.perf_counter() - start:.2f} s")
+
+        engine.lags.clear()
+        engine.cpu = 0.0
+        transitions = engine.transitions
+        time.sleep(args.duration)
+        applied = engine.transitions - transitions
+        lags = list(engine.lags)
+        engine_threads = [t for t in threading.enumerate() if t.name == 'schedule-engine']
+
+        p50, p99 = percentiles(lags) if lags else (0, 0)
+        print(f"\n{args.units} units, {args.duration:g} s")
+        print(f"transitions applied     {applied} ({applied / args.duration:.0f}/s)")
+        print(f"lag behind due time     p50 {p50:.2f} ms, p99 {p99:.2f} ms")
+        print(f"engine CPU / transition {engine.cpu / max(len(lags), 1) * 1000:.3f} ms")
+        print(f"heap entries            {len(engine._heap)} for {engine.pending()} schedules")
+        assert engine_threads, 'schedule engine thread died'
+        hydro.db_pool.clear()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Benchmark sensor ingest and dashboard queries on each storage backend.
+
+For every backend this writes HOURS of 30-second readings for the five units
+through Storage.insert_sensor_readings() in batches of BATCH rows (one
+commit per batch, like the ingest writer), plus relay changes and camera
+uploads, and reports rows/s. It then times the reads behind the dashboard
+(latest reading, latest relays, schedule, camera list, latest images per
+unit) and reports p50/p99 per query. SQLite runs on a scratch file; with
+--postgres the same run goes to a scratch schema that is dropped afterwards.
+
+Usage:
+    python benchmarks/bench_storage.py
+    python benchmarks/bench_storage.py --postgres postgresql://hydro@localhost/hydro --hours 48
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app as hydro  # noqa: E402
+
+UNIT_IDS = ['DWC1', 'DWC2', 'NFT', 'AERO', 'TROUGH']
+POSITIONS = [f"L{level}{pos}" for level in (1, 2, 3, 4) for pos in (1, 2)]
+CAMERA_IDS = [f"{unit_id}L{level}{pos}" for unit_id in UNIT_IDS for level in (1, 2, 3, 4) for pos in (1, 2)]
+
+
+def reading(unit_id, timestamp):
+    """A random sensor row in the shape Storage.insert_sensor_readings() expects"""
+    return {
+        'unit_id': unit_id, 'timestamp': timestamp,
+        'ph': round(random.uniform(5.5, 7.0), 1), 'tds': random.randint(800, 1200),
+        'turbidity': random.randint(8, 20), 'water_temp': round(random.uniform(20, 25), 1),
+        'water_level': random.randint(70, 90),
+        'climate': {p: {'temp': round(random.uniform(22, 26), 1), 'humidity': random.randint(65, 75)}
+                    for p in POSITIONS}
+    }
+
+
+def ingest(storage, args):
+    """Write the readings, relay changes and images; return sensor rows per second"""
+    now = int(time.time())
+    rows = [reading(unit_id, ts) for ts in range(now - args.hours * 3600, now, 30) for unit_id in UNIT_IDS]
+
+    start = time.perf_counter()
+    for i in range(0, len(rows), args.batch):
+        storage.insert_sensor_readings(rows[i:i + args.batch])
+        storage.commit()
+    elapsed = time.perf_counter() - start
+
+    for ts in range(now - args.hours * 3600, now, 600):
+        for unit_id in UNIT_IDS:
+            state = random.choice(['ON', 'OFF'])
+            storage.set_relays(unit_id, ts, {'lights': state, 'fans': state, 'pump': 'ON'}, source='schedule')
+        for camera_id in CAMERA_IDS:
+            storage.record_camera_image({
+                'camera_id': camera_id, 'unit_id': camera_id[:camera_id.index('L')],
+                'level': int(camera_id[-2]), 'position': int(camera_id[-1]),
+                'image_path': f'camera_images/{camera_id}_{ts}.jpg', 'timestamp': ts, 'file_size': 1024
+            })
+        storage.commit()
+    return len(rows), len(rows) / elapsed
+
+
+def time_queries(storage, args):
+    """Run each dashboard query `repeat` times per unit; return {name: (p50 ms, p99 ms)}"""
+    queries = {
+        'latest_sensor_reading': storage.latest_sensor_reading,
+        'latest_relay_state': storage.latest_relay_state,
+        'load_schedule': storage.load_schedule,
+        'list_cameras': storage.list_cameras,
+        'latest_camera_images': storage.latest_camera_images,
+        'camera_images(L11, 20)': lambda unit_id: storage.camera_images(f'{unit_id}L11', 20),
+    }
+    results = {}
+    for name, query in queries.items():
+        latencies = []
+        for i in range(args.repeat):
+            unit_id = UNIT_IDS[i % len(UNIT_IDS)]
+            start = time.perf_counter()
+            query(unit_id)
+            latencies.append((time.perf_counter() - start) * 1000)
+        storage.rollback()
+        latencies.sort()
+        results[name] = (latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)])
+    return results
+
+
+def sqlite_storage(tmp):
+    hydro.DATABASE = os.path.join(tmp, 'bench.db')
+    hydro.init_db()
+    return hydro.SQLiteStorage(hydro.db_pool.connect())
+
+
+def postgres_storage(url, schema):
+    db = hydro.connect_postgres(url)
+    db.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+    db.execute(f'CREATE SCHEMA {schema}')
+    db.execute(f'SET search_path TO {schema}, public')
+    db.commit()
+    storage = hydro.PostgresStorage(db)
+    timescale = storage.create_schema()
+    return storage, timescale
+
+
+def report(label, storage, args):
+    count, rate = ingest(storage, args)
+    print(f"\n{label}: ingested {count} readings at {rate:,.0f} rows/s (batches of {args.batch})")
+    print(f"  {'query':<26}  {'p50 ms':>7}  {'p99 ms':>7}")
+    for name, (p50, p99) in time_queries(storage, args).items():
+        print(f"  {name:<26}  {p50:>7.3f}  {p99:>7.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--hours', type=int, default=24, help='hours of readings to ingest')
+    parser.add_argument('--batch', type=int, default=500, help='readings per commit')
+    parser.add_argument('--repeat', type=int, default=500, help='executions per query')
+    parser.add_argument('--postgres', metavar='URL', help='also benchmark PostgresStorage against this database')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = sqlite_storage(tmp)
+        try:
+            report('sqlite', storage, args)
+        finally:
+            storage.close()
+
+    if args.postgres:
+        schema = f'hydro_bench_{os.getpid()}'
+        storage, timescale = postgres_storage(args.postgres, schema)
+        try:
+            report('postgres + timescaledb' if timescale else 'postgres', storage, args)
+        finally:
+            storage.rollback()
+            storage.db.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+            storage.commit()
+            storage.close()
+
+
+if __name__ == '__main__':
+    main()
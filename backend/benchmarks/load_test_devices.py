@@ -0,0 +1,212 @@
+"""Load-test the device command channel with 1,000 long-polling devices.
+
+Starts `server.py --workers 1 --no-jobs` on a scratch database and connects
+DEVICES simulated ESP32s, spread over PROCESSES client processes with one
+thread and one keep-alive connection per device. Each device long-polls
+GET /api/units/<unit_id>/commands with its cursor and acknowledges what it
+receives. A driver thread in each process switches the pump of a random
+device that has nothing in flight through POST /units/<unit_id>/relay, at
+RATE changes per second overall, and the device notes how long the change
+took to reach it. Reports delivery and ack latency, the polls each device
+sent per minute, and the requests the same fleet would send polling
+GET /units/<unit_id>/relays every POLL_INTERVAL seconds.
+
+Usage:
+    python benchmarks/load_test_devices.py
+    python benchmarks/load_test_devices.py --devices 2000 --rate 200 --poll-timeout 25
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server.py')
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return 0, 0
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+class Fleet:
+    """The devices of one client process and the changes in flight to them"""
+
+    def __init__(self, port, unit_ids, poll_timeout):
+        self.port = port
+        self.unit_ids = unit_ids
+        self.poll_timeout = poll_timeout
+        self.lock = threading.Lock()
+        self.in_flight = {}         # unit_id -> (pump state, perf_counter when sent)
+        self.delivery = []
+        self.acks = []
+        self.polls = 0
+        self.errors = 0
+        self.connected = 0
+
+    def device(self, unit_id, deadline):
+        """Long-poll and ack until the deadline, like an ESP32 would"""
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=self.poll_timeout + 30)
+        cursor = None
+        while time.time() < deadline:
+            path = f'/api/units/{unit_id}/commands?timeout={self.poll_timeout}'
+            if cursor is not None:
+                path += f'&since={cursor}'
+            try:
+                if cursor is None:
+                    with self.lock:
+                        self.connected += 1
+                connection.request('GET', path)
+                response = connection.getresponse()
+                body = json.loads(response.read())
+                received = time.perf_counter()
+                cursor = body['cursor']
+                with self.lock:
+                    self.polls += 1
+                    for command in body['commands']:
+                        expected = self.in_flight.get(unit_id)
+                        if command['kind'] == 'relays' and expected and command['data']['pump'] == expected[0]:
+                            self.delivery.append((received - expected[1]) * 1000)
+                            del self.in_flight[unit_id]
+                if body['commands']:
+                    start = time.perf_counter()
+                    connection.request('POST', f'/api/units/{unit_id}/commands/ack',
+                                       body=json.dumps({'id': cursor}),
+                                       headers={'Content-Type': 'application/json'})
+                    ack = connection.getresponse()
+                    ack.read()
+                    with self.lock:
+                        self.acks.append((time.perf_counter() - start) * 1000)
+                        if ack.status >= 400:
+                            self.errors += 1
+            except (OSError, http.client.HTTPException, ValueError):
+                with self.lock:
+                    self.errors += 1
+                connection.close()
+                time.sleep(0.5)
+        connection.close()
+
+    def driver(self, rate, start, deadline):
+        """Switch pumps of idle devices at `rate` changes per second"""
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        pumps = {}
+        interval = 1 / rate
+        due = start
+        while time.time() < deadline:
+            due += interval
+            time.sleep(max(0, due - time.time()))
+            with self.lock:
+                idle = [unit_id for unit_id in random.sample(self.unit_ids, min(8, len(self.unit_ids)))
+                        if unit_id not in self.in_flight]
+                if not idle:
+                    continue
+                unit_id = idle[0]
+                pumps[unit_id] = 'OFF' if pumps.get(unit_id) == 'ON' else 'ON'
+                self.in_flight[unit_id] = (pumps[unit_id], time.perf_counter())
+            try:
+                connection.request('POST', f'/units/{unit_id}/relay', body=json.dumps({'pump': pumps[unit_id]}),
+                                   headers={'Content-Type': 'application/json'})
+                connection.getresponse().read()
+            except (OSError, http.client.HTTPException):
+                with self.lock:
+                    self.errors += 1
+                    self.in_flight.pop(unit_id, None)
+                connection.close()
+        connection.close()
+
+
+def run_client(args):
+    """Run a share of the devices and a driver; returns (delivery ms, ack ms, polls, errors, undelivered)"""
+    port, unit_ids, rate, poll_timeout, start, deadline = args
+    fleet = Fleet(port, unit_ids, poll_timeout)
+    threads = [threading.Thread(target=fleet.device, args=(unit_id, deadline), daemon=True) for unit_id in unit_ids]
+    for thread in threads:
+        thread.start()
+    # Changes start once every device of every process has sent its first poll
+    while fleet.connected < len(unit_ids) and time.time() < start:
+        time.sleep(0.05)
+    time.sleep(max(0, start - time.time()))
+    fleet.driver(rate, start, deadline)
+    # Give the last changes and the open polls time to come back
+    for thread in threads:
+        thread.join(max(0, deadline + poll_timeout + 5 - time.time()))
+    with fleet.lock:
+        return fleet.delivery, fleet.acks, fleet.polls, fleet.errors, len(fleet.in_flight)
+
+
+def wait_ready(port, timeout=30):
+    """Block until the worker answers, or raise"""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            connection.request('GET', '/units/DWC1/relays')
+            connection.getresponse().read()
+            connection.close()
+            return
+        except OSError:
+            if time.time() > deadline:
+                raise RuntimeError(f'worker on port {port} did not start')
+            time.sleep(0.2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--devices', type=int, default=1000, help='simulated devices')
+    parser.add_argument('--processes', type=int, default=4, help='client processes the devices are spread over')
+    parser.add_argument('--rate', type=float, default=50, help='relay changes per second, overall')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of relay changes')
+    parser.add_argument('--poll-timeout', type=float, default=25, help='long-poll timeout the devices ask for')
+    parser.add_argument('--poll-interval', type=float, default=2, help='interval of the polling being compared')
+    parser.add_argument('--port', type=int, default=5400, help='port to run server.py on')
+    args = parser.parse_args()
+
+    unit_ids = [f'DEV{n:04d}' for n in range(args.devices)]
+    shares = [unit_ids[i::args.processes] for i in range(args.processes)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        server = subprocess.Popen([sys.executable, SERVER, '--workers', '1', '--port', str(args.port), '--no-jobs'],
+                                  cwd=tmp, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_ready(args.port)
+            # Connecting a thousand devices takes a moment; changes start after that
+            start = time.time() + max(5, args.devices / 200)
+            deadline = start + args.duration
+            launched = time.time()
+            with multiprocessing.Pool(args.processes) as pool:
+                results = pool.map(run_client, [(args.port, share, args.rate / args.processes, args.poll_timeout,
+                                                 start, deadline) for share in shares])
+            minutes = (time.time() - launched) / 60
+        finally:
+            server.terminate()
+            server.wait()
+
+    delivery = [latency for r in results for latency in r[0]]
+    acks = [latency for r in results for latency in r[1]]
+    polls = sum(r[2] for r in results)
+    errors = sum(r[3] for r in results)
+    undelivered = sum(r[4] for r in results)
+
+    print(f"\n{args.devices} devices, {args.rate:g} relay changes/s for {args.duration:g} s, "
+          f"{args.poll_timeout:g} s long-polls")
+    p50, p99 = percentiles(delivery)
+    print(f"changes delivered       {len(delivery)} ({undelivered} undelivered, {errors} errors)")
+    print(f"delivery latency        p50 {p50:.1f} ms, p99 {p99:.1f} ms")
+    p50, p99 = percentiles(acks)
+    print(f"ack round trip          p50 {p50:.1f} ms, p99 {p99:.1f} ms")
+    print(f"long-polls              {polls / minutes:.0f}/min for the fleet "
+          f"({polls - len(acks)} returned without a command)")
+    print(f"polling every {args.poll_interval:g} s     {args.devices * 60 / args.poll_interval:.0f}/min for the fleet, "
+          f"delivery after {args.poll_interval * 500:.0f} ms on average")
+
+
+if __name__ == '__main__':
+    main()
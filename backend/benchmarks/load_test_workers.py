@@ -0,0 +1,145 @@
+"""Load-test server.py with 1, 2, 4... workers and report requests per second.
+
+For each worker count this starts `server.py --workers N --no-jobs` on a
+scratch database and runs CLIENTS client processes for DURATION seconds.
+Each client spreads keep-alive requests round-robin over the worker ports,
+as nginx's upstream does in production. The request mix is the dashboard's
+polling traffic (latest sensors, relays, room, schedule, snapshot) plus one
+ESP32 sensor post in eight. Throughput should grow with the worker count
+until the machine runs out of cores.
+
+More than one worker needs a Socket.IO message queue (a local Redis is
+enough) and eventlet installed.
+
+Usage:
+    python benchmarks/load_test_workers.py --workers 1
+    python benchmarks/load_test_workers.py --workers 1,2,4 --message-queue redis://localhost:6379/0
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server.py')
+UNIT_IDS = ['DWC1', 'DWC2', 'NFT', 'AERO', 'TROUGH']
+SENSOR_BODY = json.dumps({
+    'reservoir': {'ph': 6.2, 'tds': 950, 'turbidity': 12, 'water_temp': 22.4, 'water_level': 78},
+    'climate': {f'L{level}{pos}': {'temp': 24.0, 'humidity': 70} for level in range(1, 5) for pos in (1, 2)}
+})
+
+
+def request_mix(i):
+    """(method, path, body) of the i-th request a client sends"""
+    unit_id = UNIT_IDS[i % len(UNIT_IDS)]
+    mix = [
+        ('GET', f'/units/{unit_id}/sensors-data', None),
+        ('GET', f'/units/{unit_id}/relays', None),
+        ('GET', '/room/front/sensors', None),
+        ('GET', f'/units/{unit_id}/schedule', None),
+        ('GET', f'/units/{unit_id}/sensors-data', None),
+        ('GET', '/room/back/sensors', None),
+        ('GET', '/dashboard/snapshot', None),
+        ('POST', f'/api/units/{unit_id}/sensors', SENSOR_BODY),
+    ]
+    return mix[i % len(mix)]
+
+
+def run_client(args):
+    """Send requests until the deadline; return (ok, errors, latencies in ms)"""
+    ports, deadline, offset = args
+    connections = [http.client.HTTPConnection('127.0.0.1', port, timeout=30) for port in ports]
+    ok = errors = 0
+    latencies = []
+    i = offset
+    while time.time() < deadline:
+        connection = connections[i % len(connections)]
+        method, path, body = request_mix(i)
+        headers = {'Content-Type': 'application/json'} if body else {}
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status < 400:
+                ok += 1
+            else:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            connection.close()
+        latencies.append((time.perf_counter() - start) * 1000)
+        i += 1
+    for connection in connections:
+        connection.close()
+    return ok, errors, latencies
+
+
+def wait_ready(ports, timeout=30):
+    """Block until every worker answers, or raise"""
+    deadline = time.time() + timeout
+    for port in ports:
+        while True:
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+                connection.request('GET', '/units/DWC1/relays')
+                connection.getresponse().read()
+                connection.close()
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise RuntimeError(f'worker on port {port} did not start')
+                time.sleep(0.2)
+
+
+def measure(workers, args):
+    """Start server.py with `workers` workers and return (req/s, errors, p50 ms, p99 ms)"""
+    ports = [args.port + i for i in range(workers)]
+    command = [sys.executable, SERVER, '--workers', str(workers), '--port', str(args.port), '--no-jobs']
+    if args.message_queue:
+        command += ['--message-queue', args.message_queue]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        server = subprocess.Popen(command, cwd=tmp, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_ready(ports)
+            deadline = time.time() + args.duration
+            with multiprocessing.Pool(args.clients) as pool:
+                results = pool.map(run_client, [(ports, deadline, n) for n in range(args.clients)])
+        finally:
+            server.terminate()
+            server.wait()
+
+    ok = sum(r[0] for r in results)
+    errors = sum(r[1] for r in results)
+    latencies = sorted(latency for r in results for latency in r[2])
+    p50 = latencies[len(latencies) // 2] if latencies else 0
+    p99 = latencies[int(len(latencies) * 0.99)] if latencies else 0
+    return ok / args.duration, errors, p50, p99
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', default='1,2,4', help='comma-separated worker counts to try')
+    parser.add_argument('--clients', type=int, default=32, help='concurrent client processes')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per measurement')
+    parser.add_argument('--port', type=int, default=5100, help='port of the first worker')
+    parser.add_argument('--message-queue', help='Socket.IO message queue URL, needed for more than one worker')
+    args = parser.parse_args()
+
+    counts = [int(n) for n in args.workers.split(',')]
+    if max(counts) > 1 and not args.message_queue:
+        parser.error('more than one worker needs --message-queue')
+
+    print(f"{'workers':>7}  {'req/s':>9}  {'errors':>6}  {'p50 ms':>7}  {'p99 ms':>7}")
+    for workers in counts:
+        rate, errors, p50, p99 = measure(workers, args)
+        print(f"{workers:>7}  {rate:>9.0f}  {errors:>6}  {p50:>7.1f}  {p99:>7.1f}")
+
+
+if __name__ == '__main__':
+    main()
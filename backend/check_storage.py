@@ -0,0 +1,362 @@
+"""Conformance checks for the storage backends in app.py.
+
+Runs the same checks against SQLiteStorage (on a scratch database) and, when
+given a PostgreSQL URL, against PostgresStorage (in a scratch schema that is
+dropped afterwards). Every backend must pass every check before the app can
+be pointed at it with HYDRO_STORAGE_URL. Exits non-zero if any check fails.
+
+Usage:
+    python check_storage.py
+    python check_storage.py --postgres postgresql://hydro@localhost/hydro
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import traceback
+
+import app as hydro
+
+POSITIONS = [f"L{level}{pos}" for level in (1, 2, 3, 4) for pos in (1, 2)]
+
+
+def reading(unit_id, timestamp, ph=6.2):
+    return {
+        'unit_id': unit_id, 'timestamp': timestamp, 'ph': ph, 'tds': 950,
+        'turbidity': 12, 'water_temp': 22.4, 'water_level': 78,
+        'climate': {p: {'temp': 24.0 + i / 10, 'humidity': 70 + i} for i, p in enumerate(POSITIONS)}
+    }
+
+
+def room_reading(room_id, timestamp, temp=25.4):
+    back = room_id == 'ROOM_BACK'
+    return {
+        'unit_id': room_id, 'timestamp': timestamp, 'temp': temp, 'humidity': 62,
+        'pressure': 1007, 'iaq': 132, 'co2': 780,
+        'ac_temp': 24 if back else None, 'ac_mode': 'COOL' if back else None
+    }
+
+
+def image(camera_id, timestamp):
+    unit_id = camera_id[:camera_id.index('L')]
+    return {
+        'camera_id': camera_id, 'unit_id': unit_id,
+        'level': int(camera_id[-2]), 'position': int(camera_id[-1]),
+        'image_path': f'camera_images/{camera_id}_{timestamp}.jpg',
+        'timestamp': timestamp, 'file_size': 1024
+    }
+
+
+# Checks. Each gets a freshly created, empty storage.
+
+def check_units(storage):
+    units = storage.list_units()
+    assert [u['unit_id'] for u in units] == [u[0] for u in hydro.DEFAULT_UNITS], units
+    assert units[0] == {'unit_id': 'DWC1', 'name': 'Deep Water Culture 1', 'type': 'DWC'}, units[0]
+
+
+def check_sensor_readings(storage):
+    assert storage.latest_sensor_reading('DWC1') is None
+    rows = [reading('DWC1', 1000), reading('DWC1', 1060, ph=6.5), reading('NFT', 1030)]
+    inserted = storage.insert_sensor_readings(rows)
+    storage.commit()
+    assert inserted == rows, inserted
+
+    latest = storage.latest_sensor_reading('DWC1')
+    expected = hydro.sensor_payload(reading('DWC1', 1060, ph=6.5), reading('DWC1', 1060)['climate'])
+    assert latest == expected, latest
+    assert storage.latest_sensor_reading('NFT')['timestamp'] == 1030
+
+    # A repeated device-stamped (unit_id, timestamp) is skipped and the stored reading kept
+    stamped = [{**reading('DWC1', 1090), 'client_timestamped': True},
+               {**reading('DWC1', 1090, ph=7.5), 'client_timestamped': True}]
+    inserted = storage.insert_sensor_readings(stamped)
+    storage.commit()
+    assert inserted == stamped[:1], inserted
+    assert storage.latest_sensor_reading('DWC1')['reservoir']['ph'] != 7.5
+
+    # Server-stamped readings in the same second are all kept; the last one is latest
+    inserted = storage.insert_sensor_readings([reading('DWC1', 1120), reading('DWC1', 1120, ph=7.5)])
+    storage.commit()
+    assert len(inserted) == 2, inserted
+    assert storage.latest_sensor_reading('DWC1')['reservoir']['ph'] == 7.5
+
+
+def check_sensor_reading_partial_climate(storage):
+    row = reading('AERO', 2000)
+    row['climate'] = {'L11': {'temp': 23.5, 'humidity': 60}}
+    storage.insert_sensor_readings([row])
+    storage.commit()
+    assert storage.latest_sensor_reading('AERO')['climate'] == {'L11': {'temp': 23.5, 'humidity': 60}}
+
+
+def check_payload_numbers(storage):
+    # Integers as posted must serialize like the stored values, so cached and stored ETags agree
+    row = {**reading('TROUGH', 3000, ph=6), 'climate': {'L11': {'temp': 24, 'humidity': 60}}}
+    room = {**room_reading('ROOM_BACK', 3000, temp=25), 'ac_temp': 24}
+    storage.insert_sensor_readings([row])
+    storage.insert_room_readings([room])
+    storage.commit()
+    stored = json.dumps(storage.latest_sensor_reading('TROUGH'), sort_keys=True)
+    assert stored == json.dumps(hydro.sensor_payload(row, row['climate']), sort_keys=True), stored
+    stored = json.dumps(storage.latest_room_reading('ROOM_BACK'), sort_keys=True)
+    assert stored == json.dumps(hydro.room_payload(room), sort_keys=True), stored
+
+
+def check_room_readings(storage):
+    assert storage.latest_room_reading('ROOM_BACK') is None
+    storage.insert_room_readings([room_reading('ROOM_FRONT', 1000), room_reading('ROOM_BACK', 1000),
+                                  room_reading('ROOM_BACK', 1010, temp=26.0)])
+    storage.commit()
+
+    back = storage.latest_room_reading('ROOM_BACK')
+    assert back == hydro.room_payload(room_reading('ROOM_BACK', 1010, temp=26.0)), back
+    front = storage.latest_room_reading('ROOM_FRONT')
+    assert 'ac' not in front and front['bme']['temp'] == 25.4, front
+
+
+def check_relay_states(storage):
+    assert storage.latest_relay_state('DWC1') is None
+    assert storage.relay_events('DWC1', 10) == []
+
+    # Relays not named keep their state (OFF for a new unit)
+    payload = storage.set_relays('DWC1', 1000, {'lights': 'ON'}, source='manual')
+    assert payload == {'unit_id': 'DWC1', 'timestamp': 1000, 'relays': {'lights': 'ON', 'fans': 'OFF', 'pump': 'OFF'}}
+    # Two changes in the same second: the later write wins
+    storage.set_relays('DWC1', 1005, {'fans': 'ON'}, source='schedule')
+    storage.set_relays('DWC1', 1005, {'lights': 'OFF', 'pump': 'ON'}, source='manual')
+    # Setting a relay to the state it already has logs nothing
+    storage.set_relays('DWC1', 1006, {'pump': 'ON', 'fans': 'ON'}, source='schedule')
+    storage.commit()
+
+    assert storage.latest_relay_state('DWC1') == {
+        'unit_id': 'DWC1', 'timestamp': 1006, 'relays': {'lights': 'OFF', 'fans': 'ON', 'pump': 'ON'}
+    }
+    assert storage.latest_relay_state('DWC2') is None
+
+    events = [dict(event) for event in storage.relay_events('DWC1', 10)]
+    assert [(e['timestamp'], e['relay'], e['state'], e['source']) for e in events] == [
+        (1005, 'pump', 'ON', 'manual'), (1005, 'lights', 'OFF', 'manual'),
+        (1005, 'fans', 'ON', 'schedule'), (1000, 'lights', 'ON', 'manual'),
+    ], events
+
+    # Keyset pages join up without gaps or repeats, and filter by relay
+    first = storage.relay_events('DWC1', 2)
+    rest = storage.relay_events('DWC1', 10, before=(first[-1]['timestamp'], first[-1]['id']))
+    assert [e['id'] for e in first + rest] == [e['id'] for e in events]
+    assert [e['state'] for e in storage.relay_events('DWC1', 10, relay='lights')] == ['OFF', 'ON']
+    assert storage.relay_events('DWC2', 10) == []
+
+
+def check_schedules(storage):
+    assert storage.load_schedule('DWC1') == {'_control_mode': 'timer'}
+
+    schedule = {'lights': {'on': '06:00', 'off': '22:00'}, 'pump': {'interval': 15}}
+    storage.save_schedule('DWC1', schedule)
+    storage.commit()
+    assert storage.load_schedule('DWC1') == {**schedule, '_control_mode': 'timer'}
+
+    storage.set_control_mode('DWC1', 'manual')
+    storage.commit()
+    assert storage.load_schedule('DWC1')['_control_mode'] == 'manual'
+
+    # Saving replaces the old schedule and returns the unit to timer mode
+    storage.save_schedule('DWC1', {'fans': {'on': '08:00'}})
+    storage.commit()
+    assert storage.load_schedule('DWC1') == {'fans': {'on': '08:00'}, '_control_mode': 'timer'}
+    assert storage.load_schedule('NFT') == {'_control_mode': 'timer'}
+
+    storage.save_schedule('NFT', {'pump_cycle': {'on_duration_sec': 300, 'interval_sec': 1800}})
+    storage.set_control_mode('NFT', 'manual')
+    storage.commit()
+    assert storage.load_schedules() == {'DWC1': storage.load_schedule('DWC1'), 'NFT': storage.load_schedule('NFT')}
+    assert storage.load_schedules()['NFT']['_control_mode'] == 'manual'
+
+
+def check_ac_schedule(storage):
+    schedule = storage.load_ac_schedule()
+    assert schedule == {f'{hour:02d}': 24 for hour in range(24)}, schedule
+    assert list(schedule) == sorted(schedule)
+
+    storage.save_ac_schedule({'06': 22, '18': 26})
+    storage.commit()
+    schedule = storage.load_ac_schedule()
+    assert schedule['06'] == 22 and schedule['18'] == 26 and schedule['12'] == 24, schedule
+
+
+def check_cameras(storage):
+    before = storage.camera_version('DWC1')
+    assert storage.list_cameras() == []
+
+    for camera_id, timestamp in [('DWC1L11', 1000), ('DWC1L11', 1300), ('DWC1L22', 1100), ('NFTL12', 1200)]:
+        storage.record_camera_image(image(camera_id, timestamp))
+    storage.commit()
+
+    cameras = storage.list_cameras('DWC1')
+    assert [c['camera_id'] for c in cameras] == ['DWC1L11', 'DWC1L22'], cameras
+    assert cameras[0]['total_images'] == 2 and cameras[0]['last_image_timestamp'] == 1300
+    assert cameras[0]['status'] == 'online' and cameras[0]['unit_id'] == 'DWC1'
+    assert cameras[0]['last_image_path'] == 'camera_images/DWC1L11_1300.jpg', cameras[0]
+    assert [c['camera_id'] for c in storage.list_cameras()] == ['DWC1L11', 'DWC1L22', 'NFTL12']
+
+    images = storage.camera_images('DWC1L11', 10)
+    assert [i['timestamp'] for i in images] == [1300, 1000], images
+    assert images[0]['image_path'] == 'camera_images/DWC1L11_1300.jpg' and images[0]['file_size'] == 1024
+    assert len(storage.camera_images('DWC1L11', 1)) == 1
+
+    latest = storage.latest_camera_images('DWC1')
+    assert [(i['camera_id'], i['timestamp'], i['level'], i['position']) for i in latest] == [
+        ('DWC1L11', 1300, 1, 1), ('DWC1L22', 1100, 2, 2)], latest
+
+    after = storage.camera_version('DWC1')
+    assert after != before and after[1] == 1300, after
+    # Any upload in scope changes the version, even with an older timestamp
+    storage.record_camera_image(image('DWC1L22', 1050))
+    storage.commit()
+    assert storage.camera_version('DWC1') != after
+    assert storage.camera_version(camera_id='NFTL12')[1] == 1200
+    # ...but the latest image stays the newest one
+    assert [i['timestamp'] for i in storage.latest_camera_images('DWC1')] == [1300, 1100]
+
+    # Two images in the same second: the later upload is the latest
+    second = {**image('DWC1L22', 1100), 'image_path': 'camera_images/DWC1L22_1100_b.jpg'}
+    storage.record_camera_image(second)
+    storage.commit()
+    latest = storage.latest_camera_images('DWC1')
+    assert len(latest) == 2 and latest[1]['image_path'] == second['image_path'], latest
+    assert storage.list_cameras('DWC1')[1]['last_image_path'] == second['image_path']
+
+
+def check_device_commands(storage):
+    assert storage.device_commands('DWC1', 0) == []
+    assert storage.last_acked_command('DWC1') == 0
+
+    relays = {'lights': 'ON', 'fans': 'OFF', 'pump': 'OFF'}
+    first = storage.queue_device_command('DWC1', 'relays', relays, 1000)
+    schedule = storage.queue_device_command('DWC1', 'schedule', {'_control_mode': 'timer'}, 1001)
+    last = storage.queue_device_command('DWC1', 'relays', {**relays, 'pump': 'ON'}, 1002)
+    other = storage.queue_device_command('NFT', 'relays', relays, 1003)
+    storage.commit()
+    assert first < schedule < last < other
+
+    # Only the newest command of each kind, in id order
+    commands = storage.device_commands('DWC1', 0)
+    assert commands == [
+        {'id': schedule, 'kind': 'schedule', 'timestamp': 1001, 'data': {'_control_mode': 'timer'}},
+        {'id': last, 'kind': 'relays', 'timestamp': 1002, 'data': {**relays, 'pump': 'ON'}},
+    ], commands
+    assert [c['id'] for c in storage.device_commands('DWC1', schedule)] == [last]
+    assert storage.device_commands('DWC1', last) == []
+
+    # Acks are per unit, only move forward and must name one of the unit's commands
+    assert storage.ack_device_command('DWC1', schedule, 2000)
+    assert not storage.ack_device_command('DWC1', other, 2001)
+    assert not storage.ack_device_command('DWC1', other + 100, 2001)
+    storage.commit()
+    assert storage.last_acked_command('DWC1') == schedule
+    assert storage.ack_device_command('DWC1', last, 2002)
+    assert storage.ack_device_command('DWC1', first, 2003)
+    storage.commit()
+    assert storage.last_acked_command('DWC1') == last
+    assert storage.last_acked_command('NFT') == 0
+
+
+def check_rollback(storage):
+    storage.insert_sensor_readings([reading('DWC2', 1000)])
+    storage.set_relays('DWC2', 1000, {'lights': 'ON', 'fans': 'ON', 'pump': 'ON'})
+    storage.rollback()
+    assert storage.latest_sensor_reading('DWC2') is None
+    assert storage.latest_relay_state('DWC2') is None
+    assert storage.relay_events('DWC2', 10) == []
+
+
+CHECKS = [check_units, check_sensor_readings, check_sensor_reading_partial_climate, check_payload_numbers,
+          check_room_readings, check_relay_states, check_schedules, check_ac_schedule, check_cameras,
+          check_device_commands, check_rollback]
+
+
+# Backends. Each yields fresh storages and cleans up after itself.
+
+class SQLiteBackend:
+    name = 'sqlite'
+
+    def __init__(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.count = 0
+
+    def create(self):
+        self.count += 1
+        hydro.DATABASE = os.path.join(self.tmp.name, f'check{self.count}.db')
+        hydro.init_db()
+        return hydro.SQLiteStorage(hydro.db_pool.connect())
+
+    def close(self):
+        self.tmp.cleanup()
+
+
+class PostgresBackend:
+    name = 'postgres'
+
+    def __init__(self, url):
+        self.url = url
+        self.schemas = []
+
+    def create(self):
+        schema = f'hydro_check_{os.getpid()}_{len(self.schemas)}'
+        db = hydro.connect_postgres(self.url)
+        db.execute(f'CREATE SCHEMA {schema}')
+        db.execute(f'SET search_path TO {schema}, public')
+        db.commit()
+        self.schemas.append(schema)
+        storage = hydro.PostgresStorage(db)
+        storage.create_schema()
+        return storage
+
+    def close(self):
+        db = hydro.connect_postgres(self.url)
+        for schema in self.schemas:
+            db.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+        db.commit()
+        db.close()
+
+
+def run(backend):
+    """Run every check on fresh storage from `backend`; return the number of failures"""
+    failures = 0
+    for check in CHECKS:
+        storage = backend.create()
+        try:
+            check(storage)
+            print(f"PASS  {backend.name:<8}  {check.__name__}")
+        except Exception:
+            failures += 1
+            print(f"FAIL  {backend.name:<8}  {check.__name__}")
+            traceback.print_exc()
+        finally:
+            storage.close()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--postgres', metavar='URL', help='also check PostgresStorage against this database')
+    args = parser.parse_args()
+
+    backends = [SQLiteBackend()]
+    if args.postgres:
+        backends.append(PostgresBackend(args.postgres))
+
+    failures = 0
+    for backend in backends:
+        try:
+            failures += run(backend)
+        finally:
+            backend.close()
+
+    print(f"{len(CHECKS) * len(backends) - failures} passed, {failures} failed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Production entry point for the hydroponics backend.
+
+Starts WORKERS eventlet processes serving the Flask app and Socket.IO on
+consecutive ports (PORT, PORT+1, ...), plus one process that runs the sensor
+simulator, the schedule engine and the retention job. Live updates travel
+through a Socket.IO message queue, so a reading ingested by one worker reaches
+clients connected to any other, every worker keeps its latest-state cache in
+step, and schedule changes reach the schedule engine.
+
+Put nginx in front with an `ip_hash` upstream over the worker ports (see
+deploy-ec2.txt) so each client's Socket.IO session stays on one worker.
+Without --message-queue only a single worker is allowed, and it runs the
+background jobs itself. The jobs process answers /metrics, /health and /ready
+on the port after the last worker's, for Prometheus to scrape with them.
+
+Usage:
+    python server.py --workers 4 --port 5000 --message-queue redis://localhost:6379/0
+    python server.py --workers 1 --no-jobs
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+
+def run_worker(host, port, jobs):
+    """Serve the app on one port (runs in a worker process)"""
+    import eventlet
+    eventlet.monkey_patch()
+
+    import app as hydro
+    hydro.warm_latest_cache()
+    hydro.start_message_queue_listener()
+    if jobs:
+        hydro.start_background_jobs()
+    print(f"Worker {os.getpid()} serving on {host}:{port}")
+    hydro.socketio.run(hydro.app, host=host, port=port)
+
+
+def run_jobs(host, port):
+    """Run the simulator, schedule engine and retention job, serving only metrics and health checks (runs in the jobs process)"""
+    import eventlet
+    import eventlet.wsgi
+    eventlet.monkey_patch()
+
+    import app as hydro
+    hydro.warm_latest_cache()
+    # Relay and schedule changes made on the workers reach the schedule engine through the queue
+    hydro.start_message_queue_listener()
+    hydro.start_background_jobs()
+    print(f"Background jobs running in process {os.getpid()}, metrics on {host}:{port}")
+    # The plain Flask app without Socket.IO; nothing routes clients here
+    eventlet.wsgi.server(eventlet.listen((host, port)), hydro.app, log_output=False)
+
+
+def supervise(args):
+    """Prepare the database, start the worker and jobs processes, and wait"""
+    if args.workers > 1 and not args.message_queue:
+        sys.exit('--workers > 1 needs --message-queue so emits reach every worker')
+
+    os.environ['HYDRO_ASYNC_MODE'] = 'eventlet'
+    if args.message_queue:
+        os.environ['HYDRO_MESSAGE_QUEUE'] = args.message_queue
+
+    # Migrations run once, here, before any worker opens the database
+    import app as hydro
+    hydro.init_db()
+
+    # With a message queue the jobs get their own process; otherwise the
+    # only worker runs them
+    separate_jobs = bool(args.message_queue) and not args.no_jobs
+    worker_jobs = not args.message_queue and not args.no_jobs
+
+    script = os.path.abspath(__file__)
+    children = []
+    for i in range(args.workers):
+        command = [sys.executable, script, '--role', 'worker', '--host', args.host, '--port', str(args.port + i)]
+        if worker_jobs:
+            command.append('--run-jobs')
+        children.append(subprocess.Popen(command))
+    if separate_jobs:
+        children.append(subprocess.Popen([sys.executable, script, '--role', 'jobs', '--host', args.host,
+                                          '--port', str(args.port + args.workers)]))
+
+    def shutdown(code):
+        for child in children:
+            if child.poll() is None:
+                child.terminate()
+        for child in children:
+            child.wait()
+        sys.exit(code)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: shutdown(0))
+    signal.signal(signal.SIGINT, lambda signum, frame: shutdown(0))
+
+    # If any process dies, take the rest down too and let systemd restart us
+    while True:
+        for child in children:
+            code = child.poll()
+            if code is not None:
+                print(f"Process {child.pid} exited with {code}, shutting down")
+                shutdown(1)
+        time.sleep(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=1, help='number of web worker processes')
+    parser.add_argument('--host', default='127.0.0.1', help='address the workers listen on')
+    parser.add_argument('--port', type=int, default=5000, help='port of the first worker; the others follow')
+    parser.add_argument('--message-queue', default=os.environ.get('HYDRO_MESSAGE_QUEUE'),
+                        help='Socket.IO message queue URL, e.g. redis://localhost:6379/0')
+    parser.add_argument('--no-jobs', action='store_true', help='do not run the simulator, schedule engine and retention job')
+    parser.add_argument('--role', choices=['supervisor', 'worker', 'jobs'], default='supervisor',
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--run-jobs', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.role == 'worker':
+        run_worker(args.host, args.port, args.run_jobs)
+    elif args.role == 'jobs':
+        run_jobs(args.host, args.port)
+    else:
+        supervise(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-import React, { createContext, useContext, useEffect, useState } from 'react';
+import React, { createContext, useCallback, useContext, useEffect, useRef, useState } from 'react';
 import io from 'socket.io-client';
 
 const SocketContext = createContext();
@@ -11,11 +11,44 @@ export const useSocket = () => {
   return context;
 };
 
+// Apply a delta payload (only the changed fields) on top of the current state
+const mergeDelta = (current, delta) => {
+  if (!current) return delta;
+  const merged = { ...current };
+  Object.entries(delta).forEach(([key, value]) => {
+    if (value && typeof value === 'object' && !Array.isArray(value) &&
+        merged[key] && typeof merged[key] === 'object') {
+      merged[key] = mergeDelta(merged[key], value);
+    } else {
+      merged[key] = value;
+    }
+  });
+  return merged;
+};
+
+// Store a full or delta update for one unit, ignoring anything older than what we have
+const applyUpdate = (setter) => (message) => {
+  setter(prev => {
+    const current = prev[message.unit_id];
+    if (current && current.timestamp > message.timestamp) {
+      return prev;
+    }
+    return {
+      ...prev,
+      [message.unit_id]: message.full ? message.data : mergeDelta(current, message.data)
+    };
+  });
+};
+
 export const SocketProvider = ({ children }) => {
   const [socket, setSocket] = useState(null);
   const [connected, setConnected] = useState(false);
   const [sensorData, setSensorData] = useState({});
   const [relayData, setRelayData] = useState({});
+  const [roomData, setRoomData] = useState({});
+
+  // unit_id -> number of components subscribed; rejoined after a reconnect
+  const joinedUnits = useRef(new Map());
 
   useEffect(() => {
     // Connect to Socket.IO server
@@ -26,6 +59,10 @@ export const SocketProvider = ({ children }) => {
     newSocket.on('connect', () => {
       console.log('Connected to server');
       setConnected(true);
+      // Rejoining sends a fresh snapshot for every subscribed unit
+      joinedUnits.current.forEach((count, unitId) => {
+        newSocket.emit('join_unit', { unit_id: unitId });
+      });
     });
 
     newSocket.on('disconnect', () => {
@@ -33,18 +70,21 @@ export const SocketProvider = ({ children }) => {
       setConnected(false);
     });
 
-    newSocket.on('sensor_update', (data) => {
-      console.log('Sensor update received:', data);
-      // Trigger re-fetch of sensor data in components
+    newSocket.on('unit_snapshot', (data) => {
+      if (data.room) {
+        setRoomData(prev => ({ ...prev, [data.unit_id]: data.room }));
+      }
+      if (data.sensors) {
+        setSensorData(prev => ({ ...prev, [data.unit_id]: data.sensors }));
+      }
+      if (data.relays) {
+        setRelayData(prev => ({ ...prev, [data.unit_id]: data.relays }));
+      }
     });
 
-    newSocket.on('relay_update', (data) => {
-      console.log('Relay update received:', data);
-      setRelayData(prev => ({
-        ...prev,
-        [data.unit_id]: data
-      }));
-    });
+    newSocket.on('sensor_update', applyUpdate(setSensorData));
+    newSocket.on('relay_update', applyUpdate(setRelayData));
+    newSocket.on('room_update', applyUpdate(setRoomData));
 
     newSocket.on('connected', (data) => {
       console.log('Server message:', data);
@@ -57,23 +97,32 @@ export const SocketProvider = ({ children }) => {
     };
   }, []);
 
-  const joinUnit = (unitId) => {
-    if (socket) {
+  const joinUnit = useCallback((unitId) => {
+    const count = joinedUnits.current.get(unitId) || 0;
+    joinedUnits.current.set(unitId, count + 1);
+    if (count === 0 && socket && socket.connected) {
       socket.emit('join_unit', { unit_id: unitId });
     }
-  };
+  }, [socket]);
 
-  const leaveUnit = (unitId) => {
-    if (socket) {
-      socket.emit('leave_unit', { unit_id: unitId });
+  const leaveUnit = useCallback((unitId) => {
+    const count = joinedUnits.current.get(unitId) || 0;
+    if (count <= 1) {
+      joinedUnits.current.delete(unitId);
+      if (socket && socket.connected) {
+        socket.emit('leave_unit', { unit_id: unitId });
+      }
+    } else {
+      joinedUnits.current.set(unitId, count - 1);
     }
-  };
+  }, [socket]);
 
   const value = {
     socket,
     connected,
     sensorData,
     relayData,
+    roomData,
     joinUnit,
     leaveUnit
   };
@@ -83,4 +132,4 @@ export const SocketProvider = ({ children }) => {
       {children}
     </SocketContext.Provider>
   );
-};
\ No newline at end of file
+};
@@ -4,7 +4,7 @@ import styled from 'styled-components';
 import SensorCard from '../components/SensorCard';
 import IoTStatusIndicator from '../components/IoTStatusIndicator';
 import { useSocket } from '../contexts/SocketContext';
-import axios from 'axios';
+import { dashboardAPI } from '../services/api';
 
 const Container = styled.div`
   display: flex;
@@ -165,11 +165,9 @@ function getUnitStatus(sensorData) {
 }
 
 const Dashboard = () => {
-  const [hydroUnitsData, setHydroUnitsData] = useState({});
-  const [roomData, setRoomData] = useState({ front: null, back: null });
   const [cameraStats, setCameraStats] = useState({ total: 0, online: 0 });
   const [loading, setLoading] = useState(true);
-  const { connected } = useSocket();
+  const { connected, sensorData, roomData: liveRoomData, joinUnit, leaveUnit } = useSocket();
 
   const hydroUnits = [
     { id: 'DWC1', name: 'Deep Water Culture 1', type: 'Deep Water Culture', icon: '💧' },
@@ -179,67 +177,46 @@ const Dashboard = () => {
     { id: 'TROUGH', name: 'Trough Based System', type: 'Trough System', icon: '🔄' }
   ];
 
+  // Sensor and room readings are pushed over the WebSocket: a snapshot on
+  // join, then only the fields that change
   useEffect(() => {
-    const fetchData = async () => {
+    const rooms = ['ROOM_FRONT', 'ROOM_BACK'];
+    hydroUnits.forEach(unit => joinUnit(unit.id));
+    rooms.forEach(room => joinUnit(room));
+    return () => {
+      hydroUnits.forEach(unit => leaveUnit(unit.id));
+      rooms.forEach(room => leaveUnit(room));
+    };
+  }, [joinUnit, leaveUnit]);
+
+  const hydroUnitsData = {};
+  hydroUnits.forEach(unit => {
+    if (sensorData[unit.id]) {
+      hydroUnitsData[unit.id] = sensorData[unit.id];
+    }
+  });
+
+  const roomData = {
+    front: liveRoomData.ROOM_FRONT || null,
+    back: liveRoomData.ROOM_BACK || null
+  };
+
+  useEffect(() => {
+    const fetchSnapshot = async () => {
       try {
-        setLoading(true);
-
-        // Fetch hydro units data
-        const hydroPromises = hydroUnits.map(async (unit) => {
-          const response = await axios.get(`/units/${unit.id}/sensors`);
-          return { unitId: unit.id, data: response.data };
-        });
-
-        const hydroResults = await Promise.all(hydroPromises);
-        const hydroData = {};
-        hydroResults.forEach(({ unitId, data }) => {
-          hydroData[unitId] = data;
-        });
-        setHydroUnitsData(hydroData);
-
-        // Fetch room data
-        const [frontResponse, backResponse] = await Promise.all([
-          axios.get('/room/front/sensors'),
-          axios.get('/room/back/sensors')
-        ]);
-
-        setRoomData({
-          front: frontResponse.data,
-          back: backResponse.data
-        });
-
-        // Fetch camera statistics
-        let totalCameras = 0;
-        let onlineCameras = 0;
-
-        for (const unit of hydroUnits) {
-          try {
-            const cameraResponse = await axios.get(`/cameras/${unit.id}`);
-            const cameras = cameraResponse.data.cameras || [];
-            totalCameras += cameras.length;
-
-            // Count online cameras (images received within 5 minutes)
-            const now = Math.floor(Date.now() / 1000);
-            cameras.forEach(camera => {
-              if (camera.last_image_timestamp && (now - camera.last_image_timestamp) <= 300) {
-                onlineCameras++;
-              }
-            });
-          } catch (error) {
-            console.warn(`Error fetching cameras for ${unit.id}:`, error);
-          }
-        }
-
-        setCameraStats({ total: totalCameras, online: onlineCameras });
+        // One aggregated request; unchanged snapshots come back as 304
+        const response = await dashboardAPI.getSnapshot();
+        const cameras = response.data.cameras || {};
+        setCameraStats({ total: cameras.total || 0, online: cameras.online || 0 });
       } catch (error) {
-        console.error('Error fetching dashboard data:', error);
+        console.error('Error fetching dashboard snapshot:', error);
       } finally {
         setLoading(false);
       }
     };
 
-    fetchData();
-    const interval = setInterval(fetchData, 30000); // Refresh every 30 seconds
+    fetchSnapshot();
+    const interval = setInterval(fetchSnapshot, 30000); // Refresh every 30 seconds
 
     return () => clearInterval(interval);
   }, []);
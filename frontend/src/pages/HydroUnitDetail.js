@@ -68,7 +68,7 @@ const ErrorMessage = styled.div`
 
 const HydroUnitDetail = () => {
   const { unitId } = useParams();
-  const { joinUnit, leaveUnit } = useSocket();
+  const { joinUnit, leaveUnit, sensorData: liveSensors, relayData: liveRelays } = useSocket();
 
   const [sensorData, setSensorData] = useState(null);
   const [relayData, setRelayData] = useState(null);
@@ -106,10 +106,21 @@ const HydroUnitDetail = () => {
 
   useEffect(() => {
     fetchData();
-    const interval = setInterval(fetchData, 30000); // Refresh every 30 seconds
-    return () => clearInterval(interval);
   }, [unitId]);
 
+  // Live readings pushed to this unit's WebSocket room replace polling
+  useEffect(() => {
+    if (liveSensors[unitId]) {
+      setSensorData(liveSensors[unitId]);
+    }
+  }, [liveSensors, unitId]);
+
+  useEffect(() => {
+    if (liveRelays[unitId]) {
+      setRelayData(liveRelays[unitId]);
+    }
+  }, [liveRelays, unitId]);
+
   const handleRelayUpdate = async (relayType, newState) => {
     try {
       const updateData = { [relayType]: newState };
@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import styled from 'styled-components';
 import SensorCard from '../components/SensorCard';
 import { roomAPI, apiUtils } from '../services/api';
+import { useSocket } from '../contexts/SocketContext';
 
 const Container = styled.div`
   display: flex;
@@ -104,6 +105,7 @@ const ErrorMessage = styled.div`
 `;
 
 const RoomBack = () => {
+  const { joinUnit, leaveUnit, roomData } = useSocket();
   const [sensorData, setSensorData] = useState(null);
   const [acSchedule, setAcSchedule] = useState({});
   const [localSchedule, setLocalSchedule] = useState({});
@@ -133,10 +135,20 @@ const RoomBack = () => {
 
   useEffect(() => {
     fetchData();
-    const interval = setInterval(fetchData, 30000); // Refresh every 30 seconds
-    return () => clearInterval(interval);
   }, []);
 
+  // Live readings are pushed to the room's WebSocket room instead of polling
+  useEffect(() => {
+    joinUnit('ROOM_BACK');
+    return () => leaveUnit('ROOM_BACK');
+  }, [joinUnit, leaveUnit]);
+
+  useEffect(() => {
+    if (roomData.ROOM_BACK) {
+      setSensorData(roomData.ROOM_BACK);
+    }
+  }, [roomData]);
+
   const handleScheduleChange = (hour, temperature) => {
     setLocalSchedule(prev => ({
       ...prev,
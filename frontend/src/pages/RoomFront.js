@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import styled from 'styled-components';
 import SensorCard from '../components/SensorCard';
 import { roomAPI, apiUtils } from '../services/api';
+import { useSocket } from '../contexts/SocketContext';
 
 const Container = styled.div`
   display: flex;
@@ -42,6 +43,7 @@ const ErrorMessage = styled.div`
 `;
 
 const RoomFront = () => {
+  const { joinUnit, leaveUnit, roomData } = useSocket();
   const [sensorData, setSensorData] = useState(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
@@ -62,10 +64,20 @@ const RoomFront = () => {
 
   useEffect(() => {
     fetchData();
-    const interval = setInterval(fetchData, 30000); // Refresh every 30 seconds
-    return () => clearInterval(interval);
   }, []);
 
+  // Live readings are pushed to the room's WebSocket room instead of polling
+  useEffect(() => {
+    joinUnit('ROOM_FRONT');
+    return () => leaveUnit('ROOM_FRONT');
+  }, [joinUnit, leaveUnit]);
+
+  useEffect(() => {
+    if (roomData.ROOM_FRONT) {
+      setSensorData(roomData.ROOM_FRONT);
+    }
+  }, [roomData]);
+
   if (loading) {
     return <LoadingMessage>Loading front room data...</LoadingMessage>;
   }
@@ -36,7 +36,7 @@ api.interceptors.response.use(
 // Hydro Units API
 export const hydroUnitsAPI = {
   // Get sensor data for a unit
-  getSensors: (unitId) => api.get(`/units/${unitId}/sensors`),
+  getSensors: (unitId) => api.get(`/units/${unitId}/sensors-data`),
 
   // Get relay states for a unit
   getRelays: (unitId) => api.get(`/units/${unitId}/relays`),
@@ -49,6 +49,9 @@ export const hydroUnitsAPI = {
 
   // Update schedule for a unit
   updateSchedule: (unitId, scheduleData) => api.post(`/units/${unitId}/schedule`, scheduleData),
+
+  // Get downsampled history of one metric
+  getHistory: (unitId, metric, params = {}) => api.get(`/units/${unitId}/history`, { params: { metric, ...params } }),
 };
 
 // Room Monitoring API
@@ -64,6 +67,9 @@ export const roomAPI = {
 
   // Update AC schedule
   updateACSchedule: (scheduleData) => api.post('/room/back/ac_schedule', scheduleData),
+
+  // Get downsampled history of one metric ('front' or 'back')
+  getHistory: (room, metric, params = {}) => api.get(`/room/${room}/history`, { params: { metric, ...params } }),
 };
 
 // Camera API
@@ -89,6 +95,12 @@ export const cameraAPI = {
   getLatestImages: (unitId) => api.get(`/units/${unitId}/cameras/latest`),
 };
 
+// Dashboard API
+export const dashboardAPI = {
+  // Get units, relays, schedules, rooms and camera summary in one response
+  getSnapshot: () => api.get('/dashboard/snapshot'),
+};
+
 // Utility functions
 export const apiUtils = {
   // Handle API errors